@@ -5,6 +5,15 @@ from effis.composition.workflow import SubWorkflow
 # Application interface
 from effis.composition.application import Application
 
+# Data-triggered dependencies
+from effis.composition.artifact import Artifact
+
+# Shared-memory data channels between (Python) Applications
+from effis.composition.channels import Publish, Allocate, Channel
+
+# Application run history (for estimates)
+from effis.composition.history import History
+
 # Globus interface
 from effis.composition.util import Input
 from effis.composition.backup import Destination
@@ -0,0 +1,537 @@
+"""
+effis.composition.agents
+"""
+
+import os
+import sys
+import glob
+import json
+import hmac
+import time
+import shutil
+import signal
+import socket
+import secrets
+import itertools
+import subprocess
+
+from effis.composition.events import EventLoop
+from effis.composition.launcher import Failed
+from effis.composition.resources import LocalGPUs
+from effis.composition.log import CompositionLogger
+
+
+#: Seconds to wait for every agent to start listening
+StartTimeout = 60
+
+#: Seconds a new connection to an agent has to present the token before it's dropped
+HelloTimeout = 10
+
+# Variables that pick the GPUs a process sees (NVIDIA, AMD)
+GPUVariables = ("CUDA_VISIBLE_DEVICES", "ROCR_VISIBLE_DEVICES", "HIP_VISIBLE_DEVICES")
+
+
+def Send(sock, message):
+    sock.sendall((json.dumps(message) + "\n").encode())
+
+
+def Receive(sock, buffer):
+    """
+    Messages that have fully arrived on sock (and what's left of the next one); messages is None once the other end has hung up
+    """
+    try:
+        data = sock.recv(1 << 16)
+    except BlockingIOError:
+        return [], buffer
+    except OSError:
+        data = b""
+    if len(data) == 0:
+        return None, buffer
+    lines = (buffer + data).split(b"\n")
+    return [json.loads(line) for line in lines[:-1] if len(line) > 0], lines[-1]
+
+
+def Connected(sock):
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    return sock
+
+
+def NodeAddress():
+    """
+    This node's own address (what its hostname resolves to, rather than loopback if there's a choice); "" if it can't be looked up
+    """
+    try:
+        addresses = [info[4][0] for info in socket.getaddrinfo(socket.gethostname(), None, socket.AF_INET, socket.SOCK_STREAM)]
+    except OSError:
+        return ""
+    for address in addresses:
+        if not address.startswith("127."):
+            return address
+    return addresses[0] if len(addresses) > 0 else ""
+
+
+def VisibleGPUs():
+    for name in GPUVariables:
+        if (name in os.environ) and (os.environ[name].strip() != ""):
+            return os.environ[name].split(",")
+    return []
+
+
+class Agent:
+    """
+    Lives on one node for the whole allocation: starts the tasks a scheduler sends it, bound to cores/GPUs of its own choosing,
+    and reports back when they exit. Once the scheduler hangs up, it kills whatever is still running and exits.
+    """
+
+    def __init__(self, directory, node, token, host=None, cores=None, gpus=None):
+        self.loop = EventLoop()
+        self.Directory = directory
+        self.Node = node
+        self.Token = token
+
+        self.Affinity = None
+        if 'sched_getaffinity' in dir(os):
+            self.Affinity = sorted(os.sched_getaffinity(0))
+        self.Cores = cores if cores is not None else (self.Affinity if self.Affinity is not None else [])
+        self.GPUs = gpus if gpus is not None else VisibleGPUs()
+        self.FreeCores = list(self.Cores)
+        self.FreeGPUs = list(self.GPUs)
+
+        self.Tasks = {}
+        self.Client = None
+        self.Buffer = b""
+        self.Done = False
+
+        # Connections that haven't shown the token yet: [socket, buffer, timer], by file descriptor
+        self.Pending = {}
+
+        if host is None:
+            host = NodeAddress()
+            if host == "":
+                CompositionLogger.Warning("Agent for node {0}: couldn't look up this node's address; listening on all interfaces".format(self.Node))
+        self.Socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.Socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.Socket.bind((host, 0))
+        self.Socket.listen()
+        self.loop.Reader(self.Socket.fileno(), self.Accept)
+
+        # Registered once listening; written whole, so the scheduler never reads half of it
+        self.Registration = os.path.join(self.Directory, "agent.{0}.json".format(self.Node))
+        registration = {
+            'host': host if host != "" else socket.gethostname(),
+            'port': self.Socket.getsockname()[1],
+            'hostname': socket.gethostname(),
+            'pid': os.getpid(),
+            'cores': self.Cores,
+            'gpus': self.GPUs,
+        }
+        with open(self.Registration + ".tmp", "w") as outfile:
+            json.dump(registration, outfile)
+        os.replace(self.Registration + ".tmp", self.Registration)
+
+
+    def Accept(self):
+        try:
+            conn, peer = self.Socket.accept()
+        except (BlockingIOError, OSError):
+            return
+        if self.Client is not None:
+            conn.close()
+            return
+        # Only the scheduler (with the token) gets to be the client; until then, others can still connect
+        conn.setblocking(False)
+        fd = conn.fileno()
+        self.Pending[fd] = [conn, b"", self.loop.Later(HelloTimeout, self.Drop, fd)]
+        self.loop.Reader(fd, lambda: self.Hello(fd))
+
+
+    def Hello(self, fd):
+        conn, buffer, timer = self.Pending[fd]
+        try:
+            messages, buffer = Receive(conn, buffer)
+            if (messages is not None) and (len(messages) > 0):
+                hello = messages[0]
+                authorized = (hello['op'] == "hello") and hmac.compare_digest(str(hello.get('token', "")), self.Token)
+        except (ValueError, TypeError, KeyError, AttributeError):
+            # Not even our protocol
+            messages, authorized = None, False
+        self.Pending[fd][1] = buffer
+        if messages is None:
+            self.Drop(fd)
+            return
+        elif len(messages) == 0:
+            return
+
+        if (self.Client is not None) or (not authorized):
+            # Not our scheduler
+            self.Drop(fd)
+            return
+
+        del self.Pending[fd]
+        timer.Cancel()
+        self.loop.Remove(fd)
+        conn.setblocking(True)
+        self.Client = Connected(conn)
+        self.Buffer = buffer
+        self.loop.Reader(fd, self.Readable)
+        for message in messages[1:]:
+            self.Handle(message)
+
+
+    def Drop(self, fd):
+        if fd not in self.Pending:
+            return
+        conn, buffer, timer = self.Pending.pop(fd)
+        timer.Cancel()
+        self.loop.Remove(fd)
+        conn.close()
+
+
+    def Readable(self):
+        messages, self.Buffer = Receive(self.Client, self.Buffer)
+        if messages is None:
+            self.Done = True
+            return
+        for message in messages:
+            self.Handle(message)
+
+
+    def Handle(self, message):
+        if message['op'] == "launch":
+            self.Launch(message)
+        elif message['op'] == "signal":
+            if message['id'] in self.Tasks:
+                self.Tasks[message['id']][0].send_signal(message['signal'])
+        elif message['op'] == "shutdown":
+            self.Done = True
+
+
+    @staticmethod
+    def Take(free, every, count):
+        # The scheduler's accounting says there's room; if this node has fewer than it was told, share
+        taken = free[:count]
+        del free[:count]
+        if (len(taken) < count) and (len(every) > 0):
+            taken += [every[i % len(every)] for i in range(count - len(taken))]
+        return taken
+
+
+    @staticmethod
+    def Give(free, every, taken):
+        free += [item for item in taken if item not in free]
+        free.sort(key=every.index)
+
+
+    def Launch(self, message):
+        cores = self.Take(self.FreeCores, self.Cores, message['cores'])
+        gpus = self.Take(self.FreeGPUs, self.GPUs, message['gpus'])
+
+        environment = dict(message['env'])
+        if len(self.GPUs) > 0:
+            for name in GPUVariables:
+                environment[name] = ",".join([str(gpu) for gpu in gpus])
+
+        stdout = None
+        try:
+            if message['log'] is not None:
+                stdout = open(message['log'], 'a' if message['append'] else 'w')
+            # Children inherit the affinity they're forked with (the agent does one thing at a time, so it can lend it its own)
+            if (self.Affinity is not None) and (len(cores) > 0):
+                os.sched_setaffinity(0, cores)
+            proc = subprocess.Popen(message['argv'], cwd=message['cwd'], stdin=subprocess.DEVNULL, stdout=stdout, stderr=stdout, env=environment)
+        except Exception as e:
+            self.Give(self.FreeCores, self.Cores, cores)
+            self.Give(self.FreeGPUs, self.GPUs, gpus)
+            Send(self.Client, {'id': message['id'], 'event': "started", 'error': str(e)})
+            return
+        finally:
+            if (self.Affinity is not None) and (len(cores) > 0):
+                os.sched_setaffinity(0, self.Affinity)
+            if stdout is not None:
+                stdout.close()
+
+        self.Tasks[message['id']] = (proc, cores, gpus)
+        Send(self.Client, {'id': message['id'], 'event': "started", 'pid': proc.pid, 'cores': cores, 'gpus': gpus})
+        self.loop.WatchProcess(proc, lambda proc, task=message['id']: self.Exited(task, proc))
+
+
+    def Exited(self, task, proc):
+        proc, cores, gpus = self.Tasks.pop(task)
+        self.Give(self.FreeCores, self.Cores, cores)
+        self.Give(self.FreeGPUs, self.GPUs, gpus)
+        if self.Client is not None:
+            try:
+                Send(self.Client, {'id': task, 'event': "exit", 'status': proc.returncode})
+            except OSError:
+                self.Done = True
+
+
+    def Run(self):
+        try:
+            while not self.Done:
+                self.loop.RunOnce()
+        finally:
+            self.Close()
+
+
+    def Close(self):
+        for proc, cores, gpus in self.Tasks.values():
+            proc.kill()
+            proc.wait()
+        self.Tasks = {}
+        for fd in list(self.Pending):
+            self.Drop(fd)
+        if os.path.exists(self.Registration):
+            os.remove(self.Registration)
+        if self.Client is not None:
+            self.Client.close()
+        self.Socket.close()
+        self.loop.Close()
+
+
+def Serve(directory, node=None, host=None, cores=None, gpus=None):
+    """
+    Run an agent until its scheduler is through with it (node defaults to the Slurm node index)
+    """
+    if node is None:
+        node = int(os.environ.get("SLURM_NODEID", 0))
+    if "EFFIS_AGENT_TOKEN" not in os.environ:
+        CompositionLogger.RaiseError(RuntimeError, "EFFIS_AGENT_TOKEN isn't set; agents are started by the Workflow's scheduler")
+    agent = Agent(directory, node, os.environ["EFFIS_AGENT_TOKEN"], host=host, cores=cores, gpus=gpus)
+    CompositionLogger.Info("Agent for node {0} (pid {1}) listening on port {2}".format(node, os.getpid(), agent.Socket.getsockname()[1]))
+    agent.Run()
+
+
+class AgentProcess:
+    """
+    Stands in for the subprocess.Popen of an Application an agent started on its node
+    """
+
+    def __init__(self, node, task):
+        self.node = node
+        self.task = task
+        self.remote = None
+        self.callback = None
+        self.returncode = None
+
+
+    @property
+    def pid(self):
+        # Only meaningful (e.g. for memory sampling) on this node
+        if self.node.Local:
+            return self.remote
+        return None
+
+
+    def Watch(self, callback):
+        self.callback = callback
+
+
+    def Finish(self, returncode):
+        self.returncode = returncode
+        if self.callback is not None:
+            self.callback()
+
+
+    def terminate(self):
+        self.node.Signal(self.task, signal.SIGTERM)
+
+
+    def kill(self):
+        self.node.Signal(self.task, signal.SIGKILL)
+
+
+class Node:
+    """
+    Scheduler's connection to the agent of one node
+    """
+
+    def __init__(self, agents, index, registration):
+        self.agents = agents
+        self.Index = index
+        self.Local = (registration['hostname'] == socket.gethostname())
+        self.Tasks = {}
+        self.Buffer = b""
+        self.Socket = Connected(socket.create_connection((registration['host'], registration['port']), timeout=StartTimeout))
+        self.Socket.settimeout(None)
+        Send(self.Socket, {'op': "hello", 'token': self.agents.Token})
+        self.agents.loop.Reader(self.Socket.fileno(), self.Readable)
+
+
+    def Launch(self, task, message, started):
+        proc = AgentProcess(self, task)
+        self.Tasks[task] = (proc, started)
+        try:
+            Send(self.Socket, {'op': "launch", 'id': task, **message})
+        except OSError:
+            self.Lost()
+
+
+    def Signal(self, task, signum):
+        if task in self.Tasks:
+            try:
+                Send(self.Socket, {'op': "signal", 'id': task, 'signal': int(signum)})
+            except OSError:
+                self.Lost()
+
+
+    def Readable(self):
+        messages, self.Buffer = Receive(self.Socket, self.Buffer)
+        if messages is None:
+            self.Lost()
+            return
+        for message in messages:
+            if message['id'] not in self.Tasks:
+                continue
+            proc, started = self.Tasks[message['id']]
+            if message['event'] == "started":
+                self.Tasks[message['id']] = (proc, None)
+                if 'error' in message:
+                    del self.Tasks[message['id']]
+                    CompositionLogger.Warning("Agent on node {0} couldn't start task: {1}".format(self.Index, message['error']))
+                    started(Failed())
+                else:
+                    proc.remote = message['pid']
+                    started(proc)
+            elif message['event'] == "exit":
+                del self.Tasks[message['id']]
+                proc.Finish(message['status'])
+
+
+    def Lost(self):
+        """
+        The agent is gone; so is everything it was running
+        """
+        if self.Socket is None:
+            return
+        CompositionLogger.Warning("Lost the agent on node {0}".format(self.Index))
+        self.Close()
+        tasks, self.Tasks = self.Tasks, {}
+        for proc, started in tasks.values():
+            if started is not None:
+                started(Failed())
+            else:
+                proc.Finish(-signal.SIGKILL)
+
+
+    def Close(self):
+        if self.Socket is None:
+            return
+        self.agents.loop.Remove(self.Socket.fileno())
+        try:
+            Send(self.Socket, {'op': "shutdown"})
+        except OSError:
+            pass
+        self.Socket.close()
+        self.Socket = None
+
+
+class Agents:
+    """
+    One long-lived agent per node for a scheduler's Applications, so starting one is a message to its node's agent
+    (which forks/execs it, bound to cores/GPUs there) instead of a job step of its own at slurmctld.
+    In a Slurm allocation they're started with a single srun; otherwise they're local processes, each standing in for one node of the resources.
+    """
+
+    def __init__(self, loop, resources, directory):
+        self.loop = loop
+        self.Resources = resources
+        self.Directory = directory
+        self.Token = secrets.token_hex(16)
+        self.Counter = itertools.count()
+        self.Procs = []
+        self.Nodes = {}
+
+
+    def Commands(self):
+        """
+        Command line(s) starting the agents
+        """
+        agent = [sys.executable, "-m", "effis.runtime.EffisAgent", "--directory", self.Directory]
+        nodes = self.Resources['Nodes']
+
+        if ("SLURM_JOB_ID" in os.environ) and (shutil.which("srun") is not None):
+            cmd = [
+                "srun", "--nodes={0}".format(nodes), "--ntasks={0}".format(nodes), "--ntasks-per-node=1",
+                "--cpus-per-task={0}".format(self.Resources['CoresPerNode']), "--cpu-bind=none", "--overlap",
+            ]
+            if self.Resources['GPUsPerNode'] > 0:
+                cmd += ["--gpus-per-task={0}".format(self.Resources['GPUsPerNode'])]
+            return [cmd + agent]
+
+        # Outside an allocation: split this machine's cores (and GPUs) between the pretend nodes
+        local = list(range(os.cpu_count()))
+        if 'sched_getaffinity' in dir(os):
+            local = sorted(os.sched_getaffinity(0))
+        gpus = VisibleGPUs()
+        if len(gpus) == 0:
+            gpus = [str(i) for i in range(LocalGPUs())]
+
+        commands = []
+        for i in range(nodes):
+            C = self.Resources['CoresPerNode']
+            G = self.Resources['GPUsPerNode']
+            cmd = agent + ["--node", str(i), "--host", "127.0.0.1"]
+            cmd += ["--cores", ",".join([str(local[(i * C + j) % len(local)]) for j in range(C)])]
+            if (G > 0) and (len(gpus) > 0):
+                cmd += ["--gpus", ",".join([gpus[(i * G + j) % len(gpus)] for j in range(G)])]
+            commands += [cmd]
+        return commands
+
+
+    def Start(self):
+        """
+        Start the agents and connect to each one (waiting until they're all listening)
+        """
+        if not os.path.exists(self.Directory):
+            os.makedirs(self.Directory)
+        for filename in glob.glob(os.path.join(self.Directory, "agent.*.json")):
+            os.remove(filename)
+
+        environment = {**os.environ, 'EFFIS_AGENT_TOKEN': self.Token}
+        with open(os.path.join(self.Directory, "agents.log"), "a") as log:
+            for cmd in self.Commands():
+                self.Procs += [subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=log, stderr=subprocess.STDOUT, env=environment)]
+        CompositionLogger.Info("Starting {0} agent(s), registering in {1}".format(self.Resources['Nodes'], self.Directory))
+
+        start = time.monotonic()
+        for i in range(self.Resources['Nodes']):
+            registration = os.path.join(self.Directory, "agent.{0}.json".format(i))
+            while not os.path.exists(registration):
+                if any([proc.poll() is not None for proc in self.Procs]):
+                    CompositionLogger.RaiseError(RuntimeError, "An agent exited while starting; see {0}".format(os.path.join(self.Directory, "agents.log")))
+                if time.monotonic() - start > StartTimeout:
+                    CompositionLogger.RaiseError(RuntimeError, "Agent for node {0} didn't start listening within {1} s".format(i, StartTimeout))
+                time.sleep(0.05)
+            with open(registration, "r") as infile:
+                self.Nodes[i] = Node(self, i, json.load(infile))
+
+
+    def Submit(self, node, cores, gpus, argv, directory, environment, logfile, append, started):
+        """
+        Have node's agent start argv; started(proc) is called (in the loop) once it has (with a Failed proc if it couldn't)
+        """
+        if (node not in self.Nodes) or (self.Nodes[node].Socket is None):
+            self.loop.Call(started, Failed())
+            return
+        message = {
+            'argv': argv,
+            'cwd': directory,
+            'env': environment,
+            'log': logfile,
+            'append': append,
+            'cores': cores,
+            'gpus': gpus,
+        }
+        self.Nodes[node].Launch(next(self.Counter), message, started)
+
+
+    def Close(self):
+        for node in self.Nodes.values():
+            node.Close()
+        for proc in self.Procs:
+            try:
+                proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+                proc.wait()
@@ -5,6 +5,8 @@ effis.composition.application
 from effis.composition.runner import Detected, UseRunner
 from effis.composition.log import CompositionLogger
 from effis.composition.util import ListType, Arguments, InputList
+from effis.composition.resources import MemoryMB
+from effis.composition.artifact import Artifact
 
 
 class Application(UseRunner):
@@ -34,7 +36,7 @@ class Application(UseRunner):
     #: Set environment variables with Python dictionary (instead of setup file); Not implemented yet
     Environment = {}
 
-    #: This application depends on others finishing
+    #: This application depends on others finishing (or on data showing up, with Artifact)
     DependsOn = []
 
     #: Input files to copy for the Application
@@ -45,6 +47,41 @@ class Application(UseRunner):
     #: Lets set a max running for the group
     Group = None
 
+    #: Expected runtime in seconds, used to prioritize the longest dependency chains
+    EstimatedRuntime = None
+
+    #: Memory needed on each node used, in MB or with a K/M/G/T suffix (like --mem); the scheduler won't overcommit a node's memory
+    Memory = None
+
+    #: Seconds the Application may run before it's terminated (SIGTERM, then SIGKILL after the Workflow's KillGrace); None uses the Workflow's Timeout
+    Timeout = None
+
+    #: How many more times to run the Application if it fails
+    Retries = 0
+
+    #: Seconds to wait before the first retry, doubling with each one after
+    RetryBackoff = 0
+
+    #: Only retry for these exit statuses (and/or "TIMEOUT"); empty retries any failure
+    RetryOn = []
+
+    #: Python callable to run instead of cmd, in the scheduler's warm worker pool (see Workflow.Preload); what it returns is kept as Result.
+    #: It runs in the Application's Directory, with its Environment and LogFile; an exception counts as a failure (exit status 1). Use Runner=None.
+    Function = None
+
+    #: Positional arguments for Function
+    Args = []
+
+    #: Keyword arguments for Function
+    Kwargs = {}
+
+    #: Names of the shared-memory channels the Application publishes (effis.composition.Publish/Allocate) for the ones depending on it;
+    #: each is freed once all of those have finished
+    Publishes = []
+
+    #: Set False for an Application that must always run (e.g. it does something outside of its Directory), even with the Workflow's Cache
+    Cache = True
+
 
     @classmethod
     def CheckApplications(cls, other):
@@ -80,13 +117,35 @@ class Application(UseRunner):
             CompositionLogger.RaiseError(AttributeError, "{0} should be set as a string".format(name))
         if (name in ("Environment")) and (type(value) is not dict):
             CompositionLogger.RaiseError(ValueError, "{0} should be set as a dictionary".format(name))
+        if (name == "Retries") and ((type(value) is not int) or (value < 0)):
+            CompositionLogger.RaiseError(ValueError, "{0} should be set as a non-negative integer".format(name))
+        if (name == "RetryOn") and ((type(value) is not list) or any([(type(code) is not int) and (code != "TIMEOUT") for code in value])):
+            CompositionLogger.RaiseError(ValueError, "{0} should be set as a list of exit statuses (integers and/or \"TIMEOUT\")".format(name))
+        if (name in ("EstimatedRuntime", "Timeout", "RetryBackoff")) and (value is not None) and ((not isinstance(value, (int, float))) or isinstance(value, bool) or (value < 0)):
+            CompositionLogger.RaiseError(ValueError, "{0} should be set as a non-negative number (of seconds)".format(name))
+        if (name == "Memory") and (value is not None):
+            MemoryMB(value)
+        if (name == "Function") and (value is not None) and (not callable(value)):
+            CompositionLogger.RaiseError(ValueError, "{0} should be set as a Python callable".format(name))
+        if (name == "Args") and (type(value) not in (list, tuple)):
+            CompositionLogger.RaiseError(ValueError, "{0} should be set as a list".format(name))
+        if (name == "Publishes") and ((type(value) is not list) or any([(type(channel) is not str) or ("/" in channel) for channel in value])):
+            CompositionLogger.RaiseError(ValueError, "{0} should be set as a list of channel names (without /)".format(name))
+        if (name == "Cache") and (type(value) is not bool):
+            CompositionLogger.RaiseError(ValueError, "{0} should be set as a boolean".format(name))
+        if (name == "Kwargs") and (type(value) is not dict):
+            CompositionLogger.RaiseError(ValueError, "{0} should be set as a dictionary".format(name))
 
         if name in ["CommandLineArguments", "MPIRunnerArguments"]:
             super(UseRunner, self).__setattr__(name, Arguments(value, key=name))
         elif name in ("Input", "SetupFile"):
             super(UseRunner, self).__setattr__(name, InputList(value, key=name))
         elif (name == "DependsOn"):
-            super(UseRunner, self).__setattr__(name, ListType(value, Application, key=name))
+            super(UseRunner, self).__setattr__(name, ListType(value, (Application, Artifact), key=name))
         else:
             super(UseRunner, self).__setattr__(name, value)
 
+        # cmd names the Function for History, estimates, and the default Name
+        if (name == "Function") and (value is not None) and (self.cmd is None):
+            super(UseRunner, self).__setattr__("cmd", "{0}.{1}".format(getattr(value, "__module__", None), getattr(value, "__qualname__", type(value).__name__)))
+
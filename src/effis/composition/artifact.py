@@ -0,0 +1,210 @@
+"""
+effis.composition.artifact
+"""
+
+import os
+import stat
+import ctypes
+import ctypes.util
+
+from effis.composition.log import CompositionLogger
+
+try:
+    import adios2
+except ImportError:
+    adios2 = None
+
+
+def BPSteps(path):
+    """
+    Number of steps written to an ADIOS BP file so far
+    """
+    if not os.path.exists(path):
+        return 0
+    try:
+        with adios2.FileReader(path) as reader:
+            return reader.num_steps()
+    except Exception:
+        # Not readable yet (e.g. the writer hasn't finished its first step)
+        return 0
+
+
+class Artifact:
+    """
+    A dependency on data instead of on a process: satisfied once path exists
+    (and is at least size bytes, modified at or after mtime (seconds since the epoch), and/or has at least steps BP steps).
+    Relative paths are relative to the Workflow's Directory; directories (like BP files) count everything inside them.
+    Once nothing in the Workflow is running (or about to) that could still write it, it's waited for timeout more seconds
+    and then given up on, cancelling what depends on it; timeout=None waits regardless (e.g. for data from outside the Workflow).
+    """
+
+    def __init__(self, path, size=None, mtime=None, steps=None, timeout=0):
+
+        if type(path) is not str:
+            CompositionLogger.RaiseError(ValueError, "Invalid Artifact path={0} --> Must be a string (path)".format(str(path)))
+        for key, value in (('size', size), ('mtime', mtime), ('steps', steps), ('timeout', timeout)):
+            if (value is not None) and ((not isinstance(value, (int, float))) or isinstance(value, bool) or (value < 0)):
+                CompositionLogger.RaiseError(ValueError, "Invalid assignment: {0} attribute of Artifact is set as a non-negative number -- gave {1}".format(key, str(value)))
+        if (steps is not None) and (adios2 is None):
+            CompositionLogger.RaiseError(ImportError, "Artifact steps={0} needs the adios2 Python module to count BP steps".format(steps))
+
+        self.path = path
+        self.size = size
+        self.mtime = mtime
+        self.steps = steps
+        self.timeout = timeout
+
+
+    def Resolve(self, directory):
+        return os.path.join(directory, os.path.expanduser(self.path))
+
+
+    def Satisfied(self, path):
+
+        if not os.path.exists(path):
+            return False
+
+        if (self.size is not None) or (self.mtime is not None):
+            files = [path]
+            if os.path.isdir(path):
+                for root, dirs, names in os.walk(path):
+                    files += [os.path.join(root, name) for name in names]
+            size, mtime = 0, 0
+            for name in files:
+                try:
+                    info = os.stat(name)
+                except OSError:
+                    continue
+                if not stat.S_ISDIR(info.st_mode):
+                    size += info.st_size
+                mtime = max(mtime, info.st_mtime)
+            if (self.size is not None) and (size < self.size):
+                return False
+            if (self.mtime is not None) and (mtime < self.mtime):
+                return False
+
+        if (self.steps is not None) and (BPSteps(path) < self.steps):
+            return False
+
+        return True
+
+
+def Inotify():
+    """
+    Non-blocking inotify file descriptor (None where there isn't inotify)
+    """
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+    except (OSError, AttributeError):
+        return None, None
+    if fd < 0:
+        return None, None
+    return libc, fd
+
+
+class Watcher:
+    """
+    Calls back when Artifacts are satisfied.
+    Directories on the way to each path are watched with inotify, and conditions are only checked after something changes in them;
+    without inotify, they're polled.
+    """
+
+    # inotify: IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+    Mask = 0x2 | 0x4 | 0x8 | 0x80 | 0x100
+
+    #: Seconds to let a burst of file events settle before checking
+    Debounce = 0.05
+
+    #: Seconds between checks without inotify
+    PollInterval = 1.0
+
+    #: Seconds between checks with inotify anyway -- it doesn't see writes from other nodes to a parallel file system
+    SafetyInterval = 10.0
+
+
+    def __init__(self, loop, directory):
+        self.loop = loop
+        self.Directory = directory
+        self.Pending = []
+        self.Watched = set()
+        self.Timer = None
+        self.Soon = False
+
+        self.libc, self.fd = Inotify()
+        if self.fd is not None:
+            self.loop.Reader(self.fd, self.Event)
+        else:
+            CompositionLogger.Debug("No inotify; polling for Artifacts every {0} s".format(self.PollInterval))
+
+
+    def Add(self, artifact, callback):
+        path = artifact.Resolve(self.Directory)
+        if artifact.Satisfied(path):
+            self.loop.Call(callback)
+            return
+        self.Pending += [(artifact, path, callback)]
+        self.Watch(path)
+        if self.Timer is None:
+            self.Later()
+
+
+    def Watch(self, path):
+        if self.fd is None:
+            return
+        targets = []
+        if os.path.isdir(path):
+            targets += [path]
+        parent = os.path.dirname(path)
+        while (not os.path.isdir(parent)) and (parent != os.path.dirname(parent)):
+            parent = os.path.dirname(parent)
+        targets += [parent]
+        for target in targets:
+            if (target not in self.Watched) and (self.libc.inotify_add_watch(self.fd, target.encode(), self.Mask) >= 0):
+                self.Watched.add(target)
+
+
+    def Later(self):
+        if self.Timer is not None:
+            self.Timer.Cancel()
+        self.Soon = False
+        if len(self.Pending) > 0:
+            self.Timer = self.loop.Later(self.PollInterval if self.fd is None else self.SafetyInterval, self.Check)
+        else:
+            self.Timer = None
+
+
+    def Event(self):
+        try:
+            while os.read(self.fd, 65536):
+                pass
+        except (BlockingIOError, OSError):
+            pass
+        if not self.Soon:
+            if self.Timer is not None:
+                self.Timer.Cancel()
+            self.Soon = True
+            self.Timer = self.loop.Later(self.Debounce, self.Check)
+
+
+    def Check(self):
+        self.Timer = None
+        pending = []
+        for artifact, path, callback in self.Pending:
+            if artifact.Satisfied(path):
+                callback()
+            else:
+                pending += [(artifact, path, callback)]
+                # New directories on the way may have been created
+                self.Watch(path)
+        self.Pending = pending
+        self.Later()
+
+
+    def Close(self):
+        if self.Timer is not None:
+            self.Timer.Cancel()
+        if self.fd is not None:
+            self.loop.Remove(self.fd)
+            os.close(self.fd)
+            self.fd = None
@@ -0,0 +1,351 @@
+"""
+effis.composition.cache
+"""
+
+import os
+import json
+import time
+import shutil
+import sqlite3
+import hashlib
+import tempfile
+import threading
+import concurrent.futures
+import dill as pickle
+
+from effis.composition.application import Application
+from effis.composition.resources import MemoryMB
+from effis.composition.log import CompositionLogger
+
+
+def HashPath(digest, path, exclude=()):
+    """
+    Add the contents of path (a file, or everything in a directory but exclude) to digest
+    """
+    if os.path.isdir(path):
+        for root, dirs, files in os.walk(path):
+            dirs[:] = sorted([d for d in dirs if os.path.join(root, d) not in exclude])
+            for name in sorted(files):
+                filename = os.path.join(root, name)
+                if filename in exclude:
+                    continue
+                digest.update(os.path.relpath(filename, path).encode())
+                HashPath(digest, filename)
+    elif os.path.exists(path):
+        with open(path, 'rb') as infile:
+            for block in iter(lambda: infile.read(1 << 20), b""):
+                digest.update(block)
+    else:
+        digest.update(b"\0missing")
+
+
+def Inputs(app):
+    """
+    What effis itself put in app's Directory (copied SetupFiles and Inputs, the wrapper script), as opposed to what app wrote
+    """
+    return [item.outpath for item in list(app.SetupFile) + list(app.Input)] + [os.path.join(app.Directory, "{0}.sh".format(app.Name))]
+
+
+class Cached:
+    """
+    Stands in for the subprocess.Popen of an Application whose result came out of the cache (it finished right away, successfully)
+    """
+    returncode = 0
+    pid = None
+
+    def __init__(self, result=None):
+        self.Result = result
+
+    def terminate(self):
+        pass
+
+    def kill(self):
+        pass
+
+
+class Cache:
+    """
+    Results of earlier runs of Applications: what each left in its Directory (and a Function's return value),
+    keyed by a hash of its command, arguments, Environment and Input/SetupFile contents -- and of what the Applications it depends on
+    produced: their own key if they have one, else what they wrote in their Directory (not their log, or what effis put there),
+    so anything different upstream is a miss downstream.
+    An index (SQLite) next to the entries keeps sizes, last use and hit/miss counts, for Stats() and Evict().
+    The index is written with a rollback journal, so the cache directory can be shared between nodes.
+    """
+
+    DefaultPath = os.path.join(os.path.expanduser("~"), ".effis", "cache")
+
+
+    def __init__(self, path=None, size=None, age=None):
+        if path is None:
+            path = os.environ.get("EFFIS_CACHE", self.DefaultPath)
+        self.Path = os.path.abspath(os.path.expanduser(path))
+
+        # Most it's allowed to hold (MB, or with a K/M/G/T suffix), and how long (seconds) an entry is kept after its last use
+        self.Size = MemoryMB(size)
+        self.Age = age
+
+        if not os.path.exists(self.Path):
+            os.makedirs(self.Path)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(os.path.join(self.Path, "index.sqlite"), timeout=30, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=DELETE")
+        self.db.execute("CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, name TEXT, cmd TEXT, size INTEGER, created REAL, used REAL, hits INTEGER)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER)")
+        self.db.commit()
+
+        # Hashing, and copying outputs in and out, happen in a thread, so a big one doesn't hold up the scheduler
+        self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="effis-cache")
+
+
+    def Key(self, app, directory=None):
+        """
+        Content hash of app, once the Applications it depends on have finished; directory (the Workflow's) resolves Artifact paths.
+        None if it can't be hashed (e.g. a Function that doesn't pickle, or an upstream Application without a Directory of its own),
+        and so isn't cached.
+        """
+        digest = hashlib.sha256()
+        options = {}
+        if app.Runner is not None:
+            for option in app.Runner.options:
+                if getattr(app, option) is not None:
+                    options[option] = str(getattr(app, option))
+        digest.update(json.dumps([
+            app.cmd,
+            list(app.CommandLineArguments.List),
+            list(app.MPIRunnerArguments.List),
+            sorted(app.Environment.items()),
+            options,
+        ]).encode())
+
+        if app.Function is not None:
+            try:
+                digest.update(pickle.dumps((app.Function, list(app.Args), dict(app.Kwargs)), recurse=True))
+            except Exception as e:
+                CompositionLogger.Warning("Application Name = {0} -- Not cached, its Function can't be hashed: {1}".format(app.Name, e))
+                return None
+
+        setup = list(app.UpstreamSetupFile) if "UpstreamSetupFile" in app.__dir__() else []
+        for item in setup + list(app.SetupFile) + list(app.Input):
+            digest.update(os.path.basename(item.outpath).encode())
+            HashPath(digest, item.outpath)
+
+        for dep in app.DependsOn:
+            if isinstance(dep, Application):
+                if dep.__dict__.get('CacheKey') is not None:
+                    # Same key, same outputs
+                    digest.update(b"\0upstream key" + dep.CacheKey.encode())
+                    continue
+                if (dep.Directory is None) or (dep.Directory == directory):
+                    # Can't tell its outputs from everything else's
+                    return None
+                exclude = set(Inputs(dep))
+                if dep.LogFile is not None:
+                    # Timings, hostnames, ... differ from run to run
+                    exclude.add(os.path.join(dep.Directory, dep.LogFile))
+                digest.update(b"\0upstream")
+                HashPath(digest, dep.Directory, exclude=exclude)
+                if (dep.Function is not None) and ('Result' in dep.__dir__()):
+                    try:
+                        digest.update(pickle.dumps(dep.Result, recurse=True))
+                    except Exception:
+                        return None
+            else:
+                path = dep.Resolve(directory if directory is not None else os.getcwd())
+                digest.update(path.encode())
+                HashPath(digest, path)
+
+        return digest.hexdigest()
+
+
+    def Lookup(self, app, directory, callback, link=False):
+        """
+        From the cache's thread: key app, and put its cached outputs in its Directory on a hit (see Restore()).
+        Then callback(key, cached) -- also from the cache's thread -- with cached None on a miss, and key None if app can't be cached.
+        """
+        self.pool.submit(self.Find, app, directory, callback, link)
+
+
+    def Find(self, app, directory, callback, link):
+        key = None
+        cached = None
+        try:
+            key = self.Key(app, directory=directory)
+            if key is not None:
+                cached = self.Restore(key, app.Directory, link=link)
+        except Exception as e:
+            CompositionLogger.Warning("Application Name = {0} -- Cache lookup failed; running it: {1}".format(app.Name, e))
+            key = None
+            cached = None
+        callback(key, cached)
+
+
+    def Entry(self, key):
+        return os.path.join(self.Path, key[:2], key)
+
+
+    def Count(self, name, by=1):
+        self.db.execute("INSERT INTO counters VALUES (?, ?) ON CONFLICT(name) DO UPDATE SET value = value + ?", (name, by, by))
+
+
+    def Restore(self, key, directory, link=False):
+        """
+        Put the outputs cached under key in directory (hard links with link, else copies); returns a Cached stand-in, or None on a miss
+        """
+        entry = self.Entry(key)
+        with self.lock:
+            found = os.path.exists(os.path.join(entry, "entry.json"))
+            self.Count("hits" if found else "misses")
+            if found:
+                self.db.execute("UPDATE entries SET used = ?, hits = hits + 1 WHERE key = ?", (time.time(), key))
+            self.db.commit()
+        if not found:
+            return None
+
+        outputs = os.path.join(entry, "outputs")
+        for root, dirs, files in os.walk(outputs):
+            target = os.path.join(directory, os.path.relpath(root, outputs))
+            if not os.path.exists(target):
+                os.makedirs(target)
+            for name in files:
+                source = os.path.join(root, name)
+                destination = os.path.join(target, name)
+                if os.path.lexists(destination):
+                    os.remove(destination)
+                if os.path.islink(source):
+                    os.symlink(os.readlink(source), destination)
+                    continue
+                if link:
+                    try:
+                        os.link(source, destination)
+                        continue
+                    except OSError:
+                        pass
+                shutil.copy2(source, destination)
+
+        result = None
+        if os.path.exists(os.path.join(entry, "result.pickle")):
+            with open(os.path.join(entry, "result.pickle"), 'rb') as infile:
+                result = pickle.load(infile)
+        return Cached(result)
+
+
+    def Store(self, key, app, exclude=(), result=None):
+        """
+        Cache what app left in its Directory (but not exclude, e.g. its copied inputs) under key, from the cache's thread
+        """
+        self.pool.submit(self.Copy, key, app.Name, app.cmd, app.Directory, set(exclude), result)
+
+
+    def Copy(self, key, name, cmd, directory, exclude, result):
+        entry = self.Entry(key)
+        if os.path.exists(entry):
+            return
+        if not os.path.exists(os.path.dirname(entry)):
+            os.makedirs(os.path.dirname(entry), exist_ok=True)
+
+        # Built to the side and moved into place whole, so nobody sees a partial entry
+        staging = tempfile.mkdtemp(dir=os.path.dirname(entry), prefix=".{0}.".format(key[:8]))
+        try:
+            size = 0
+            outputs = os.path.join(staging, "outputs")
+            for root, dirs, files in os.walk(directory):
+                dirs[:] = [d for d in dirs if os.path.join(root, d) not in exclude]
+                target = os.path.join(outputs, os.path.relpath(root, directory))
+                os.makedirs(target, exist_ok=True)
+                for filename in files:
+                    source = os.path.join(root, filename)
+                    if source in exclude:
+                        continue
+                    shutil.copy2(source, os.path.join(target, filename), follow_symlinks=False)
+                    if not os.path.islink(source):
+                        size += os.path.getsize(source)
+            if result is not None:
+                with open(os.path.join(staging, "result.pickle"), 'wb') as outfile:
+                    pickle.dump(result, outfile, recurse=True)
+            now = time.time()
+            with open(os.path.join(staging, "entry.json"), "w") as outfile:
+                json.dump({'key': key, 'name': name, 'cmd': cmd, 'size': size, 'created': now}, outfile)
+            os.rename(staging, entry)
+        except OSError as e:
+            # e.g. someone else stored the same result first
+            shutil.rmtree(staging, ignore_errors=True)
+            if not os.path.exists(entry):
+                CompositionLogger.Warning("Application Name = {0} -- Couldn't cache its result: {1}".format(name, e))
+            return
+
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, 0)", (key, name, cmd, size, now, now))
+            self.Count("stores")
+            self.db.commit()
+        if (self.Size is not None) or (self.Age is not None):
+            self.Evict(size=self.Size, age=self.Age)
+
+
+    def Evict(self, size=None, age=None):
+        """
+        Remove entries not used in the last age seconds, then the least recently used ones until the cache holds at most size
+        (MB, or with a K/M/G/T suffix); returns how many were removed
+        """
+        size = MemoryMB(size)
+        with self.lock:
+            entries = self.db.execute("SELECT key, size, used FROM entries ORDER BY used").fetchall()
+        total = sum([entry[1] for entry in entries]) / (1024.0 * 1024.0)
+
+        removed = []
+        for key, nbytes, used in entries:
+            if ((age is not None) and (used < time.time() - age)) or ((size is not None) and (total > size)):
+                shutil.rmtree(self.Entry(key), ignore_errors=True)
+                total -= nbytes / (1024.0 * 1024.0)
+                removed += [key]
+
+        with self.lock:
+            self.db.executemany("DELETE FROM entries WHERE key = ?", [(key, ) for key in removed])
+            self.Count("evictions", len(removed))
+            self.db.commit()
+        if len(removed) > 0:
+            CompositionLogger.Info("Cache {0}: evicted {1} entr{2}".format(self.Path, len(removed), "y" if len(removed) == 1 else "ies"))
+        return len(removed)
+
+
+    def Stats(self):
+        """
+        Entries, size (MB), hit/miss/store/eviction counts and the hit rate
+        """
+        with self.lock:
+            entries, size, oldest, newest = self.db.execute("SELECT COUNT(*), SUM(size), MIN(created), MAX(used) FROM entries").fetchone()
+            counters = dict(self.db.execute("SELECT name, value FROM counters").fetchall())
+        hits = counters.get("hits", 0)
+        misses = counters.get("misses", 0)
+        return {
+            'Path': self.Path,
+            'Entries': entries,
+            'SizeMB': (size or 0) / (1024.0 * 1024.0),
+            'Hits': hits,
+            'Misses': misses,
+            'Stores': counters.get("stores", 0),
+            'Evictions': counters.get("evictions", 0),
+            'HitRate': hits / (hits + misses) if (hits + misses) > 0 else None,
+            'Oldest': oldest,
+            'LastUsed': newest,
+        }
+
+
+    def Close(self):
+        self.pool.shutdown(wait=True)
+        self.db.close()
+
+
+def OpenCache(setting, size=None, age=None):
+    """
+    Cache for a Workflow's Cache attribute (True, or a directory); None if off or unusable
+    """
+    if setting in (None, False):
+        return None
+    try:
+        if setting is True:
+            return Cache(size=size, age=age)
+        return Cache(setting, size=size, age=age)
+    except (sqlite3.Error, OSError) as e:
+        CompositionLogger.Warning("Not caching Application results: {0}".format(e))
+        return None
@@ -0,0 +1,136 @@
+"""
+effis.composition.channels
+"""
+
+import os
+import json
+import struct
+import hashlib
+from multiprocessing import shared_memory, resource_tracker
+
+from effis.composition.log import CompositionLogger
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+#: Bytes at the start of each segment for its shape/dtype; the array starts page aligned after it
+HeaderSize = 4096
+
+# Segments mapped by this process (during a call), kept open while NumPy views of them may be in use
+Handles = {}
+
+
+def Scope(directory):
+    """
+    Names of a Workflow's channels are prefixed with a hash of its Directory, so Workflows don't see each other's
+    """
+    return hashlib.sha1(directory.encode()).hexdigest()[:12]
+
+
+def SegmentName(name, scope=None):
+    if scope is None:
+        if "EFFIS_CHANNELS" not in os.environ:
+            CompositionLogger.RaiseError(RuntimeError, "Channel {0}: not running as an Application of a Workflow (EFFIS_CHANNELS isn't set)".format(name))
+        scope = os.environ["EFFIS_CHANNELS"]
+    return "effis-{0}-{1}".format(scope, name)
+
+
+def Untrack(shm):
+    # The Workflow's scheduler decides when a channel goes away, not the exit of whichever process touched it
+    try:
+        resource_tracker.unregister(shm._name, "shared_memory")
+    except Exception:
+        pass
+
+
+def View(shm, header, readonly):
+    array = numpy.ndarray(tuple(header['shape']), dtype=numpy.dtype(header['dtype']), buffer=shm.buf, offset=HeaderSize)
+    if readonly:
+        array.flags.writeable = False
+    return array
+
+
+def Allocate(name, shape, dtype="float64"):
+    """
+    Create channel name (replacing one left from an earlier attempt) and return a writable NumPy array in it to fill in place
+    """
+    if numpy is None:
+        CompositionLogger.RaiseError(ImportError, "Channels need the numpy Python module")
+
+    if isinstance(shape, int):
+        shape = (shape,)
+    segment = SegmentName(name)
+    header = {'shape': [int(n) for n in shape], 'dtype': numpy.dtype(dtype).str}
+    encoded = json.dumps(header).encode()
+    size = HeaderSize + max(int(numpy.prod(header['shape'])) * numpy.dtype(dtype).itemsize, 1)
+
+    Free(name)
+    shm = shared_memory.SharedMemory(name=segment, create=True, size=size)
+    Untrack(shm)
+    shm.buf[:8] = struct.pack("!Q", len(encoded))
+    shm.buf[8:8 + len(encoded)] = encoded
+    Handles[segment] = shm
+    return View(shm, header, False)
+
+
+def Publish(name, array):
+    """
+    Put (a copy of) array in channel name, for Applications that depend on this one; returns the shared copy
+    """
+    if numpy is None:
+        CompositionLogger.RaiseError(ImportError, "Channels need the numpy Python module")
+    array = numpy.asarray(array)
+    shared = Allocate(name, array.shape, array.dtype)
+    shared[...] = array
+    return shared
+
+
+def Channel(name):
+    """
+    Map channel name, published by an Application this one depends on: a read-only NumPy view of the shared memory, no copy
+    """
+    if numpy is None:
+        CompositionLogger.RaiseError(ImportError, "Channels need the numpy Python module")
+    segment = SegmentName(name)
+    if segment in Handles:
+        shm = Handles[segment]
+    else:
+        try:
+            shm = shared_memory.SharedMemory(name=segment)
+        except FileNotFoundError:
+            CompositionLogger.RaiseError(KeyError, "No channel {0} has been published (or it was already freed)".format(name))
+        Untrack(shm)
+        Handles[segment] = shm
+    length = struct.unpack("!Q", bytes(shm.buf[:8]))[0]
+    header = json.loads(bytes(shm.buf[8:8 + length]).decode())
+    return View(shm, header, True)
+
+
+def Close():
+    """
+    Unmap what this process has mapped (anything still viewed stays mapped until next time)
+    """
+    for segment in list(Handles.keys()):
+        try:
+            Handles[segment].close()
+        except BufferError:
+            continue
+        del Handles[segment]
+
+
+def Free(name, scope=None):
+    """
+    Remove channel name (of the Workflow with scope); its memory goes away once nothing has it mapped
+    """
+    try:
+        shm = shared_memory.SharedMemory(name=SegmentName(name, scope=scope))
+    except FileNotFoundError:
+        return
+    shm.close()
+    try:
+        shm.unlink()
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,218 @@
+"""
+effis.composition.dag
+"""
+
+import time
+import heapq
+
+from effis.composition.artifact import Artifact
+from effis.composition.log import CompositionLogger
+
+
+class DAG:
+    """
+    Indexes a Workflow's Applications and their DependsOn graph once.
+    Each Application keeps a counter of unfinished dependencies; finishing one decrements its successors,
+    and those reaching zero go onto the Ready queue -- so scheduling the whole Workflow costs O(V+E).
+    An Application depending on one (outside of the graph) that already finished without succeeding(dep) won't run:
+    it and what depends on it are cancelled up front (their indices are in Doomed).
+    """
+
+    def __init__(self, applications, finished, clock=time.time, ready=None, succeeded=None):
+
+        self.Applications = list(applications)
+        self.Clock = clock
+        self.OnReady = ready
+        self.Index = {}
+        for i, app in enumerate(self.Applications):
+            self.Index[id(app)] = i
+
+        self.Successors = [[] for app in self.Applications]
+        self.Remaining = [0] * len(self.Applications)
+        self.External = []
+        self.Artifacts = []
+        self.Ready = []
+        self.Completed = 0
+        self.Priority = None
+        self.ReadyTime = [None] * len(self.Applications)
+
+        doomed = []
+        for i, app in enumerate(self.Applications):
+            for dep in app.DependsOn:
+                if isinstance(dep, Artifact):
+                    self.Artifacts += [(i, dep)]
+                    self.Remaining[i] += 1
+                elif id(dep) in self.Index:
+                    self.Successors[self.Index[id(dep)]] += [i]
+                    self.Remaining[i] += 1
+                elif not finished(dep):
+                    self.External += [(i, dep)]
+                    self.Remaining[i] += 1
+                elif (succeeded is not None) and (not succeeded(dep)):
+                    doomed += [i]
+
+        self.CheckCycles()
+
+        # Anything that already finished (e.g. before a restart) releases its successors up front, and never runs again
+        self.Skip = set([i for i, app in enumerate(self.Applications) if finished(app)])
+        for i in self.Skip:
+            self.Completed += 1
+            self.Release(i, push=False)
+
+        self.Doomed = []
+        for i in doomed:
+            self.Doomed += self.Drop(i)
+
+        for i, app in enumerate(self.Applications):
+            if (self.Remaining[i] == 0) and (i not in self.Skip):
+                self.Push(i)
+
+
+    def CheckCycles(self):
+        """
+        Kahn's algorithm: anything never reaching zero in-degree is on a cycle
+        """
+        remaining = list(self.Remaining)
+        for i, dep in self.External + self.Artifacts:
+            remaining[i] -= 1
+
+        stack = [i for i in range(len(self.Applications)) if remaining[i] == 0]
+        self.Order = []
+        while len(stack) > 0:
+            i = stack.pop()
+            self.Order += [i]
+            for j in self.Successors[i]:
+                remaining[j] -= 1
+                if remaining[j] == 0:
+                    stack += [j]
+
+        if len(self.Order) != len(self.Applications):
+            names = [self.Applications[i].Name for i in range(len(self.Applications)) if remaining[i] > 0]
+            CompositionLogger.RaiseError(ValueError, "Cyclic dependencies between Applications: {0}".format(", ".join(names)))
+
+
+    def CriticalPath(self, estimates):
+        """
+        Priority = estimated time from starting an Application through the end of its longest downstream chain
+        """
+        self.Priority = [0] * len(self.Applications)
+        for i in reversed(self.Order):
+            longest = 0
+            for j in self.Successors[i]:
+                longest = max(longest, self.Priority[j])
+            self.Priority[i] = estimates[i] + longest
+
+        self.Ready = [(self.Key(i), i) for key, i in self.Ready]
+        heapq.heapify(self.Ready)
+
+
+    def Add(self, app, finished, succeeded=None):
+        """
+        Add an Application to the graph while it's running; it may only depend on ones already in it.
+        Returns its index -- in Skip if something it depends on already finished without succeeding(dep), since then it won't run.
+        """
+        i = len(self.Applications)
+        self.Applications += [app]
+        self.Index[id(app)] = i
+        self.Successors += [[]]
+        self.Remaining += [0]
+        self.ReadyTime += [None]
+        self.Order += [i]
+        if self.Priority is not None:
+            self.Priority += [0]
+
+        doomed = False
+        for dep in app.DependsOn:
+            if isinstance(dep, Artifact):
+                self.Artifacts += [(i, dep)]
+                self.Remaining[i] += 1
+            elif finished(dep):
+                doomed = doomed or ((succeeded is not None) and (not succeeded(dep)))
+            elif id(dep) in self.Index:
+                self.Successors[self.Index[id(dep)]] += [i]
+                self.Remaining[i] += 1
+            else:
+                self.External += [(i, dep)]
+                self.Remaining[i] += 1
+
+        if doomed:
+            self.Skip.add(i)
+            self.Completed += 1
+        return i
+
+
+    def Key(self, i):
+        # Longest remaining chain first; Workflow order breaks ties
+        if self.Priority is None:
+            return (0, i)
+        return (-self.Priority[i], i)
+
+
+    def Push(self, i):
+        if self.ReadyTime[i] is None:
+            self.ReadyTime[i] = self.Clock()
+            if self.OnReady is not None:
+                self.OnReady(i)
+        heapq.heappush(self.Ready, (self.Key(i), i))
+
+
+    def Pop(self):
+        """
+        Next ready Application (or None)
+        """
+        if len(self.Ready) == 0:
+            return None
+        return self.Applications[heapq.heappop(self.Ready)[1]]
+
+
+    def Satisfy(self, i, push=True):
+        self.Remaining[i] -= 1
+        if (self.Remaining[i] == 0) and push and (i not in self.Skip):
+            self.Push(i)
+
+
+    def Release(self, i, push=True):
+        for j in self.Successors[i]:
+            self.Satisfy(j, push=push)
+
+
+    def Complete(self, app):
+        """
+        app finished: successors with nothing else outstanding become ready
+        """
+        self.Completed += 1
+        self.Release(self.Index[id(app)])
+
+
+    def Cancel(self, i):
+        """
+        i failed for good: everything downstream of it won't run.
+        Returns the indices newly cancelled.
+        """
+        cancelled = []
+        stack = list(self.Successors[i])
+        while len(stack) > 0:
+            j = stack.pop()
+            if j in self.Skip:
+                continue
+            self.Skip.add(j)
+            self.Completed += 1
+            cancelled += [j]
+            stack += self.Successors[j]
+        return cancelled
+
+
+    def Drop(self, i):
+        """
+        i won't run (e.g. the data it waits for can't show up anymore): neither it nor anything downstream of it.
+        Returns the indices newly cancelled.
+        """
+        if i in self.Skip:
+            return []
+        self.Skip.add(i)
+        self.Completed += 1
+        return [i] + self.Cancel(i)
+
+
+    def Done(self):
+        return self.Completed == len(self.Applications)
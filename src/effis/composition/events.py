@@ -0,0 +1,203 @@
+"""
+effis.composition.events
+"""
+
+import os
+import time
+import heapq
+import itertools
+import threading
+import selectors
+import collections
+
+from effis.composition.log import CompositionLogger
+
+
+class Timer:
+    """
+    Handle returned by EventLoop.Later(); Cancel() keeps the callback from running
+    """
+
+    def __init__(self, when, callback, args):
+        self.when = when
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+
+    def Cancel(self):
+        self.cancelled = True
+
+
+class EventLoop:
+    """
+    Blocks in a selector until a child process exits, a watched file descriptor is readable,
+    a timer expires, or another thread hands over work with Call().
+    Nothing is polled, so an idle loop costs no CPU.
+    """
+
+    def __init__(self):
+        self.selector = selectors.DefaultSelector()
+        self.lock = threading.Lock()
+        self.pending = collections.deque()
+        self.timers = []
+        self.counter = itertools.count()
+
+        # Self-pipe so other threads (and error handling) can interrupt select()
+        self.rfd, self.wfd = os.pipe()
+        os.set_blocking(self.rfd, False)
+        os.set_blocking(self.wfd, False)
+        self.selector.register(self.rfd, selectors.EVENT_READ, self.Drain)
+
+        CompositionLogger.OnError(self.Wake)
+
+
+    def Now(self):
+        return time.time()
+
+
+    def Wake(self):
+        try:
+            os.write(self.wfd, b"\0")
+        except (BlockingIOError, OSError):
+            pass
+
+
+    def Drain(self):
+        try:
+            while os.read(self.rfd, 4096):
+                pass
+        except (BlockingIOError, OSError):
+            pass
+
+
+    def Call(self, callback, *args):
+        """
+        Thread-safe: run callback(*args) in the loop thread
+        """
+        with self.lock:
+            self.pending.append((callback, args))
+        self.Wake()
+
+
+    def Later(self, delay, callback, *args):
+        """
+        Thread-safe: run callback(*args) in the loop thread after delay seconds
+        """
+        timer = Timer(time.monotonic() + max(delay, 0), callback, args)
+        with self.lock:
+            heapq.heappush(self.timers, (timer.when, next(self.counter), timer))
+        self.Wake()
+        return timer
+
+
+    def Reader(self, fd, callback):
+        """
+        Run callback() whenever fd is readable
+        """
+        self.selector.register(fd, selectors.EVENT_READ, callback)
+
+
+    def Remove(self, fd):
+        try:
+            self.selector.unregister(fd)
+        except (KeyError, ValueError):
+            pass
+
+
+    def WatchProcess(self, proc, callback):
+        """
+        Run callback(proc) once the subprocess.Popen proc exits.
+        Uses a pidfd in the selector where the OS has one; otherwise a waiter thread blocks in waitpid().
+        Stand-ins for Popen that aren't a process of their own (e.g. FunctionCall) say when they're done with Watch().
+        """
+
+        if 'Watch' in dir(proc):
+            proc.Watch(lambda: self.Call(callback, proc))
+            return
+
+        pidfd = None
+        if 'pidfd_open' in dir(os):
+            try:
+                pidfd = os.pidfd_open(proc.pid)
+            except OSError:
+                pidfd = None
+
+        if pidfd is not None:
+
+            def Exited():
+                self.Remove(pidfd)
+                os.close(pidfd)
+                proc.wait()
+                callback(proc)
+
+            self.Reader(pidfd, Exited)
+
+        else:
+
+            def Waiter():
+                proc.wait()
+                self.Call(callback, proc)
+
+            threading.Thread(target=Waiter, daemon=True).start()
+
+
+    def Timeout(self):
+        with self.lock:
+            while (len(self.timers) > 0) and self.timers[0][2].cancelled:
+                heapq.heappop(self.timers)
+            if len(self.pending) > 0:
+                return 0
+            elif len(self.timers) == 0:
+                return None
+            else:
+                return max(self.timers[0][0] - time.monotonic(), 0)
+
+
+    def RunOnce(self):
+        """
+        Block until something happens, then dispatch everything that is ready.
+        If a callback raises, what's left of the batch is put back (for the next RunOnce()) before the exception is passed on.
+        """
+
+        for key, mask in self.selector.select(self.Timeout()):
+            # File descriptors are level-triggered: any not handled because of an exception come back in the next select()
+            key.data()
+
+        now = time.monotonic()
+        due = []
+        with self.lock:
+            while (len(self.timers) > 0) and (self.timers[0][0] <= now):
+                due += [heapq.heappop(self.timers)[2]]
+            pending = list(self.pending)
+            self.pending.clear()
+
+        for n, timer in enumerate(due):
+            if timer.cancelled:
+                continue
+            try:
+                timer.callback(*timer.args)
+            except BaseException:
+                self.Putback(due[n+1:], pending)
+                raise
+
+        for n, (callback, args) in enumerate(pending):
+            try:
+                callback(*args)
+            except BaseException:
+                self.Putback([], pending[n+1:])
+                raise
+
+
+    def Putback(self, timers, pending):
+        with self.lock:
+            for timer in timers:
+                heapq.heappush(self.timers, (timer.when, next(self.counter), timer))
+            self.pending.extendleft(reversed(pending))
+
+
+    def Close(self):
+        CompositionLogger.OffError(self.Wake)
+        self.selector.close()
+        os.close(self.rfd)
+        os.close(self.wfd)
@@ -0,0 +1,427 @@
+"""
+effis.composition.executor
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import threading
+import subprocess
+import dill as pickle
+
+from effis.composition.events import EventLoop
+from effis.composition.scheduler import Scheduler
+from effis.composition.resources import DetectResources, Pool, MemoryMB
+from effis.composition.artifact import Artifact, Watcher
+from effis.composition.journal import Journal
+from effis.composition.log import CompositionLogger
+
+
+LocalExecutor = None
+LocalLock = threading.Lock()
+
+
+def Address(address=True):
+    """
+    Socket of the executor daemon: a path, or True for the default ($EFFIS_EXECUTOR, else ~/.effis/executor.<host>.sock)
+    """
+    if address is True:
+        default = os.path.join(os.path.expanduser("~"), ".effis", "executor.{0}.sock".format(socket.gethostname()))
+        address = os.environ.get("EFFIS_EXECUTOR", default)
+    return os.path.abspath(os.path.expanduser(address))
+
+
+def Request(address, message, timeout=30):
+    """
+    Send message (a dict) to the executor daemon and return its reply; raises OSError if nothing is listening
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(address)
+        sock.sendall((json.dumps(message) + "\n").encode())
+        with sock.makefile('r') as infile:
+            line = infile.readline()
+    if len(line) == 0:
+        raise ConnectionError("No reply from the executor at {0}".format(address))
+    return json.loads(line)
+
+
+def Running(address):
+    try:
+        Request(address, {'op': "status"}, timeout=5)
+    except OSError:
+        return False
+    return True
+
+
+def StartDaemon(address, resources=None, timeout=30):
+    """
+    Start the executor daemon in its own session (so it outlives whatever started it), logging next to its socket
+    """
+    if Running(address):
+        return
+    if not os.path.exists(os.path.dirname(address)):
+        os.makedirs(os.path.dirname(address))
+
+    cmd = [sys.executable, "-m", "effis.runtime.EffisExecutor", "run", "--socket", address]
+    if resources is not None:
+        cmd += ["--resources", json.dumps(resources)]
+    with open(os.path.splitext(address)[0] + ".log", 'a') as log:
+        subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=log, stderr=subprocess.STDOUT, start_new_session=True)
+
+    start = time.monotonic()
+    while not Running(address):
+        if time.monotonic() - start > timeout:
+            CompositionLogger.RaiseError(RuntimeError, "Executor daemon didn't start listening on {0}".format(address))
+        time.sleep(0.1)
+    CompositionLogger.Info("Started executor daemon on {0}".format(address))
+
+
+class Submission:
+    """
+    Stands in for the thread running a (Runner=None) Workflow, when the executor daemon runs it instead:
+    start() hands the Workflow over, and it's alive as long as the daemon has it.
+    """
+
+    #: Seconds between asking the daemon in join()
+    PollInterval = 1.0
+
+
+    def __init__(self, workflow, restart=False):
+        self.Address = Address(workflow.Executor)
+        self.Name = workflow.Name
+        self.Filename = workflow._picklename_
+        self.Restart = restart
+
+        # The daemon's own environment is whatever it started with; the Workflow runs with the submitter's
+        self.Environment = dict(os.environ)
+
+
+    def start(self):
+        StartDaemon(self.Address)
+        reply = Request(self.Address, {'op': "submit", 'pickle': self.Filename, 'restart': self.Restart, 'environment': self.Environment})
+        if not reply['ok']:
+            CompositionLogger.RaiseError(RuntimeError, "Executor couldn't take Workflow Name={0}: {1}".format(self.Name, reply['error']))
+        CompositionLogger.Info("Workflow Name={0} submitted to the executor on {1}".format(self.Name, self.Address))
+
+
+    def is_alive(self):
+        try:
+            reply = Request(self.Address, {'op': "status"})
+        except OSError:
+            return False
+        return self.Filename in reply['workflows']
+
+
+    def join(self, timeout=None):
+        start = time.monotonic()
+        while self.is_alive():
+            if (timeout is not None) and (time.monotonic() - start >= timeout):
+                return
+            time.sleep(self.PollInterval)
+
+
+class Executor:
+    """
+    One EventLoop and one resource Pool shared by every Workflow handed to it, so Workflows running side by side
+    take turns with the allocation instead of each assuming it has it to itself.
+    Serve() runs it as a daemon taking Workflows from Submission (Workflow.Executor) over a Unix socket.
+    With shared=False, Workflows only share the loop: each one's Resources are used (or not) as if it had been Submit()-ed.
+    """
+
+    def __init__(self, resources=None, shared=True):
+        self.loop = EventLoop()
+
+        self.Pool = None
+        if shared:
+            detected = DetectResources()
+            if resources is not None:
+                detected.update(resources)
+            if detected['MemoryPerNode'] is not None:
+                detected['MemoryPerNode'] = MemoryMB(detected['MemoryPerNode'])
+            self.Pool = Pool(detected)
+            CompositionLogger.Info("Executor resources: {0}".format(detected))
+
+        # Workflows the executor has (by pickle file name): waiting on dependencies, running, or wrapping up
+        self.Workflows = {}
+        self.Callbacks = {}
+        self.Environments = {}
+        self.Watcher = None
+        self.Socket = None
+        self.Address = None
+        self.Stopping = False
+
+
+    def Submit(self, workflow, restart=False, key=None, callback=None, wait=True, environment=None):
+        """
+        Thread-safe: run workflow once the Workflows it depends on have finished (right away with wait=False, if the caller has seen to that).
+        callback(result) is called (from another thread) when it's through: result is True if everything finished,
+        False if some was left for a continuation job, or the exception that kept it from running.
+        environment is what its Applications start with (this process's own if None).
+        """
+        if key is None:
+            key = workflow._picklename_
+        self.Workflows[key] = workflow
+        self.Callbacks[key] = callback
+        self.Environments[key] = environment
+        if wait:
+            self.loop.Call(self.Wait, workflow, restart, key)
+        else:
+            self.loop.Call(self.Start, workflow, restart, key)
+
+
+    def Through(self, key, result):
+        self.Workflows.pop(key, None)
+        self.Environments.pop(key, None)
+        callback = self.Callbacks.pop(key, None)
+        if callback is not None:
+            callback(result)
+
+
+    def Wait(self, workflow, restart, key):
+        """
+        Start workflow once what it depends on is through: batch jobs finished, and Runner=None Workflows' done markers written.
+        A dependency that stops without getting there (its job failed, or the process running it is gone) is the end of it:
+        workflow doesn't run, and its callback gets the error.
+        """
+        runners = [dep for dep in workflow.DependsOn if dep.Runner is not None]
+        others = [dep for dep in workflow.DependsOn if dep.Runner is None]
+        waiting = {'remaining': len(others) + int(len(runners) > 0), 'others': list(others), 'over': False}
+
+        def Satisfied(dep=None):
+            if waiting['over']:
+                return
+            if dep is not None:
+                waiting['others'].remove(dep)
+            waiting['remaining'] -= 1
+            if waiting['remaining'] == 0:
+                waiting['over'] = True
+                self.Start(workflow, restart, key)
+
+        def Abandon(error):
+            if waiting['over']:
+                return
+            waiting['over'] = True
+            CompositionLogger.Warning("Executor not running Workflow Name={0}: {1}".format(workflow.Name, error))
+            self.Through(key, error)
+
+        def Check():
+            if waiting['over']:
+                return
+            for dep in waiting['others']:
+                if self.Gone(dep):
+                    Abandon(RuntimeError("Workflow Name={0} it depends on stopped without finishing".format(dep.Name)))
+                    return
+            self.loop.Later(workflow.MonitorInterval, Check)
+
+        if waiting['remaining'] == 0:
+            self.Start(workflow, restart, key)
+            return
+
+        # Runner=None dependencies are done once they've written their done marker
+        for dep in others:
+            if self.Watcher is None:
+                self.Watcher = Watcher(self.loop, "/")
+            CompositionLogger.Info("Workflow Name={0} waiting for Workflow Name={1}".format(workflow.Name, dep.Name))
+            self.Watcher.Add(Artifact(dep._touchname_, timeout=None), lambda dep=dep: Satisfied(dep))
+        if len(others) > 0:
+            self.loop.Later(workflow.MonitorInterval, Check)
+
+        if len(runners) > 0:
+            def Batch():
+                try:
+                    workflow.BatchWait([dep.JobID for dep in runners], [dep.Name for dep in runners], [dep.Runner for dep in runners])
+                except BaseException as e:
+                    # A job it depends on failed (or was cancelled, ...)
+                    CompositionLogger.ERROR = False
+                    error = e if isinstance(e, Exception) else RuntimeError("a batch job it depends on didn't complete")
+                    self.loop.Call(Abandon, error)
+                    return
+                self.loop.Call(Satisfied)
+            threading.Thread(target=Batch, daemon=True).start()
+
+
+    def Gone(self, dep):
+        """
+        Whether the Runner=None Workflow dep has stopped running without writing its done marker
+        """
+        if os.path.exists(dep._touchname_) or (dep._picklename_ in self.Workflows):
+            return False
+
+        if dep.Executor not in (None, False):
+            address = Address(dep.Executor)
+            if address == self.Address:
+                # Went through this executor, and it's through
+                return True
+            try:
+                return dep._picklename_ not in Request(address, {'op': "status"}, timeout=5)['workflows']
+            except (OSError, ValueError):
+                return True
+
+        # Running in a thread of some process (recorded in its journal when it started)
+        run = None
+        for record in Journal.Read(dep._journalname_):
+            if record['event'] == "run":
+                run = record
+        if (run is None) or (run['host'] != socket.gethostname()):
+            return False
+        try:
+            os.kill(run['pid'], 0)
+        except ProcessLookupError:
+            return True
+        except PermissionError:
+            pass
+        return False
+
+
+    def Start(self, workflow, restart, key):
+        try:
+            if restart:
+                workflow.Restart()
+            scheduler = Scheduler(workflow, loop=self.loop, pool=self.Pool, environment=self.Environments.get(key))
+            scheduler.Key = key
+            scheduler.Start(callback=self.Finished)
+        except Exception as e:
+            CompositionLogger.Warning("Executor couldn't start Workflow Name={0}: {1}".format(workflow.Name, e))
+            CompositionLogger.ERROR = False
+            self.Through(key, e)
+
+
+    def Finished(self, scheduler):
+        done = scheduler.Done()
+        if done:
+            scheduler.Summarize()
+        scheduler.Close()
+
+        # Done marker, campaign, continuation job, ... can take a while; don't hold up everyone else's Applications
+        def Complete():
+            result = done
+            try:
+                scheduler.Workflow.Completed(done, scheduler.Stalled)
+            except Exception as e:
+                result = e
+            finally:
+                self.loop.Call(self.Through, scheduler.Key, result)
+        threading.Thread(target=Complete, daemon=True).start()
+
+
+    def Listen(self, address):
+        if Running(address):
+            CompositionLogger.RaiseError(RuntimeError, "An executor is already listening on {0}".format(address))
+        if os.path.exists(address):
+            os.remove(address)
+        if not os.path.exists(os.path.dirname(address)):
+            os.makedirs(os.path.dirname(address))
+        self.Socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.Socket.bind(address)
+        os.chmod(address, 0o600)
+        self.Socket.listen()
+        self.Socket.setblocking(False)
+        self.Address = address
+        self.loop.Reader(self.Socket.fileno(), self.Accept)
+
+
+    def Accept(self):
+        try:
+            conn, peer = self.Socket.accept()
+        except (BlockingIOError, OSError):
+            return
+        with conn:
+            try:
+                # Requests are one short line from this machine
+                conn.settimeout(5)
+                with conn.makefile('r') as infile:
+                    message = json.loads(infile.readline())
+                reply = self.Handle(message)
+            except Exception as e:
+                reply = {'ok': False, 'error': str(e)}
+            try:
+                conn.sendall((json.dumps(reply) + "\n").encode())
+            except OSError:
+                pass
+
+
+    def Handle(self, message):
+        if message['op'] == "submit":
+            if self.Stopping:
+                return {'ok': False, 'error': "executor is stopping"}
+            if message['pickle'] in self.Workflows:
+                return {'ok': False, 'error': "{0} is already running".format(message['pickle'])}
+            try:
+                with open(message['pickle'], 'rb') as handle:
+                    workflow = pickle.load(handle)
+            except Exception as e:
+                CompositionLogger.ERROR = False
+                return {'ok': False, 'error': "couldn't load {0}: {1}".format(message['pickle'], e)}
+            CompositionLogger.Info("Executor took Workflow Name={0} ({1})".format(workflow.Name, message['pickle']))
+            self.Submit(workflow, restart=message.get('restart', False), key=message['pickle'], environment=message.get('environment'))
+            return {'ok': True}
+        elif message['op'] == "status":
+            reply = {'ok': True, 'pid': os.getpid(), 'workflows': list(self.Workflows.keys()), 'resources': None, 'free': None}
+            if self.Pool is not None:
+                # Otherwise (shared=False) each Workflow has its own
+                reply['resources'] = self.Pool.Resources
+                reply['free'] = self.Pool.Free
+            return reply
+        elif message['op'] == "stop":
+            self.Stopping = True
+            return {'ok': True}
+        else:
+            return {'ok': False, 'error': "unknown op {0}".format(message['op'])}
+
+
+    def Run(self):
+        """
+        Run until stopped (Stop(), or a stop request) and everything it has is through
+        """
+        try:
+            while (not self.Stopping) or (len(self.Workflows) > 0):
+                try:
+                    self.loop.RunOnce()
+                except Exception as e:
+                    # One Workflow's error shouldn't take the others down with it
+                    CompositionLogger.Warning("Executor: {0}".format(e))
+                    CompositionLogger.ERROR = False
+        finally:
+            self.Close()
+
+
+    def Stop(self):
+        """
+        Thread-safe: finish what's been submitted, then return from Run()
+        """
+        self.loop.Call(setattr, self, 'Stopping', True)
+
+
+    def Close(self):
+        if self.Socket is not None:
+            self.loop.Remove(self.Socket.fileno())
+            self.Socket.close()
+            self.Socket = None
+            if os.path.exists(self.Address):
+                os.remove(self.Address)
+        if self.Watcher is not None:
+            self.Watcher.Close()
+        self.loop.Close()
+
+
+def Local():
+    """
+    The Executor running Workflows submitted with SubmitAsync() in this process: one thread for all of them.
+    Each keeps its own Resources setting, the same as with Submit().
+    """
+    global LocalExecutor
+    with LocalLock:
+        if LocalExecutor is None:
+            LocalExecutor = Executor(shared=False)
+            threading.Thread(target=LocalExecutor.Run, daemon=True).start()
+    return LocalExecutor
+
+
+def Serve(address=True, resources=None):
+    executor = Executor(resources=resources)
+    executor.Listen(Address(address))
+    CompositionLogger.Info("Executor (pid {0}) listening on {1}".format(os.getpid(), executor.Address))
+    executor.Run()
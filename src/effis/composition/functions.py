@@ -0,0 +1,292 @@
+"""
+effis.composition.functions
+"""
+
+import os
+import sys
+import signal
+import struct
+import importlib
+import traceback
+import subprocess
+import collections
+import dill as pickle
+
+from effis.composition import channels
+from effis.composition.log import CompositionLogger
+
+
+class Terminated(BaseException):
+    """
+    Raised in a worker's Function on SIGTERM, so a timeout stops the call the way it would stop a process
+    """
+
+
+def OnTerm(signum, frame):
+    raise Terminated()
+
+
+def Call(payload, directory, logfile, append, environment):
+    """
+    Run a Function in a worker like its own process would have run: in directory, with environment, output to logfile.
+    Returns (exit status, pickled return value).
+    """
+
+    olddir = os.getcwd()
+    oldenv = dict(os.environ)
+    saved = None
+    status, result = 0, None
+
+    try:
+        os.chdir(directory)
+        os.environ.update(environment)
+        if logfile is not None:
+            fd = os.open(logfile, os.O_WRONLY | os.O_CREAT | (os.O_APPEND if append else os.O_TRUNC), 0o644)
+            sys.stdout.flush()
+            sys.stderr.flush()
+            saved = (os.dup(1), os.dup(2))
+            os.dup2(fd, 1)
+            os.dup2(fd, 2)
+            os.close(fd)
+        function, args, kwargs = pickle.loads(payload)
+        result = function(*args, **kwargs)
+    except Terminated:
+        status = -signal.SIGTERM
+    except BaseException:
+        traceback.print_exc()
+        status = 1
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        if saved is not None:
+            os.dup2(saved[0], 1)
+            os.dup2(saved[1], 2)
+            os.close(saved[0])
+            os.close(saved[1])
+        os.chdir(olddir)
+        os.environ.clear()
+        os.environ.update(oldenv)
+        channels.Close()
+
+    try:
+        result = pickle.dumps(result)
+    except Exception as e:
+        sys.stderr.write("EFFIS worker couldn't send back the result from {0}: {1}\n".format(directory, e))
+        result = pickle.dumps(None)
+    return status, result
+
+
+def Send(stream, message):
+    data = pickle.dumps(message)
+    stream.write(struct.pack("!Q", len(data)) + data)
+    stream.flush()
+
+
+def Serve(modules):
+    """
+    Worker process: import modules, then run calls read from stdin, one at a time, answering on (the original) stdout
+    """
+
+    # Keep stdout for answers; anything the Functions print goes to stderr (or their LogFile)
+    answers = os.fdopen(os.dup(1), 'wb')
+    os.dup2(2, 1)
+    requests = sys.stdin.buffer
+
+    for module in modules:
+        try:
+            importlib.import_module(module)
+        except ImportError as e:
+            sys.stderr.write("EFFIS worker couldn't preload {0}: {1}\n".format(module, e))
+    signal.signal(signal.SIGTERM, OnTerm)
+
+    while True:
+        header = requests.read(8)
+        if len(header) < 8:
+            break
+        request = pickle.loads(requests.read(struct.unpack("!Q", header)[0]))
+        Send(answers, Call(**request))
+
+
+class FunctionCall:
+    """
+    Stands in for the subprocess.Popen of an Application with a Function: queued for a worker, then running in one
+    """
+
+    def __init__(self, workers, request):
+        self.workers = workers
+        self.request = request
+        self.worker = None
+        self.callback = None
+        self.returncode = None
+        self.Result = None
+
+
+    @property
+    def pid(self):
+        if self.worker is None:
+            return None
+        return self.worker.proc.pid
+
+
+    def Watch(self, callback):
+        """
+        Call callback() (in the loop) once the call has returned
+        """
+        self.callback = callback
+
+
+    def Finish(self, returncode, result=None):
+        self.worker = None
+        self.returncode = returncode
+        if result is not None:
+            self.Result = pickle.loads(result)
+        if self.callback is not None:
+            self.callback()
+
+
+    def terminate(self):
+        if self.worker is None:
+            self.workers.Dequeue(self)
+        else:
+            self.worker.proc.send_signal(signal.SIGTERM)
+
+
+    def kill(self):
+        # Takes the worker with it; another one is started in its place
+        if self.worker is None:
+            self.workers.Dequeue(self)
+        else:
+            self.worker.proc.kill()
+
+
+class Worker:
+    """
+    One persistent Python process of a Workers pool
+    """
+
+    def __init__(self, workers, preload):
+        self.workers = workers
+        self.call = None
+        self.buffer = b""
+        self.proc = subprocess.Popen(
+            [sys.executable, "-m", "effis.runtime.EffisWorker"] + preload,
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+        )
+        os.set_blocking(self.proc.stdout.fileno(), False)
+        self.workers.loop.Reader(self.proc.stdout.fileno(), self.Readable)
+
+
+    def Start(self, call):
+        self.call = call
+        call.worker = self
+        try:
+            Send(self.proc.stdin, call.request)
+        except OSError:
+            # Died while idle; noticed when its stdout closes
+            pass
+
+
+    def Readable(self):
+        try:
+            data = os.read(self.proc.stdout.fileno(), 1 << 20)
+        except BlockingIOError:
+            return
+
+        if len(data) == 0:
+            self.workers.loop.Remove(self.proc.stdout.fileno())
+            self.proc.stdin.close()
+            self.proc.stdout.close()
+            self.proc.wait()
+            self.workers.Died(self)
+            return
+
+        self.buffer += data
+        if (len(self.buffer) >= 8) and (len(self.buffer) >= 8 + struct.unpack("!Q", self.buffer[:8])[0]):
+            size = struct.unpack("!Q", self.buffer[:8])[0]
+            status, result = pickle.loads(self.buffer[8:8 + size])
+            self.buffer = self.buffer[8 + size:]
+            call, self.call = self.call, None
+            self.workers.Idle(self)
+            call.Finish(status, result)
+
+
+    def Close(self):
+        self.workers.loop.Remove(self.proc.stdout.fileno())
+        self.proc.stdin.close()
+        self.proc.stdout.close()
+        self.proc.kill()
+        self.proc.wait()
+
+
+class Workers:
+    """
+    Persistent pool of Python processes for Applications with a Function, driven from the scheduler's EventLoop.
+    Each worker imports the Workflow's Preload modules once, when it starts, so calls skip interpreter startup and those imports.
+    A worker killed (e.g. after a Timeout) is replaced.
+    """
+
+    def __init__(self, loop, size, preload=()):
+        self.loop = loop
+        self.Preload = list(preload)
+        self.Queue = collections.deque()
+        self.Free = []
+        self.Pool = []
+        for i in range(size):
+            self.Pool += [Worker(self, self.Preload)]
+        self.Free = list(self.Pool)
+        CompositionLogger.Debug("Started {0} Python worker(s), preloading: {1}".format(size, ", ".join(self.Preload)))
+
+
+    def Submit(self, app, append=False, environment={}):
+        """
+        Queue app's Function (with environment on top of its own) for the next free worker; returns a FunctionCall
+        """
+        logfile = None
+        if app.LogFile is not None:
+            logfile = os.path.join(app.Directory, app.LogFile)
+        request = {
+            'payload': pickle.dumps((app.Function, list(app.Args), dict(app.Kwargs)), recurse=True),
+            'directory': app.Directory,
+            'logfile': logfile,
+            'append': append,
+            'environment': {**environment, **app.Environment},
+        }
+        call = FunctionCall(self, request)
+        self.Queue.append(call)
+        self.Dispatch()
+        return call
+
+
+    def Dispatch(self):
+        while (len(self.Free) > 0) and (len(self.Queue) > 0):
+            self.Free.pop().Start(self.Queue.popleft())
+
+
+    def Dequeue(self, call):
+        if call in self.Queue:
+            self.Queue.remove(call)
+            self.loop.Call(call.Finish, -signal.SIGTERM)
+
+
+    def Idle(self, worker):
+        self.Free += [worker]
+        self.Dispatch()
+
+
+    def Died(self, worker):
+        self.Pool.remove(worker)
+        if worker in self.Free:
+            self.Free.remove(worker)
+        replacement = Worker(self, self.Preload)
+        self.Pool += [replacement]
+        self.Idle(replacement)
+        if worker.call is not None:
+            worker.call.Finish(worker.proc.returncode)
+
+
+    def Close(self):
+        for worker in self.Pool:
+            worker.Close()
+        self.Pool = []
+        self.Free = []
+
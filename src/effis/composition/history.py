@@ -0,0 +1,158 @@
+"""
+effis.composition.history
+"""
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+import statistics
+import concurrent.futures
+
+from effis.composition.log import CompositionLogger
+
+
+class History:
+    """
+    SQLite record of how Applications ran, kept across Workflow runs.
+    Runs are keyed on an Application's signature (cmd, Name, arguments and resource shape),
+    with a looser cmd + shape key to fall back on (e.g. for new members of an ensemble).
+    It keeps SQLite's rollback journal (not WAL, which needs shared memory), since home directories are often on NFS/GPFS,
+    and runs are written from a thread of its own, so a slow filesystem doesn't hold up the scheduler.
+    """
+
+    DefaultPath = os.path.join(os.path.expanduser("~"), ".effis", "history.sqlite")
+
+    #: How many recent (successful) runs an estimate is built from
+    Window = 20
+
+
+    def __init__(self, path=None):
+
+        if path is None:
+            path = os.environ.get("EFFIS_HISTORY", self.DefaultPath)
+        self.Path = os.path.abspath(os.path.expanduser(path))
+
+        if not os.path.exists(os.path.dirname(self.Path)):
+            os.makedirs(os.path.dirname(self.Path))
+
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(self.Path, timeout=30, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=DELETE")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS runs ("
+            "signature TEXT, command TEXT, name TEXT, cmd TEXT, arguments TEXT, shape TEXT, workflow TEXT, directory TEXT, "
+            "start REAL, queuewait REAL, launchlatency REAL, runtime REAL, peakmemory REAL, status INTEGER)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS runs_signature ON runs (signature)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS runs_command ON runs (command)")
+        self.db.commit()
+        self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="effis-history")
+
+
+    @staticmethod
+    def Shape(app):
+        shape = {'Memory': app.Memory}
+        if app.Runner is not None:
+            for option in app.Runner.options:
+                if getattr(app, option) is not None:
+                    shape[option] = str(getattr(app, option))
+        return json.dumps(shape, sort_keys=True)
+
+
+    @classmethod
+    def Keys(cls, app):
+        """
+        (signature, command) hashes for app
+        """
+        shape = cls.Shape(app)
+        arguments = json.dumps(list(app.CommandLineArguments.List))
+        signature = hashlib.sha1(json.dumps([app.cmd, app.Name, arguments, shape]).encode("utf-8")).hexdigest()
+        command = hashlib.sha1(json.dumps([app.cmd, shape]).encode("utf-8")).hexdigest()
+        return signature, command
+
+
+    def Record(self, app, workflow=None, queuewait=None, launchlatency=None, runtime=None, peakmemory=None, status=None, start=None):
+        """
+        Add one run of app (written from the history's thread)
+        """
+        signature, command = self.Keys(app)
+        if start is None:
+            start = time.time()
+        row = (
+            signature, command, app.Name, app.cmd, json.dumps(list(app.CommandLineArguments.List)), self.Shape(app),
+            workflow, app.Directory, start, queuewait, launchlatency, runtime, peakmemory, status,
+        )
+        self.pool.submit(self.Insert, row)
+
+
+    def Insert(self, row):
+        try:
+            with self.lock:
+                self.db.execute("INSERT INTO runs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", row)
+                self.db.commit()
+        except sqlite3.Error as e:
+            CompositionLogger.Warning("Couldn't record Application Name = {0} in the history: {1}".format(row[2], e))
+
+
+    def Runs(self, app, exact=True, limit=None):
+        """
+        Past runs of app (most recent first) as dictionaries
+        """
+        signature, command = self.Keys(app)
+        if exact:
+            query, key = "signature = ?", signature
+        else:
+            query, key = "command = ?", command
+        sql = "SELECT * FROM runs WHERE {0} ORDER BY start DESC".format(query)
+        if limit is not None:
+            sql += " LIMIT {0}".format(int(limit))
+        with self.lock:
+            cursor = self.db.execute(sql, (key, ))
+            names = [column[0] for column in cursor.description]
+            rows = cursor.fetchall()
+        return [dict(zip(names, row)) for row in rows]
+
+
+    def Estimate(self, app):
+        """
+        Medians (max for memory) of recent successful runs of app, or None if it has never run.
+        Looks for the exact signature first, then for the same cmd with the same resource shape.
+        """
+
+        for exact in (True, False):
+            runs = [run for run in self.Runs(app, exact=exact, limit=self.Window * 5) if run['status'] == 0][:self.Window]
+            if len(runs) > 0:
+                break
+        else:
+            return None
+
+        estimate = {'Runs': len(runs), 'Exact': exact}
+        for key, name in (('runtime', 'Runtime'), ('queuewait', 'QueueWait'), ('launchlatency', 'LaunchLatency')):
+            values = [run[key] for run in runs if run[key] is not None]
+            estimate[name] = statistics.median(values) if len(values) > 0 else None
+        values = [run['peakmemory'] for run in runs if run['peakmemory'] is not None]
+        estimate['PeakMemory'] = max(values) if len(values) > 0 else None
+        return estimate
+
+
+    def Close(self):
+        self.pool.shutdown(wait=True)
+        self.db.close()
+
+
+def OpenHistory(setting):
+    """
+    History for a Workflow's History attribute (True, a path, or False/None); None if off or unusable
+    """
+    if setting in (None, False):
+        return None
+    try:
+        if setting is True:
+            return History()
+        return History(setting)
+    except (sqlite3.Error, OSError) as e:
+        CompositionLogger.Warning("Not recording Application history: {0}".format(e))
+        return None
@@ -0,0 +1,106 @@
+"""
+effis.composition.inbox
+"""
+
+import os
+import uuid
+import dill as pickle
+
+from effis.composition.artifact import Inotify
+from effis.composition.log import CompositionLogger
+
+
+def SendApplication(path, app):
+    """
+    Drop app into the inbox directory at path (written under a temporary name, then renamed, so it's never read half-written)
+    """
+    if not os.path.exists(path):
+        os.makedirs(path)
+    name = os.path.join(path, uuid.uuid4().hex)
+    with open(name + ".tmp", 'wb') as handle:
+        pickle.dump(app, handle, protocol=pickle.HIGHEST_PROTOCOL, recurse=True)
+    os.rename(name + ".tmp", name + ".pickle")
+
+
+class Inbox:
+    """
+    Directory that other processes drop pickled Applications into (SendApplication) for a running Workflow.
+    New files are noticed with inotify (or polling without it) and handed to callback(app) in the order they arrived.
+    """
+
+    # inotify: IN_CLOSE_WRITE | IN_MOVED_TO
+    Mask = 0x8 | 0x80
+
+    #: Seconds between looks without inotify
+    PollInterval = 1.0
+
+    #: Seconds between looks with inotify anyway, for files written from other nodes of a parallel file system
+    SafetyInterval = 10.0
+
+
+    def __init__(self, loop, path, callback):
+        self.loop = loop
+        self.Path = path
+        self.callback = callback
+        self.Timer = None
+
+        if not os.path.exists(self.Path):
+            os.makedirs(self.Path)
+
+        self.libc, self.fd = Inotify()
+        if (self.fd is not None) and (self.libc.inotify_add_watch(self.fd, self.Path.encode(), self.Mask) < 0):
+            os.close(self.fd)
+            self.fd = None
+        if self.fd is not None:
+            self.loop.Reader(self.fd, self.Check)
+
+        # Anything sent before the Workflow started running
+        self.Check()
+
+
+    def Check(self):
+        if self.fd is not None:
+            try:
+                while os.read(self.fd, 65536):
+                    pass
+            except (BlockingIOError, OSError):
+                pass
+        if self.Timer is not None:
+            self.Timer.Cancel()
+
+        arrived = {}
+        for name in os.listdir(self.Path):
+            if not name.endswith(".pickle"):
+                continue
+            try:
+                arrived[os.path.join(self.Path, name)] = os.path.getmtime(os.path.join(self.Path, name))
+            except OSError:
+                # Gone (or renamed) since the listing
+                continue
+
+        for name in sorted(arrived, key=arrived.get):
+            try:
+                with open(name, 'rb') as handle:
+                    app = pickle.load(handle)
+            except FileNotFoundError:
+                continue
+            except Exception as e:
+                CompositionLogger.Warning("Couldn't read Application from {0}: {1}".format(name, e))
+                app = None
+            try:
+                os.remove(name)
+            except OSError:
+                pass
+            if app is not None:
+                self.callback(app)
+
+        self.Timer = self.loop.Later(self.PollInterval if self.fd is None else self.SafetyInterval, self.Check)
+
+
+    def Close(self):
+        if self.Timer is not None:
+            self.Timer.Cancel()
+        if self.fd is not None:
+            self.loop.Remove(self.fd)
+            os.close(self.fd)
+            self.fd = None
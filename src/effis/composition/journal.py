@@ -0,0 +1,80 @@
+"""
+effis.composition.journal
+"""
+
+import os
+import json
+import time
+
+
+class Journal:
+    """
+    Append-only JSON-lines record of a Workflow's events (create, ready, launch, exit, ...), one line per event.
+    Every line is flushed to the OS as it's written, so nothing is lost if the process is killed;
+    fsync()s to the disk are batched to at most one per SyncInterval, unless an event asks for one.
+    """
+
+    #: Seconds between fsync()s
+    SyncInterval = 1.0
+
+
+    def __init__(self, filename, loop=None):
+        self.Filename = filename
+        self.file = open(filename, 'a')
+        self.loop = loop
+        self.LastSync = time.monotonic()
+        self.Timer = None
+
+
+    def Write(self, event, sync=False, **fields):
+        record = {'time': time.time(), 'event': event}
+        record.update(fields)
+        self.file.write(json.dumps(record) + "\n")
+        self.file.flush()
+
+        if sync or (time.monotonic() - self.LastSync >= self.SyncInterval):
+            self.Sync()
+        elif (self.loop is not None) and (self.Timer is None):
+            self.Timer = self.loop.Later(self.SyncInterval, self.Sync)
+
+
+    def Sync(self):
+        if self.Timer is not None:
+            self.Timer.Cancel()
+            self.Timer = None
+        if not self.file.closed:
+            os.fsync(self.file.fileno())
+        self.LastSync = time.monotonic()
+
+
+    def Close(self):
+        self.Sync()
+        self.file.close()
+
+
+    @staticmethod
+    def Read(filename):
+        """
+        All complete records in the journal (a line cut off by a crash is skipped)
+        """
+        records = []
+        if not os.path.exists(filename):
+            return records
+        with open(filename, 'r') as infile:
+            for line in infile:
+                if not line.endswith("\n"):
+                    break
+                try:
+                    records += [json.loads(line)]
+                except ValueError:
+                    continue
+        return records
+
+
+def AppendEvent(filename, event, **fields):
+    """
+    Write a single event (synced), for things that happen once in a while
+    """
+    journal = Journal(filename)
+    journal.Write(event, sync=True, **fields)
+    journal.Close()
@@ -0,0 +1,226 @@
+"""
+effis.composition.launcher
+"""
+
+import os
+import stat
+import shlex
+import time
+import json
+import hashlib
+import threading
+import subprocess
+import concurrent.futures
+
+from effis.composition.log import CompositionLogger
+
+
+# Environments left by sourcing setup files, by Snapshot key; shared by every scheduler in the process (e.g. the executor daemon's)
+Snapshots = {}
+SnapshotLock = threading.Lock()
+
+# Set by the shell itself, not by setup files
+ShellVariables = ("PWD", "OLDPWD", "SHLVL", "_")
+
+
+class Failed:
+    """
+    Stands in for the subprocess.Popen of a process that couldn't be started (exit status 127, like the shell's command not found)
+    """
+    returncode = 127
+    pid = None
+
+    def terminate(self):
+        pass
+
+    def kill(self):
+        pass
+
+
+class Launcher:
+    """
+    Starts Applications' processes for a scheduler, without holding up its loop.
+    Each Application's argv, environment and wrapper script (for its SetupFiles) are worked out once (Prepare());
+    then a few threads spawn in parallel -- Popen forks with vfork and lets go of the GIL while it does --
+    at most Rate launches per second, so a burst of ready Applications doesn't flood srun/slurmctld.
+    Processes start from base (e.g. the environment of whoever submitted the Workflow to a daemon), else this process's environment.
+    """
+
+    def __init__(self, threads=4, rate=None, environment={}, snapshot=False, base=None):
+        self.Rate = rate
+        self.Snapshot = snapshot
+        self.Next = 0
+        self.lock = threading.Lock()
+        self.Prepared = {}
+
+        # Applications without an Environment of their own share this one
+        self.Extra = dict(environment)
+        self.Base = dict(os.environ if base is None else base)
+        self.Environment = {**self.Base, **environment}
+
+        self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=threads, thread_name_prefix="effis-launch")
+
+
+    def Prepare(self, app, cache=True, direct=False):
+        """
+        argv and environment to start app with (writing its wrapper script, if it has setup to source);
+        direct leaves out the Runner (e.g. srun), for a per-node agent to start it itself
+        """
+
+        if cache and (id(app) in self.Prepared):
+            return self.Prepared[id(app)]
+
+        if direct:
+            cmd = [app.cmd] + app.CommandLineArguments.List
+        else:
+            cmd = app.GetCall()
+        msg = "Application Name = {0} -- Starting:".format(app.Name) + "\n" + " ".join(cmd)
+        if app.LogFile is not None:
+            msg = msg + " > {0} 2>&1".format(app.LogFile)
+
+        ShellSetup = app.ShellSetup()
+
+        environment = None
+        if (ShellSetup is not None) and self.Snapshot:
+            environment = self.Snapshotted(app, ShellSetup)
+            if environment is not None:
+                ShellSetup = None
+
+        if ShellSetup is not None:
+            jobfile = os.path.join(app.Directory, "{0}.sh".format(app.Name))
+
+            with open(jobfile, "w") as outfile:
+                outfile.write(ShellSetup)
+                # exec, so signals (e.g. from a Timeout) go to the Application itself; quoted, so each argument stays one argument
+                outfile.write(
+                    "exec {0}".format(shlex.join(cmd))
+                )
+
+            os.chmod(
+                jobfile,
+                stat.S_IRUSR | stat.S_IXUSR | stat.S_IWUSR |
+                stat.S_IRGRP | stat.S_IXGRP |
+                stat.S_IROTH | stat.S_IXOTH
+            )
+            cmd = [jobfile]
+
+        if environment is None:
+            environment = self.Environment
+            if len(app.Environment) > 0:
+                environment = {**self.Environment, **app.Environment}
+
+        prepared = (cmd, environment, msg)
+        if cache:
+            self.Prepared[id(app)] = prepared
+        return prepared
+
+
+    def Snapshotted(self, app, ShellSetup):
+        """
+        Environment app's setup files leave behind, sourced once per distinct set of files (by content), Environment and base environment;
+        None if sourcing them fails, to fall back on the wrapper script
+        """
+        files = []
+        if "UpstreamSetupFile" in app.__dir__():
+            files += [SetupFile.outpath for SetupFile in app.UpstreamSetupFile]
+        files += [SetupFile.outpath for SetupFile in app.SetupFile]
+
+        digest = hashlib.sha1()
+        for filename in files:
+            # By content: each Application has its own copy of the same file
+            with open(filename, 'rb') as infile:
+                digest.update(hashlib.sha1(infile.read()).digest())
+        digest.update(json.dumps(sorted(app.Environment.items())).encode())
+        digest.update(json.dumps(sorted(self.Base.items())).encode())
+        key = digest.hexdigest()
+
+        with SnapshotLock:
+            if key not in Snapshots:
+                Snapshots[key] = self.Capture(app, ShellSetup, files)
+            snapshot = Snapshots[key]
+
+        if snapshot is None:
+            return None
+        return {**snapshot, **self.Extra}
+
+
+    def Capture(self, app, ShellSetup, files):
+        CompositionLogger.Info("Application Name = {0} -- Snapshotting the environment from: {1}".format(app.Name, " ".join(files)))
+        try:
+            result = subprocess.run(
+                [self.Base.get('SHELL', '/bin/sh'), "-c", ShellSetup + "exec env -0\n"],
+                cwd=app.Directory, env={**self.Base, **app.Environment},
+                stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            )
+        except OSError as e:
+            result = None
+            error = str(e)
+        if (result is not None) and (result.returncode == 0):
+            snapshot = {}
+            for item in result.stdout.decode(errors="surrogateescape").split("\0"):
+                if "=" in item:
+                    name, value = item.split("=", 1)
+                    snapshot[name] = value
+            for name in ShellVariables:
+                snapshot.pop(name, None)
+            return snapshot
+        if result is not None:
+            error = "exit status {0}: {1}".format(result.returncode, result.stderr.decode(errors="replace").strip())
+        CompositionLogger.Warning("Application Name = {0} -- Couldn't snapshot its setup ({1}); sourcing it at every launch instead".format(app.Name, error))
+        return None
+
+
+    def Throttle(self):
+        """
+        Wait for this launch's turn under Rate
+        """
+        if self.Rate is None:
+            return
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.Next)
+            self.Next = start + 1.0 / self.Rate
+        if start > now:
+            time.sleep(start - now)
+
+
+    def Spawn(self, app, append=False, cache=True):
+        """
+        Start app's process in its Directory (with Popen's cwd, so the controller's own working directory never changes);
+        returns the process and its open log file (or None)
+        """
+        cmd, environment, msg = self.Prepare(app, cache=cache)
+        self.Throttle()
+
+        stdout = None
+        if app.LogFile is not None:
+            stdout = open(os.path.join(app.Directory, app.LogFile), 'a' if append else 'w')
+
+        CompositionLogger.Info(msg)
+        try:
+            proc = subprocess.Popen(cmd, cwd=app.Directory, stdout=stdout, stderr=stdout, env=environment)
+        except Exception:
+            if stdout is not None:
+                stdout.close()
+            raise
+        return proc, stdout
+
+
+    def Submit(self, app, callback, append=False):
+        """
+        Spawn app from a launcher thread; callback(proc, stdout) is called from that thread (with a Failed proc if it couldn't be started)
+        """
+
+        def Start():
+            try:
+                proc, stdout = self.Spawn(app, append=append)
+            except Exception as e:
+                CompositionLogger.Warning("Application Name = {0} -- Couldn't be started: {1}".format(app.Name, e))
+                proc, stdout = Failed(), None
+            callback(proc, stdout)
+
+        self.pool.submit(Start)
+
+
+    def Close(self):
+        self.pool.shutdown(wait=True, cancel_futures=True)
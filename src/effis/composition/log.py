@@ -100,6 +100,7 @@ class EffisFormatter(logging.Formatter):
 
 class CompositionLogger:
     ERROR = False
+    ErrorCallbacks = []
     
     log = logging.getLogger(__name__)
     log.setLevel(logging.DEBUG)
@@ -138,6 +139,16 @@ class CompositionLogger:
         cls.log.debug(msg)
         
         
+    @classmethod
+    def OnError(cls, callback):
+        cls.ErrorCallbacks.append(callback)
+
+    @classmethod
+    def OffError(cls, callback):
+        if callback in cls.ErrorCallbacks:
+            cls.ErrorCallbacks.remove(callback)
+
+
     @classmethod
     def RunnerError(cls, msg):
         return cls.RaiseError(ValueError, msg)
@@ -149,6 +160,10 @@ class CompositionLogger:
         cls.ERROR = True
         cls.log.error(msg + "\n")
 
+        # Wake anything blocked waiting on events, so it can see the error
+        for callback in list(cls.ErrorCallbacks):
+            callback()
+
         '''
         stack = traceback.extract_stack(limit=-2)
         stack = ''.join(traceback.format_list(stack))
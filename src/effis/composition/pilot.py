@@ -0,0 +1,327 @@
+"""
+effis.composition.pilot
+"""
+
+import os
+import json
+import time
+import socket
+import sqlite3
+import contextlib
+
+from effis.composition.runner import UseRunner, WalltimeSeconds
+from effis.composition.application import Application
+from effis.composition.resources import DetectResources
+from effis.composition.scheduler import Scheduler, Finished
+from effis.composition.log import CompositionLogger
+
+
+class Queue:
+    """
+    A Workflow's Applications as tasks in an SQLite file in its Directory, worked through by however many pilot jobs are running.
+    Claiming and finishing a task are each one IMMEDIATE transaction, so two pilots never get the same task.
+    It keeps SQLite's rollback journal (not WAL, which needs shared memory), so the file can live on a shared filesystem.
+    """
+
+    #: Seconds a pilot can go without checking in before its tasks are handed out again (e.g. its job was killed)
+    Stale = 120
+
+
+    def __init__(self, path):
+        self.Path = path
+        self.db = sqlite3.connect(self.Path, timeout=60, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=DELETE")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS tasks ("
+            "idx INTEGER PRIMARY KEY, name TEXT, state TEXT, depends TEXT, attempts INTEGER, worker TEXT, status INTEGER, start REAL, end REAL)"
+        )
+        self.db.execute("CREATE TABLE IF NOT EXISTS pilots (worker TEXT PRIMARY KEY, host TEXT, jobid TEXT, started REAL, beat REAL)")
+
+
+    @contextlib.contextmanager
+    def Transaction(self):
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self.db.execute("ROLLBACK")
+            raise
+        self.db.execute("COMMIT")
+
+
+    def Fill(self, applications, finished):
+        """
+        Add a task for each Application not in the queue yet (done already if finished(app)).
+        Tasks already there are left alone -- pilots may be working on them -- except failed or cancelled ones
+        that are to run again (not finished(app), e.g. after Restart()).
+        """
+        index = {id(app): i for i, app in enumerate(applications)}
+        with self.Transaction():
+            for i, app in enumerate(applications):
+                depends = [index[id(dep)] for dep in app.DependsOn]
+                state = "done" if finished(app) else "waiting"
+                self.db.execute("INSERT OR IGNORE INTO tasks VALUES (?, ?, ?, ?, 0, NULL, NULL, NULL, NULL)", (i, app.Name, state, json.dumps(depends)))
+                if state == "waiting":
+                    self.db.execute("UPDATE tasks SET state = 'waiting', worker = NULL, status = NULL WHERE idx = ? AND state IN ('failed', 'cancelled')", (i, ))
+            self.Release()
+
+
+    def Release(self):
+        # Waiting tasks whose dependencies are all done
+        done = set([row[0] for row in self.db.execute("SELECT idx FROM tasks WHERE state = 'done'")])
+        for idx, depends in self.db.execute("SELECT idx, depends FROM tasks WHERE state = 'waiting'").fetchall():
+            if all([dep in done for dep in json.loads(depends)]):
+                self.db.execute("UPDATE tasks SET state = 'ready' WHERE idx = ?", (idx, ))
+
+
+    def Cancel(self):
+        """
+        Cancel waiting tasks downstream of failed (or cancelled) ones
+        """
+        bad = set([row[0] for row in self.db.execute("SELECT idx FROM tasks WHERE state IN ('failed', 'cancelled')")])
+        waiting = self.db.execute("SELECT idx, depends FROM tasks WHERE state = 'waiting'").fetchall()
+        changed = True
+        while changed:
+            changed = False
+            for idx, depends in waiting:
+                if (idx not in bad) and any([dep in bad for dep in json.loads(depends)]):
+                    bad.add(idx)
+                    self.db.execute("UPDATE tasks SET state = 'cancelled' WHERE idx = ?", (idx, ))
+                    changed = True
+
+
+    def Requeue(self, now):
+        stale = now - self.Stale
+        for idx, name, worker in self.db.execute(
+            "SELECT idx, name, worker FROM tasks WHERE state = 'running' AND worker IN (SELECT worker FROM pilots WHERE beat < ?)", (stale, )
+        ).fetchall():
+            CompositionLogger.Warning("Application Name = {0} -- Pilot {1} stopped checking in; handing it out again".format(name, worker))
+            self.db.execute("UPDATE tasks SET state = 'ready', worker = NULL WHERE idx = ?", (idx, ))
+
+
+    def Beat(self, worker):
+        """
+        Check in as a live pilot (and hand out again the tasks of pilots that stopped checking in)
+        """
+        now = time.time()
+        with self.Transaction():
+            self.db.execute(
+                "INSERT INTO pilots VALUES (?, ?, ?, ?, ?) ON CONFLICT(worker) DO UPDATE SET beat = excluded.beat",
+                (worker, socket.gethostname(), os.environ.get("SLURM_JOB_ID"), now, now)
+            )
+            self.Requeue(now)
+
+
+    def Claim(self, worker, idx):
+        """
+        Take task idx if it's ready (or already worker's, to run again); returns how many times it has run before, or None if it isn't available
+        """
+        with self.Transaction():
+            row = self.db.execute("SELECT state, worker, attempts FROM tasks WHERE idx = ?", (idx, )).fetchone()
+            if (row is None) or not ((row[0] == "ready") or ((row[0] == "running") and (row[1] == worker))):
+                return None
+            self.db.execute("UPDATE tasks SET state = 'running', worker = ?, attempts = ?, start = ? WHERE idx = ?", (worker, row[2] + 1, time.time(), idx))
+        return row[2]
+
+
+    def Finish(self, idx, status, completed=True):
+        """
+        Record how task idx ended; returns whether this was the last of the Workflow's tasks
+        """
+        with self.Transaction():
+            state = "done" if completed else "failed"
+            self.db.execute("UPDATE tasks SET state = ?, status = ?, end = ? WHERE idx = ?", (state, status, time.time(), idx))
+            if completed:
+                self.Release()
+            else:
+                self.Cancel()
+            drained = self.Drained()
+        return drained
+
+
+    def States(self):
+        """
+        (state, worker, status) of each task, by index
+        """
+        return {row[0]: row[1:] for row in self.db.execute("SELECT idx, state, worker, status FROM tasks")}
+
+
+    def Drained(self):
+        return self.db.execute("SELECT COUNT(*) FROM tasks WHERE state IN ('waiting', 'ready', 'running')").fetchone()[0] == 0
+
+
+    def Counts(self):
+        return dict(self.db.execute("SELECT state, COUNT(*) FROM tasks GROUP BY state").fetchall())
+
+
+    def Pilots(self):
+        return [dict(zip(("worker", "host", "jobid", "started", "beat"), row)) for row in self.db.execute("SELECT * FROM pilots")]
+
+
+    def Close(self):
+        self.db.close()
+
+
+def Enqueue(workflow):
+    """
+    Put workflow's Applications in its queue (those that already finished, e.g. after Restart(), as done)
+    """
+    members = set([id(app) for app in workflow.Applications])
+    for app in workflow.Applications:
+        for dep in app.DependsOn:
+            if (not isinstance(dep, Application)) or (id(dep) not in members):
+                CompositionLogger.RaiseError(ValueError, "Pilot mode: Application Name={0} depends on something outside of the Workflow".format(app.Name))
+
+    queue = Queue(workflow._queuename_)
+    queue.Fill(workflow.Applications, lambda app: ('Status' in app.__dir__()) and (app.Status == 0))
+    counts = queue.Counts()
+    queue.Close()
+    CompositionLogger.Info("Workflow Name={0}: queued {1} Application(s) for pilots ({2} already done)".format(
+        workflow.Name, len(workflow.Applications), counts.get("done", 0)
+    ))
+
+
+class Pilot(Scheduler):
+    """
+    What runs in a pilot job: the Workflow's Scheduler (dependencies, Groups, priorities, admission into its own allocation, retries, cache, ...),
+    claiming each Application from the Workflow's Queue before launching it, so it runs in only one pilot.
+    Every PollInterval it checks in and catches up with the other pilots, until the queue is drained (or its walltime is nearly up).
+    """
+
+    #: Seconds between checks for tasks that other pilots finished, or handed back (and check-ins with the queue)
+    PollInterval = 5
+
+
+    def __init__(self, workflow):
+        self.Queue = Queue(workflow._queuename_)
+        self.Worker = "{0}:{1}:{2}".format(socket.gethostname(), os.environ.get("SLURM_JOB_ID", ""), os.getpid())
+
+        # Tasks claimed by other pilots (looked at again if they're handed back), whether this pilot finished the last task, and the next check-in
+        self.Elsewhere = set()
+        self.Last = False
+        self.Poller = None
+
+        super().__init__(workflow)
+
+
+    def Allocation(self):
+        # A pilot has its allocation to itself, so it packs it unless told not to
+        if self.Workflow.Resources is False:
+            return None
+        resources = DetectResources()
+        if isinstance(self.Workflow.Resources, dict):
+            resources.update(self.Workflow.Resources)
+        return resources
+
+
+    def FindDeadline(self):
+        deadline = super().FindDeadline()
+        if (deadline is None) and (self.Workflow.Walltime is not None):
+            # Pilot jobs are submitted with the Workflow's Walltime, whatever the Runner
+            self.JobLength = WalltimeSeconds(self.Workflow.Walltime)
+            deadline = float(os.environ.get("SLURM_JOB_START_TIME", self.loop.Now())) + self.JobLength
+        return deadline
+
+
+    def OpenInbox(self):
+        # Applications are handed out through the queue
+        return None
+
+
+    def Ready(self, i):
+        # Which tasks are ready is in the queue; every pilot writing it to the journal would only repeat it
+        pass
+
+
+    def Record(self, event, app=None, sync=False, **fields):
+        fields['worker'] = self.Worker
+        super().Record(event, app=app, sync=sync, **fields)
+
+
+    def Sync(self):
+        """
+        Catch up with the other pilots: what they finished releases (or cancels) what depends on it here too,
+        and tasks handed back (their pilot stopped checking in) can be claimed again
+        """
+        for i, (state, worker, status) in self.Queue.States().items():
+            if i >= len(self.Graph.Applications):
+                continue
+            app = self.Graph.Applications[i]
+            if (i in self.Graph.Skip) or Finished(app) or (id(app) in self.Running):
+                continue
+            elif state == "done":
+                super(UseRunner, app).__setattr__('Status', status)
+                super(UseRunner, app).__setattr__('State', "COMPLETED")
+                self.Elsewhere.discard(i)
+                self.Graph.Complete(app)
+            elif state in ("failed", "cancelled"):
+                super(UseRunner, app).__setattr__('Status', status)
+                super(UseRunner, app).__setattr__('State', "FAILED" if state == "failed" else "CANCELLED")
+                for j in self.Graph.Cancel(i):
+                    super(UseRunner, self.Graph.Applications[j]).__setattr__('Status', None)
+                    super(UseRunner, self.Graph.Applications[j]).__setattr__('State', "CANCELLED")
+                self.Elsewhere.discard(i)
+                self.Graph.Complete(app)
+            elif (state == "ready") and (i in self.Elsewhere):
+                self.Elsewhere.discard(i)
+                self.Graph.Push(i)
+
+
+    def Launch(self, app):
+        i = self.Graph.Index[id(app)]
+        attempts = None
+        if not Finished(app):
+            attempts = self.Queue.Claim(self.Worker, i)
+        if attempts is None:
+            # Another pilot has it (or already ran it)
+            self.Elsewhere.add(i)
+            self.Free(app)
+            return
+        if attempts > 0:
+            # Ran in another pilot that went away: pick up its count (and log file)
+            self.Attempts[id(app)] = max(self.Attempts.get(id(app), 0), attempts)
+        super().Launch(app)
+
+
+    def Finish(self, app):
+        super().Finish(app)
+        if self.Retry(app):
+            # Keeps the task, to run it again after its backoff
+            return
+        if self.Queue.Finish(self.Graph.Index[id(app)], app.Status, completed=(app.State == "COMPLETED")):
+            self.Last = True
+
+
+    def Poll(self):
+        self.Poller = None
+        self.Queue.Beat(self.Worker)
+        self.Sync()
+        if (len(self.Running) == 0) and (self.Launching == 0) and (self.Deadline is not None) and (self.loop.Now() + self.Workflow.WalltimeMargin > self.Deadline):
+            CompositionLogger.Info("Pilot {0}: out of walltime; leaving the rest to other pilots".format(self.Worker))
+            self.Stalled = True
+        self.Schedule()
+        if not (self.Done() or self.Stalled):
+            self.Poller = self.loop.Later(self.PollInterval, self.Poll)
+
+
+    def Start(self, callback=None):
+        self.Queue.Beat(self.Worker)
+        self.Sync()
+        super().Start(callback=callback)
+        self.Poller = self.loop.Later(self.PollInterval, self.Poll)
+
+
+    def Close(self):
+        if self.Poller is not None:
+            self.Poller.Cancel()
+        super().Close()
+        self.Queue.Close()
+
+
+    def Run(self):
+        CompositionLogger.Info("Pilot {0} working on Workflow Name={1}".format(self.Worker, self.Workflow.Name))
+        done = super().Run()
+        if self.Last:
+            # Last one out: wrap the Workflow up, like a single job running all of it would have
+            self.Workflow.Completed(True)
+        return done
@@ -0,0 +1,326 @@
+"""
+effis.composition.resources
+"""
+
+import os
+import re
+import math
+
+from effis.composition.log import CompositionLogger
+
+
+def SlurmCount(value):
+    """
+    Slurm per-node lists look like "64(x2),32" -- return the first count
+    """
+    if value is None:
+        return None
+    match = re.match(r"^\D*?(\d+)", value.split(",")[0].split(":")[-1])
+    if match is None:
+        return None
+    return int(match.group(1))
+
+
+def LocalCores():
+    if 'sched_getaffinity' in dir(os):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count()
+
+
+def LocalGPUs():
+    for name in ("CUDA_VISIBLE_DEVICES", "ROCR_VISIBLE_DEVICES", "HIP_VISIBLE_DEVICES"):
+        if (name in os.environ) and (os.environ[name].strip() != ""):
+            return len(os.environ[name].split(","))
+    return 0
+
+
+def MemoryMB(value):
+    """
+    Memory given like Slurm's --mem: an integer (MB), or a string with a K/M/G/T suffix
+    """
+    if value is None:
+        return None
+    elif isinstance(value, (int, float)) and (not isinstance(value, bool)):
+        return float(value)
+
+    match = re.match(r"^\s*(\d+(?:\.\d+)?)\s*([KMGT]?)B?\s*$", str(value).upper())
+    if match is None:
+        CompositionLogger.RaiseError(ValueError, "Cannot understand memory setting {0} (use MB, or a K/M/G/T suffix)".format(value))
+    scale = {'K': 1.0/1024, '': 1.0, 'M': 1.0, 'G': 1024.0, 'T': 1024.0*1024}
+    return float(match.group(1)) * scale[match.group(2)]
+
+
+def LocalMemory():
+    """
+    MemAvailable from /proc/meminfo in MB (unlimited when it can't be read)
+    """
+    try:
+        with open("/proc/meminfo", "r") as infile:
+            for line in infile:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) / 1024.0
+    except OSError:
+        pass
+    return math.inf
+
+
+def ProcessRSS(pid):
+    """
+    Resident memory (MB) of pid plus all of its descendants, from /proc
+    """
+
+    children = {}
+    rss = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(os.path.join("/proc", entry, "status"), "r") as infile:
+                ppid = None
+                for line in infile:
+                    if line.startswith("PPid:"):
+                        ppid = int(line.split()[1])
+                    elif line.startswith("VmRSS:"):
+                        rss[int(entry)] = int(line.split()[1]) / 1024.0
+            children.setdefault(ppid, []).append(int(entry))
+        except (OSError, ValueError, IndexError):
+            continue
+
+    total = 0
+    stack = [pid]
+    while len(stack) > 0:
+        current = stack.pop()
+        total += rss.get(current, 0)
+        stack += children.get(current, [])
+    return total
+
+
+def DetectResources():
+    """
+    Node/core/GPU/memory inventory of the current allocation (or of the local machine outside of one)
+    """
+
+    resources = {
+        'Nodes': 1,
+        'CoresPerNode': LocalCores(),
+        'GPUsPerNode': LocalGPUs(),
+        'MemoryPerNode': LocalMemory(),
+    }
+
+    if "SLURM_JOB_ID" in os.environ:
+        for name in ("SLURM_JOB_NUM_NODES", "SLURM_NNODES"):
+            if name in os.environ:
+                resources['Nodes'] = int(os.environ[name])
+                break
+        for name in ("SLURM_CPUS_ON_NODE", "SLURM_JOB_CPUS_PER_NODE"):
+            if SlurmCount(os.environ.get(name)) is not None:
+                resources['CoresPerNode'] = SlurmCount(os.environ[name])
+                break
+        for name in ("SLURM_GPUS_ON_NODE", "SLURM_GPUS_PER_NODE"):
+            if SlurmCount(os.environ.get(name)) is not None:
+                resources['GPUsPerNode'] = SlurmCount(os.environ[name])
+                break
+        if "SLURM_MEM_PER_NODE" in os.environ:
+            resources['MemoryPerNode'] = float(os.environ["SLURM_MEM_PER_NODE"])
+        elif "SLURM_MEM_PER_CPU" in os.environ:
+            resources['MemoryPerNode'] = float(os.environ["SLURM_MEM_PER_CPU"]) * resources['CoresPerNode']
+
+    return resources
+
+
+def Option(app, name):
+    if (name in app.__dir__()) and (getattr(app, name) is not None):
+        return int(getattr(app, name))
+    return None
+
+
+class Request:
+    """
+    What an Application asks for, in units of a rank (or of RanksPerGPU ranks sharing one GPU)
+    """
+
+    def __init__(self, app, memory=None):
+
+        self.Name = app.Name
+        self.Local = (app.Runner is None) or (app.Function is not None)
+
+        # Per node, like --mem; a measured footprint can stand in for (or tighten) the setting
+        self.Memory = MemoryMB(app.Memory)
+        if memory is not None:
+            self.Memory = memory
+        if self.Memory is None:
+            self.Memory = 0
+
+        Nodes = Option(app, 'Nodes')
+        Ranks = Option(app, 'Ranks')
+        RanksPerNode = Option(app, 'RanksPerNode')
+        CoresPerRank = Option(app, 'CoresPerRank')
+        GPUsPerRank = Option(app, 'GPUsPerRank')
+        RanksPerGPU = Option(app, 'RanksPerGPU')
+
+        if Ranks is None:
+            if (Nodes is not None) and (RanksPerNode is not None):
+                Ranks = Nodes * RanksPerNode
+            elif Nodes is not None:
+                Ranks = Nodes
+            else:
+                Ranks = 1
+        if CoresPerRank is None:
+            CoresPerRank = 1
+
+        group = 1
+        self.UnitGPUs = 0
+        if RanksPerGPU is not None:
+            group = RanksPerGPU
+            self.UnitGPUs = 1
+        elif GPUsPerRank is not None:
+            self.UnitGPUs = GPUsPerRank
+
+        self.Ranks = Ranks
+        self.Units = int(math.ceil(Ranks / group))
+        self.UnitCores = CoresPerRank * group
+        self.Nodes = Nodes
+        self.UnitsPerNode = None
+        if RanksPerNode is not None:
+            self.UnitsPerNode = max(RanksPerNode // group, 1)
+
+        self.Cores = self.Units * self.UnitCores
+        self.GPUs = self.Units * self.UnitGPUs
+
+
+    def __str__(self):
+        return "{0} core(s), {1} GPU(s), {2:.0f} MB/node".format(self.Cores, self.GPUs, self.Memory)
+
+
+class Pool:
+    """
+    Slot accounting of free cores/GPUs/memory per node.
+    Acquire() returns a placement when a Request fits (or None when it has to wait), Release() gives it back.
+    """
+
+    def __init__(self, resources):
+        self.Resources = resources
+        self.Free = []
+        for i in range(resources['Nodes']):
+            self.Free += [{'Cores': resources['CoresPerNode'], 'GPUs': resources['GPUsPerNode'], 'Memory': resources.get('MemoryPerNode', math.inf)}]
+        self.InUse = 0
+
+        # Called after every Release(), for everyone sharing the pool
+        self.Listeners = []
+
+
+    def Empty(self):
+        """
+        A full-size copy of the pool with nothing running
+        """
+        return Pool(self.Resources)
+
+
+    def Split(self, request):
+        """
+        Units to put on each node used
+        """
+        if request.Local:
+            return None
+        elif request.UnitsPerNode is not None:
+            counts = [request.UnitsPerNode] * (request.Units // request.UnitsPerNode)
+            if request.Units % request.UnitsPerNode != 0:
+                counts += [request.Units % request.UnitsPerNode]
+            return counts
+        elif request.Nodes is not None:
+            each = int(math.ceil(request.Units / request.Nodes))
+            counts = [each] * (request.Units // each)
+            if request.Units % each != 0:
+                counts += [request.Units % each]
+            return counts
+        else:
+            return None
+
+
+    def Fit(self, i, cores, gpus, memory):
+        free = self.Free[i]
+        return (free['Cores'] >= cores) and (free['GPUs'] >= gpus) and (free['Memory'] >= memory)
+
+
+    def Place(self, request):
+
+        if request.Local:
+            # Runner=None processes run where the workflow is running
+            if self.Fit(0, request.UnitCores, request.UnitGPUs, request.Memory):
+                return [(0, request.UnitCores, request.UnitGPUs, request.Memory)]
+            return None
+
+        counts = self.Split(request)
+        placement = []
+
+        if counts is not None:
+            used = set()
+            for count in counts:
+                for i, free in enumerate(self.Free):
+                    if (i not in used) and self.Fit(i, count * request.UnitCores, count * request.UnitGPUs, request.Memory):
+                        used.add(i)
+                        placement += [(i, count * request.UnitCores, count * request.UnitGPUs, request.Memory)]
+                        break
+                else:
+                    return None
+
+        else:
+            remaining = request.Units
+            for i, free in enumerate(self.Free):
+                if free['Memory'] < request.Memory:
+                    continue
+                fit = free['Cores'] // max(request.UnitCores, 1)
+                if request.UnitGPUs > 0:
+                    fit = min(fit, free['GPUs'] // request.UnitGPUs)
+                fit = min(fit, remaining)
+                if fit > 0:
+                    placement += [(i, fit * request.UnitCores, fit * request.UnitGPUs, request.Memory)]
+                    remaining -= fit
+                if remaining == 0:
+                    break
+            if remaining > 0:
+                return None
+
+        return placement
+
+
+    def Take(self, placement):
+        for i, cores, gpus, memory in placement:
+            self.Free[i]['Cores'] -= cores
+            self.Free[i]['GPUs'] -= gpus
+            self.Free[i]['Memory'] -= memory
+        self.InUse += 1
+
+
+    def Acquire(self, request):
+        """
+        Reserve room for request if it fits right now
+        """
+
+        placement = self.Place(request)
+
+        if (placement is None) and (self.Empty().Place(request) is None):
+            # Can never fit; don't deadlock, but only run it with nothing else running
+            if self.InUse > 0:
+                return None
+            CompositionLogger.Warning(
+                "Application Name={0} asks for more ({1}) than the allocation has; running it by itself".format(request.Name, request)
+            )
+            placement = []
+            for i, free in enumerate(self.Free):
+                placement += [(i, free['Cores'], free['GPUs'], free['Memory'])]
+
+        if placement is not None:
+            self.Take(placement)
+
+        return placement
+
+
+    def Release(self, placement):
+        for i, cores, gpus, memory in placement:
+            self.Free[i]['Cores'] += cores
+            self.Free[i]['GPUs'] += gpus
+            self.Free[i]['Memory'] += memory
+        self.InUse -= 1
+        for listener in list(self.Listeners):
+            listener()
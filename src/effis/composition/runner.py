@@ -31,6 +31,31 @@ def ValidateIntOptions(options, Application, label="Application"):
                 CompositionLogger.RaiseError(AttributeError, "{0} {1} setting must be an integer (or string of one)".format(name, label))
 
 
+def WalltimeSeconds(value):
+    """
+    Seconds in a Slurm walltime: MM, MM:SS, HH:MM:SS, D-HH, D-HH:MM or D-HH:MM:SS
+    """
+
+    value = str(value).strip()
+    days = 0
+    if "-" in value:
+        days, value = value.split("-", 1)
+        days = int(days)
+        fields = [int(field) for field in value.split(":")]
+        fields += [0] * (3 - len(fields))
+        hours, minutes, seconds = fields
+    else:
+        fields = [int(field) for field in value.split(":")]
+        if len(fields) == 1:
+            hours, minutes, seconds = 0, fields[0], 0
+        elif len(fields) == 2:
+            hours, minutes, seconds = 0, fields[0], fields[1]
+        else:
+            hours, minutes, seconds = fields[-3:]
+
+    return ((days * 24 + hours) * 60 + minutes) * 60 + seconds
+
+
 class UseRunner(object):
     """
     The idea of UseRunner inheritance is an abstraction on Workflow and Application setup.
@@ -38,6 +63,9 @@ class UseRunner(object):
     Each takes a Parallel Runner child class object (or None) to configure appropriately for the system/situation.
     """
 
+    # Set while running, not part of the description
+    _RunTime_ = ("procid", "stdout", "tid", "scheduler", "futures", "Result", "Status", "State", "PeakMemory", "StartTime", "EndTime", "LaunchLatency", "QueueWait")
+
     @classmethod
     def DetectRunnerInfo(cls, useprint=True):
         """
@@ -164,6 +192,16 @@ class UseRunner(object):
                 self.__setattr__(key, getattr(self, key))
 
 
+    def __getstate__(self):
+        """
+        Pickles (and copies) are the description only; what happened while running is in the Workflow's journal
+        """
+        state = dict(self.__dict__)
+        for key in self._RunTime_:
+            state.pop(key, None)
+        return state
+
+
     def _add_(self, other, reverse=False):
         
         if isinstance(other, type(self)):
@@ -246,14 +284,14 @@ class UseRunner(object):
 
         if len(setuplines) > 0:
             setuplines = (
-                "#!{0}".format(os.environ['SHELL']) + "\n" +
+                "#!{0}".format(os.environ.get('SHELL', '/bin/sh')) + "\n" +
                 "\n".join(setuplines) + "\n"
             )
             return setuplines
 
         elif force:
             return (
-                "#!{0}".format(os.environ['SHELL']) + "\n"
+                "#!{0}".format(os.environ.get('SHELL', '/bin/sh')) + "\n"
             )
 
         else:
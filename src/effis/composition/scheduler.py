@@ -0,0 +1,1065 @@
+"""
+effis.composition.scheduler
+"""
+
+import os
+import copy
+import asyncio
+import shutil
+import tempfile
+import statistics
+import threading
+import collections
+
+from effis.composition.runner import UseRunner, WalltimeSeconds, slurm
+from effis.composition.application import Application
+from effis.composition.artifact import Artifact
+from effis.composition.util import ListType
+from effis.composition.events import EventLoop
+from effis.composition.dag import DAG
+from effis.composition.resources import DetectResources, Request, Pool, MemoryMB, ProcessRSS
+from effis.composition.history import OpenHistory
+from effis.composition.journal import Journal
+from effis.composition.artifact import Watcher
+from effis.composition.inbox import Inbox
+from effis.composition.functions import Workers, FunctionCall
+from effis.composition import channels
+from effis.composition.launcher import Launcher
+from effis.composition.agents import Agents
+from effis.composition.cache import OpenCache, Cached, Inputs
+from effis.composition.log import CompositionLogger
+
+
+# Applications finishing in one Scheduler can release dependents waiting in another one
+Waiters = {}
+WaitersLock = threading.Lock()
+
+
+def Finished(app):
+    if ('State' in app.__dir__()) and (app.State == "CANCELLED"):
+        return True
+    return ('Status' in app.__dir__()) and (app.Status is not None)
+
+
+def Succeeded(app):
+    return ('Status' in app.__dir__()) and (app.Status == 0)
+
+
+def Subscribe(app, callback):
+    """
+    Call callback() once app has finished (immediately if it already has)
+    """
+    with WaitersLock:
+        if not Finished(app):
+            Waiters.setdefault(id(app), []).append(callback)
+            return
+    callback()
+
+
+def Future(app):
+    """
+    asyncio future (in the running asyncio loop) that is set to app once it has finished
+    """
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+
+    def Set():
+        if not future.done():
+            future.set_result(app)
+
+    Subscribe(app, lambda: loop.call_soon_threadsafe(Set))
+    return future
+
+
+def Notify(app):
+    with WaitersLock:
+        callbacks = Waiters.pop(id(app), [])
+    for callback in callbacks:
+        callback()
+
+
+class Scheduler:
+    """
+    Event-driven execution engine behind Workflow.SubSubmit().
+    Applications come off the DAG's Ready queue once their dependencies have finished, and launch if their Group has room;
+    in between, the scheduler sleeps in its EventLoop until a process exits.
+    Several Schedulers can share one EventLoop and one Pool (see Executor): Start() them, and they call back once they're through.
+    environment replaces this process's own for the Applications (e.g. the submitter's, in the executor daemon).
+    """
+
+    #: Safety factor applied to a measured memory footprint when it's used for admission
+    MemoryHeadroom = 1.25
+
+    #: Runs real processes (and takes new Applications while it does)
+    Live = True
+
+
+    def __init__(self, workflow, loop=None, pool=None, environment=None):
+        self.Workflow = workflow
+        self.Environment = environment
+        self.Callback = None
+
+        self.OwnLoop = (loop is None)
+        if self.OwnLoop:
+            loop = EventLoop()
+        self.loop = loop
+
+        self.Journal = self.OpenJournal()
+        self.Graph = DAG(self.Workflow.Applications, Finished, clock=self.loop.Now, ready=self.Ready, succeeded=Succeeded)
+
+        # Estimates from past runs (History) and from this one (Runtimes)
+        self.History = OpenHistory(self.Workflow.History)
+        self.Past = {}
+        if self.History is not None:
+            for app in self.Graph.Applications:
+                if not Finished(app):
+                    self.Past[id(app)] = self.History.Estimate(app)
+        self.Runtimes = {}
+        if self.Workflow.Priority == "CriticalPath":
+            self.Graph.CriticalPath([self.Estimate(app) for app in self.Graph.Applications])
+
+        self.GroupRunning = {}
+        self.GroupWaiting = {}
+        self.GroupSize = {}
+        for app in self.Workflow.Applications:
+            self.AddGroup(app)
+
+        # Straggler mode: finished members' runtimes, checks on running members, their speculative copies,
+        # copies that finished first, and copies stopped because the original did (and not yet exited)
+        self.GroupTimes = {}
+        self.GroupDone = {}
+        self.Watching = {}
+        self.Copies = {}
+        self.Won = {}
+        self.Dying = 0
+
+        self.Pool = None
+        self.Shared = False
+        if (pool is not None) and (self.Workflow.Resources is not False):
+            # Other Workflows use it too, so their Applications finishing can make room for ours
+            self.Pool = pool
+            self.Shared = True
+            self.Pool.Listeners += [self.Released]
+        else:
+            resources = self.Allocation()
+            if resources is not None:
+                if resources['MemoryPerNode'] is not None:
+                    resources['MemoryPerNode'] = MemoryMB(resources['MemoryPerNode'])
+                self.Pool = Pool(resources)
+                CompositionLogger.Debug("Workflow Name={0} resources: {1}".format(self.Workflow.Name, resources))
+        self.Placements = {}
+        self.ResourceWaiting = []
+
+        # Peak memory seen for each cmd, from finished Applications
+        self.Running = {}
+        self.Learned = {}
+        self.Sampler = None
+
+        # Warm Python processes for Applications with a Function (started with the first one)
+        self.Workers = None
+
+        # Shared-memory channels between Applications are named within the Workflow
+        self.Channels = channels.Scope(self.Workflow.Directory if self.Workflow.Directory is not None else str(id(self.Workflow)))
+
+        # Processes are started off the loop, from argv/environments worked out up front
+        self.Launcher = Launcher(
+            threads=self.Workflow.LaunchThreads,
+            rate=self.Workflow.LaunchRate,
+            environment={'EFFIS_CHANNELS': self.Channels},
+            snapshot=self.Workflow.SnapshotSetup,
+            base=self.Environment,
+        )
+        self.Launching = 0
+        if self.Live and self.Workflow._CreateCalled_:
+            for app in self.Graph.Applications:
+                if (not Finished(app)) and (app.Function is None):
+                    self.Launcher.Prepare(app, direct=self.Direct(app))
+
+        # Per-node agents starting single-rank Applications (started with the Scheduler)
+        self.Agents = None
+
+        # Results of earlier runs to reuse instead of running Applications again
+        self.Cache = None
+        if self.Live and self.Workflow._CreateCalled_:
+            self.Cache = OpenCache(self.Workflow.Cache, size=self.Workflow.CacheSize, age=self.Workflow.CacheAge)
+        self.Keys = {}
+
+        # Timeout (then SIGKILL) timers of running Applications, and which ones have run out of time
+        self.Timers = {}
+        self.TimedOut = set()
+
+        # Runs so far of each Application, for retries
+        self.Attempts = {}
+
+        # Applications that can't finish before the batch job ends are held back (for a continuation job)
+        self.JobLength = None
+        self.Deadline = self.FindDeadline()
+        self.Deferred = []
+        self.Stalled = False
+
+        # Dependencies on Applications outside of this Workflow can't be seen finishing by this loop
+        self.Outside = 0
+        for i, dep in self.Graph.External:
+            self.Subscribe(i, dep)
+
+        # Retries waiting out their backoff
+        self.Retrying = 0
+
+        # Data dependencies are satisfied by files showing up; once nothing is left running that could write them, they're given up on
+        self.Watcher = None
+        self.Unsatisfied = {}
+        self.IdleSince = None
+        self.GiveUpTimer = None
+        self.WatchArtifacts(self.Graph.Artifacts)
+
+        # Applications added while running: handed over from other threads (Post), or other processes (Inbox)
+        self.Inbox = None
+        self.Posted = 0
+        self.PostLock = threading.Lock()
+        self.Closed = False
+
+
+    def Allocation(self):
+        """
+        Resources to admit Applications against, when not sharing a pool (None: launch them as soon as they're ready)
+        """
+        if (self.Workflow.Resources in (None, False)) and (not self.Workflow.Agents):
+            return None
+        # Agents place Applications on nodes, so they need the inventory too
+        resources = DetectResources()
+        if isinstance(self.Workflow.Resources, dict):
+            resources.update(self.Workflow.Resources)
+        return resources
+
+
+    def OpenJournal(self):
+        if not self.Workflow._CreateCalled_:
+            return None
+        return Journal(self.Workflow._journalname_, loop=self.loop)
+
+
+    def OpenInbox(self):
+        if not self.Workflow._CreateCalled_:
+            return None
+        return Inbox(self.loop, self.Workflow._inboxname_, self.Add)
+
+
+    def Record(self, event, app=None, sync=False, **fields):
+        """
+        Append event (about app) to the Workflow's journal
+        """
+        if self.Journal is None:
+            return
+        if app is not None:
+            fields['app'] = app.Name
+            if 'index' not in fields:
+                fields['index'] = self.Graph.Index[id(app)]
+        self.Journal.Write(event, sync=sync, **fields)
+
+
+    def Ready(self, i):
+        # Called from the DAG, including while it's being built
+        self.Record("ready", app=self.Workflow.Applications[i], index=i)
+
+
+    def AddGroup(self, app):
+        if app.Group is None:
+            return
+        if app.Group not in self.GroupRunning:
+            self.GroupRunning[app.Group] = []
+            self.GroupWaiting[app.Group] = collections.deque()
+            self.GroupSize[app.Group] = 0
+        self.GroupSize[app.Group] += 1
+
+
+    def Post(self, app):
+        """
+        Thread-safe: add app to the running Workflow. Returns False if the scheduler has already finished.
+        """
+        with self.PostLock:
+            if self.Closed:
+                return False
+            self.Posted += 1
+        self.loop.Call(self.Received, app)
+        return True
+
+
+    def Received(self, app):
+        self.Posted -= 1
+        self.Add(app)
+
+
+    def Add(self, app):
+        """
+        Take on a new Application while running (in the loop thread)
+        """
+
+        if app.Name is None:
+            super(UseRunner, app).__setattr__('Name', os.path.basename(app.cmd))
+
+        # Applications sent from other processes depend on copies: match them up by Name
+        names = {}
+        for other in self.Graph.Applications:
+            names[other.Name] = other
+        deps = []
+        for dep in app.DependsOn:
+            if isinstance(dep, Application) and (id(dep) not in self.Graph.Index) and (dep.Name in names):
+                dep = names[dep.Name]
+            deps += [dep]
+        super(UseRunner, app).__setattr__('DependsOn', ListType(deps, (Application, Artifact), key="DependsOn"))
+
+        self.Workflow.Applications += app
+        self.Workflow.SetAppDirectories([app])
+        if not os.path.exists(app.Directory):
+            os.makedirs(app.Directory)
+        app.CopyInput()
+
+        i = self.Graph.Add(app, Finished, Succeeded)
+        self.AddGroup(app)
+        if self.History is not None:
+            self.Past[id(app)] = self.History.Estimate(app)
+        if self.Graph.Priority is not None:
+            self.Graph.CriticalPath([self.Estimate(other) for other in self.Graph.Applications])
+        self.Record("add", app=app, directory=app.Directory, DependsOn=[dep.Name if isinstance(dep, Application) else dep.path for dep in app.DependsOn])
+        CompositionLogger.Info("Application Name = {0} -- Added to running Workflow Name={1}".format(app.Name, self.Workflow.Name))
+
+        if i in self.Graph.Skip:
+            CompositionLogger.Warning("Application Name = {0} -- Something it depends on didn't finish successfully; cancelling it".format(app.Name))
+            self.Cancelled([app], "DependsOn")
+            self.Schedule()
+            return
+
+        for j, dep in self.Graph.External:
+            if j == i:
+                self.Subscribe(i, dep)
+        self.WatchArtifacts([(j, artifact) for j, artifact in self.Graph.Artifacts if j == i])
+        if self.Graph.Remaining[i] == 0:
+            self.Graph.Push(i)
+        self.Schedule()
+
+
+    def Subscribe(self, i, dep):
+        self.Outside += 1
+        Subscribe(dep, lambda: self.loop.Call(self.OutsideFinished, i, dep))
+
+
+    def OutsideFinished(self, i, dep):
+        self.Outside -= 1
+        if not Succeeded(dep):
+            cancelled = [self.Graph.Applications[j] for j in self.Graph.Drop(i)]
+            if len(cancelled) > 0:
+                CompositionLogger.Warning(
+                    "Application Name = {0} (another Workflow) -- {1}; cancelling what depends on it: {2}".format(dep.Name, dep.__dict__.get('State'), ", ".join([app.Name for app in cancelled]))
+                )
+            self.Cancelled(cancelled, dep.Name)
+            self.Schedule()
+            return
+        self.ExternalFinished(i)
+
+
+    def WatchArtifacts(self, artifacts):
+        for i, artifact in artifacts:
+            if i in self.Graph.Skip:
+                continue
+            if self.Watcher is None:
+                self.Watcher = Watcher(self.loop, self.Workflow.Directory)
+            key = (i, id(artifact))
+            self.Unsatisfied[key] = artifact
+            self.Watcher.Add(artifact, lambda i=i, key=key: self.ArtifactFinished(i, key))
+
+
+    def ArtifactFinished(self, i, key):
+        if self.Unsatisfied.pop(key, None) is None:
+            # Given up on already
+            return
+        self.ExternalFinished(i)
+
+
+    def Idle(self):
+        """
+        Nothing is running or about to run, so nothing in the Workflow can still write the Artifacts left to wait for
+        """
+        return (
+            (len(self.Running) == 0) and (self.Launching == 0) and (len(self.Graph.Ready) == 0) and (len(self.ResourceWaiting) == 0) and
+            (len(self.Deferred) == 0) and (self.Retrying == 0) and (self.Posted == 0) and (self.Outside == 0)
+        )
+
+
+    def Starved(self):
+        """
+        Give up on Artifacts (after their timeouts) once the Workflow has gone idle waiting for them
+        """
+        if not self.Idle():
+            self.IdleSince = None
+            if self.GiveUpTimer is not None:
+                self.GiveUpTimer.Cancel()
+                self.GiveUpTimer = None
+            return
+        if self.IdleSince is None:
+            self.IdleSince = self.loop.Now()
+
+        waited = self.loop.Now() - self.IdleSince
+        later = None
+        for key, artifact in list(self.Unsatisfied.items()):
+            i = key[0]
+            if (key not in self.Unsatisfied) or (artifact.timeout is None):
+                continue
+            elif waited >= artifact.timeout:
+                self.GiveUp(i, artifact)
+            elif (later is None) or (artifact.timeout - waited < later):
+                later = artifact.timeout - waited
+
+        if (later is not None) and (self.GiveUpTimer is None):
+            self.GiveUpTimer = self.loop.Later(later, self.Recheck)
+
+
+    def Recheck(self):
+        self.GiveUpTimer = None
+        self.Schedule()
+
+
+    def GiveUp(self, i, artifact):
+        app = self.Graph.Applications[i]
+        for key in [key for key in self.Unsatisfied if key[0] == i]:
+            self.Unsatisfied.pop(key)
+        cancelled = [self.Graph.Applications[j] for j in self.Graph.Drop(i)]
+        CompositionLogger.Warning(
+            "Application Name = {0} -- Nothing left running could write {1}; cancelling: {2}".format(app.Name, artifact.path, ", ".join([dep.Name for dep in cancelled]))
+        )
+        self.Cancelled(cancelled, artifact.path)
+
+
+    def Estimate(self, app):
+        """
+        Expected runtime (seconds): the Application's EstimatedRuntime, else its recorded History,
+        else what its cmd has taken so far in this run, else 1
+        """
+        past = self.Past.get(id(app))
+        if app.EstimatedRuntime is not None:
+            return float(app.EstimatedRuntime)
+        elif (past is not None) and (past['Runtime'] is not None):
+            return past['Runtime']
+        elif app.cmd in self.Runtimes:
+            return sum(self.Runtimes[app.cmd]) / len(self.Runtimes[app.cmd])
+        else:
+            return 1.0
+
+
+    def FindDeadline(self):
+        """
+        When the current batch job ends (None if unknown or not in one)
+        """
+        if isinstance(self.Workflow.Runner, slurm) and (self.Workflow.Walltime is not None):
+            self.JobLength = WalltimeSeconds(self.Workflow.Walltime)
+        if "SLURM_JOB_END_TIME" in os.environ:
+            return float(os.environ["SLURM_JOB_END_TIME"])
+        elif self.JobLength is not None:
+            return float(os.environ.get("SLURM_JOB_START_TIME", self.loop.Now())) + self.JobLength
+        return None
+
+
+    def FitsWalltime(self, app):
+        if self.Deadline is None:
+            return True
+        needed = self.Estimate(app) + self.Workflow.WalltimeMargin
+        if (self.JobLength is not None) and (needed > self.JobLength):
+            # Would never fit in any job of this size, so waiting for another one doesn't help
+            return True
+        return self.loop.Now() + needed <= self.Deadline
+
+
+    def ExternalFinished(self, i):
+        self.Graph.Satisfy(i)
+        self.Schedule()
+
+
+    def Limit(self, app):
+        """
+        Seconds app may run (None for no limit)
+        """
+        if app.Timeout is not None:
+            return app.Timeout
+        return self.Workflow.Timeout
+
+
+    def Expired(self, app, proc):
+        if id(app) not in self.Running:
+            return
+        CompositionLogger.Warning("Application Name = {0} -- Timed out after {1} s; sending SIGTERM".format(app.Name, self.Limit(app)))
+        self.TimedOut.add(id(app))
+        self.Record("timeout", app=app)
+        proc.terminate()
+        self.Timers[id(app)] = self.loop.Later(self.Workflow.KillGrace, self.Kill, app, proc)
+
+
+    def Kill(self, app, proc):
+        if id(app) not in self.Running:
+            return
+        CompositionLogger.Warning("Application Name = {0} -- Still running {1} s after SIGTERM; sending SIGKILL".format(app.Name, self.Workflow.KillGrace))
+        proc.kill()
+
+
+    def GroupFull(self, app):
+        return (app.Group is not None) and (app.Group in self.Workflow.GroupMax) and (len(self.GroupRunning[app.Group]) >= self.Workflow.GroupMax[app.Group])
+
+
+    def Join(self, app):
+        """
+        Take a slot in app's Group as soon as it's launched (starting the process happens later, off the loop)
+        """
+        if app.Group is not None:
+            self.GroupRunning[app.Group] += [id(app)]
+
+
+    def Leave(self, app):
+        if app.Group is None:
+            return
+        self.GroupRunning[app.Group].remove(id(app))
+        if len(self.GroupWaiting[app.Group]) > 0:
+            self.Graph.Push(self.Graph.Index[id(self.GroupWaiting[app.Group].popleft())])
+
+
+    def Admit(self, app):
+        """
+        Reserve the cores/GPUs app needs, if they are free
+        """
+        if self.Pool is None:
+            return True
+        memory = None
+        past = self.Past.get(id(app))
+        if app.cmd in self.Learned:
+            memory = self.Learned[app.cmd] * self.MemoryHeadroom
+        elif (past is not None) and (past['PeakMemory'] is not None):
+            memory = past['PeakMemory'] * self.MemoryHeadroom
+        placement = self.Pool.Acquire(Request(app, memory=memory))
+        if placement is None:
+            return False
+        self.Placements[id(app)] = placement
+        return True
+
+
+    def Free(self, app):
+        if id(app) in self.Placements:
+            self.Pool.Release(self.Placements.pop(id(app)))
+        self.Unwait()
+
+
+    def Unwait(self):
+        for waiting in self.ResourceWaiting:
+            self.Graph.Push(self.Graph.Index[id(waiting)])
+        self.ResourceWaiting = []
+
+
+    def Released(self):
+        # Something (maybe another Workflow's Application) gave resources back to a shared pool
+        if len(self.ResourceWaiting) > 0:
+            self.loop.Call(self.Unblock)
+
+
+    def Unblock(self):
+        if self.Closed:
+            return
+        self.Unwait()
+        self.Schedule()
+
+
+    def Done(self):
+        return self.Graph.Done() and (self.Posted == 0) and (self.Dying == 0)
+
+
+    def Schedule(self):
+        """
+        Launch everything that is able to run right now.
+        Whatever doesn't fit waits for resources to free up; with Backfill, smaller Applications further back in the queue go around it,
+        until it has waited BackfillWait (so a large Application isn't starved by a stream of small ones).
+        """
+        app = self.Graph.Pop()
+        while app is not None:
+            if not self.FitsWalltime(app):
+                CompositionLogger.Info("Application Name = {0} -- Not enough walltime left; deferring".format(app.Name))
+                self.Record("defer", app=app)
+                self.Deferred += [app]
+            elif self.GroupFull(app):
+                self.GroupWaiting[app.Group].append(app)
+            elif not self.Admit(app):
+                self.ResourceWaiting += [app]
+                if (not self.Workflow.Backfill) or self.Overdue(app):
+                    break
+            else:
+                self.Launch(app)
+            app = self.Graph.Pop()
+
+        if (
+            (len(self.Running) == 0) and (self.Launching == 0) and (len(self.Graph.Ready) == 0) and (len(self.ResourceWaiting) == 0) and
+            (self.Retrying == 0) and (self.Posted == 0) and (len(self.Deferred) > 0)
+        ):
+            # Whatever is still waiting on Artifacts or on other Workflows is left to the continuation job too, which watches for them again
+            self.Stalled = True
+
+        if len(self.Unsatisfied) > 0:
+            self.Starved()
+
+        if (self.Callback is not None) and (self.Done() or self.Stalled):
+            callback, self.Callback = self.Callback, None
+            self.loop.Call(callback, self)
+
+
+    def Overdue(self, app):
+        """
+        Whether app has waited for resources long enough that nothing else should start ahead of it
+        """
+        if self.Workflow.BackfillWait is None:
+            return False
+        ready = self.Graph.ReadyTime[self.Graph.Index[id(app)]]
+        return (ready is not None) and (self.loop.Now() - ready >= self.Workflow.BackfillWait)
+
+
+    def Direct(self, app):
+        """
+        Whether app goes to its node's agent instead of through its Runner: single-rank Applications, when the Workflow uses Agents
+        """
+        return self.Workflow.Agents and (self.Pool is not None) and (app.Function is None) and (app.Runner is not None) and (Request(app).Ranks == 1)
+
+
+    def Launch(self, app):
+        launch = self.loop.Now()
+        self.Launching += 1
+        self.Join(app)
+        if self.Cacheable(app):
+            # Hashing what it takes in (and copying a hit into place) can take a while, so it's done in the cache's thread
+            self.Cache.Lookup(
+                app, self.Workflow.Directory,
+                lambda key, cached: self.loop.Call(self.Looked, app, launch, key, cached),
+                link=self.Workflow.CacheLink,
+            )
+        else:
+            self.Dispatch(app, launch)
+
+
+    def Looked(self, app, launch, key, cached):
+        self.Keys[id(app)] = key
+        if cached is not None:
+            CompositionLogger.Info("Application Name = {0} -- Result found in the cache; not running it".format(app.Name))
+            self.Record("cached", key=key, app=app)
+            self.Started(app, cached, launch)
+        else:
+            self.Dispatch(app, launch)
+
+
+    def Dispatch(self, app, launch):
+        """
+        Start app's process (or Function call)
+        """
+
+        # Retries add to the first attempt's log
+        append = (id(app) in self.Attempts)
+
+        if app.Function is not None:
+            self.Started(app, self.Call(app, append=append), launch)
+        elif (self.Agents is not None) and self.Direct(app):
+            self.Delegate(app, launch, append)
+        else:
+            self.Launcher.Submit(app, lambda proc, stdout: self.loop.Call(self.Started, app, proc, launch, stdout), append=append)
+
+
+    def Cacheable(self, app):
+        # Only Applications with a Directory of their own: everything in it is taken to be the result
+        return (self.Cache is not None) and app.Cache and (app.Directory != self.Workflow.Directory)
+
+
+    def Delegate(self, app, launch, append=False):
+        """
+        Have the agent of the node app was placed on start it, on the cores/GPUs reserved for it
+        """
+        cmd, environment, msg = self.Launcher.Prepare(app, direct=True)
+        node, cores, gpus, memory = self.Placements[id(app)][0]
+        logfile = None
+        if app.LogFile is not None:
+            logfile = os.path.join(app.Directory, app.LogFile)
+        CompositionLogger.Info(msg + " (agent on node {0})".format(node))
+        self.Agents.Submit(node, cores, gpus, cmd, app.Directory, environment, logfile, append, lambda proc: self.Started(app, proc, launch))
+
+
+    def Started(self, app, proc, launch, stdout=None):
+        """
+        app's process is up (or is already through, with a Failed or Cached stand-in)
+        """
+        self.Launching -= 1
+        if (app.Function is None) or isinstance(proc, Cached):
+            super(UseRunner, app).__setattr__('stdout', stdout)
+
+        self.Track(app, proc, launch)
+        if self.Limit(app) is not None:
+            self.Timers[id(app)] = self.loop.Later(self.Limit(app), self.Expired, app, proc)
+        if (self.Workflow.SampleMemory > 0) and (self.Sampler is None):
+            self.Sampler = self.loop.Later(self.Workflow.SampleMemory, self.Sample)
+        self.Stragglers(app.Group)
+
+        if proc.returncode is not None:
+            self.loop.Call(self.Exited, app, proc)
+        else:
+            self.loop.WatchProcess(proc, lambda proc: self.Exited(app, proc))
+
+
+    def Spawn(self, app, append=False, cache=True):
+        """
+        Start app's process right away (in the loop thread)
+        """
+        if app.Function is not None:
+            return self.Call(app, append=append)
+        proc, stdout = self.Launcher.Spawn(app, append=append, cache=cache)
+        super(UseRunner, app).__setattr__('stdout', stdout)
+        return proc
+
+
+    def Call(self, app, append=False):
+        """
+        Hand app's Function to the worker pool (no interpreter startup, and the Workflow's Preload modules are already imported)
+        """
+        if self.Workers is None:
+            size = self.Workflow.Workers
+            if size is None:
+                size = os.cpu_count() if self.Pool is None else self.Pool.Resources['CoresPerNode']
+            self.Workers = Workers(self.loop, size, preload=self.Workflow.Preload)
+        super(UseRunner, app).__setattr__('stdout', None)
+        CompositionLogger.Info("Application Name = {0} -- Calling: {1}".format(app.Name, app.cmd))
+        return self.Workers.Submit(app, append=append, environment={**(self.Environment or {}), 'EFFIS_CHANNELS': self.Channels})
+
+
+    def Stragglers(self, group):
+        """
+        (Re)schedule the straggler check of group's running members: once enough of the Group has finished,
+        a member running longer than the Workflow's Speculate factor x the Group's median runtime gets a duplicate
+        """
+        if (group not in self.Workflow.Speculate) or (len(self.GroupTimes.get(group, [])) == 0):
+            return
+        if self.GroupDone[group] < self.Workflow.SpeculateAfter * self.GroupSize[group]:
+            return
+        cutoff = self.Workflow.Speculate[group] * statistics.median(self.GroupTimes[group])
+        for app in self.Running.values():
+            if (app.Group != group) or (id(app) in self.Copies) or (id(app) in self.Won):
+                continue
+            if id(app) in self.Watching:
+                self.Watching[id(app)].Cancel()
+            self.Watching[id(app)] = self.loop.Later(app.StartTime + cutoff - self.loop.Now(), self.Speculate, app)
+
+
+    def Speculate(self, app):
+        """
+        Start a duplicate of straggling app in <Directory>.speculative
+        """
+        self.Watching.pop(id(app), None)
+        if (id(app) not in self.Running) or (id(app) in self.Copies):
+            return
+        if app.Directory == self.Workflow.Directory:
+            CompositionLogger.Debug("Application Name = {0} -- Not speculating without its own directory (Subdirs=False)".format(app.Name))
+            return
+
+        dup = copy.copy(app)
+        super(UseRunner, dup).__setattr__('Directory', app.Directory + ".speculative")
+        if not self.Admit(dup):
+            # Looked at again when the next Group member finishes
+            return
+
+        shutil.rmtree(dup.Directory, ignore_errors=True)
+        os.makedirs(dup.Directory)
+        for kind in ('Input', 'SetupFile'):
+            for item in getattr(app, kind):
+                if item.outpath is None:
+                    continue
+                outpath = os.path.join(dup.Directory, os.path.relpath(item.outpath, app.Directory))
+                if not os.path.exists(os.path.dirname(outpath)):
+                    os.makedirs(os.path.dirname(outpath))
+                if item.link:
+                    os.symlink(os.path.abspath(item.inpath), outpath)
+                elif os.path.isdir(item.inpath):
+                    shutil.copytree(item.inpath, outpath)
+                else:
+                    shutil.copy(item.inpath, outpath)
+
+        CompositionLogger.Warning("Application Name = {0} -- Straggling; starting a speculative copy in {1}".format(app.Name, dup.Directory))
+        proc = self.Spawn(dup, cache=False)
+        self.Copies[id(app)] = (dup, proc)
+        self.Record("speculate", app=app, pid=proc.pid, directory=dup.Directory)
+        self.loop.WatchProcess(proc, lambda proc: self.CopyExited(app, dup, proc))
+
+
+    def CopyExited(self, app, dup, proc):
+        if dup.stdout is not None:
+            dup.stdout.close()
+        self.Free(dup)
+
+        if (id(app) in self.Copies) and (self.Copies[id(app)][0] is dup):
+            self.Copies.pop(id(app))
+            # The copy finished first: it's the result, and the original is stopped
+            CompositionLogger.Info("Application Name = {0} -- Speculative copy finished first; stopping the original".format(app.Name))
+            self.Record("speculative-win", app=app, status=proc.returncode)
+            self.Won[id(app)] = proc
+            timer = self.Timers.pop(id(app), None)
+            if timer is not None:
+                timer.Cancel()
+            app.procid.terminate()
+            self.Timers[id(app)] = self.loop.Later(self.Workflow.KillGrace, self.Kill, app, app.procid)
+        else:
+            self.Dying -= 1
+            shutil.rmtree(dup.Directory, ignore_errors=True)
+
+        self.Schedule()
+
+
+    def Settle(self, app, proc):
+        """
+        Sort out a straggler and its copy once the original exits; returns the process whose result counts
+        """
+        if id(app) in self.Watching:
+            self.Watching.pop(id(app)).Cancel()
+
+        if id(app) in self.Won:
+            # Swap in the copy's directory
+            self.TimedOut.discard(id(app))
+            straggler = app.Directory + ".straggler"
+            os.rename(app.Directory, straggler)
+            os.rename(app.Directory + ".speculative", app.Directory)
+            shutil.rmtree(straggler, ignore_errors=True)
+            return self.Won.pop(id(app))
+
+        if id(app) in self.Copies:
+            dup, copyproc = self.Copies.pop(id(app))
+            CompositionLogger.Info("Application Name = {0} -- Original finished first; stopping the speculative copy".format(app.Name))
+            copyproc.kill()
+            self.Dying += 1
+
+        return proc
+
+
+    def Track(self, app, proc, launch):
+        """
+        Bookkeeping for a newly started Application
+        """
+        self.Attempts[id(app)] = self.Attempts.get(id(app), 0) + 1
+        super(UseRunner, app).__setattr__('procid', proc)
+        super(UseRunner, app).__setattr__('Status', None)
+        super(UseRunner, app).__setattr__('State', "RUNNING")
+        super(UseRunner, app).__setattr__('PeakMemory', None)
+        super(UseRunner, app).__setattr__('StartTime', self.loop.Now())
+        super(UseRunner, app).__setattr__('LaunchLatency', app.StartTime - launch)
+        super(UseRunner, app).__setattr__('QueueWait', launch - self.Graph.ReadyTime[self.Graph.Index[id(app)]])
+        self.Running[id(app)] = app
+        self.Record("launch", app=app, pid=proc.pid, directory=getattr(app, 'Directory', None), attempt=self.Attempts[id(app)])
+
+
+    def Sample(self):
+        """
+        Record the resident memory of everything running (the process tree visible on this node)
+        """
+        self.Sampler = None
+        for app in self.Running.values():
+            if app.procid.pid is None:
+                continue
+            rss = ProcessRSS(app.procid.pid)
+            if (app.PeakMemory is None) or (rss > app.PeakMemory):
+                super(UseRunner, app).__setattr__('PeakMemory', rss)
+        if len(self.Running) > 0:
+            self.Sampler = self.loop.Later(self.Workflow.SampleMemory, self.Sample)
+
+
+    def Finish(self, app):
+        self.Workflow.FinishCloseFile(app)
+
+
+    def Exited(self, app, proc):
+        timer = self.Timers.pop(id(app), None)
+        if timer is not None:
+            timer.Cancel()
+        result = self.Settle(app, proc)
+        if id(app) in self.TimedOut:
+            self.TimedOut.discard(id(app))
+            state = "TIMEOUT"
+        elif result.returncode == 0:
+            state = "COMPLETED"
+        else:
+            state = "FAILED"
+        super(UseRunner, app).__setattr__('Status', result.returncode)
+        super(UseRunner, app).__setattr__('State', state)
+        if isinstance(result, (FunctionCall, Cached)):
+            super(UseRunner, app).__setattr__('Result', result.Result)
+        key = self.Keys.pop(id(app), None)
+        if (state == "COMPLETED") and (key is not None) and (not isinstance(result, Cached)):
+            self.Cache.Store(key, app, exclude=Inputs(app), result=app.Result if app.Function is not None else None)
+        # What depends on it is keyed on this, rather than on what's in its Directory
+        super(UseRunner, app).__setattr__('CacheKey', key if state == "COMPLETED" else None)
+        super(UseRunner, app).__setattr__('EndTime', self.loop.Now())
+        self.Record("exit", app=app, status=app.Status, state=app.State, runtime=app.EndTime - app.StartTime, peakmemory=app.PeakMemory)
+        # A result out of the cache says nothing about how long the Application takes
+        if not isinstance(result, Cached):
+            self.Runtimes.setdefault(app.cmd, []).append(app.EndTime - app.StartTime)
+        if (self.History is not None) and (not isinstance(result, Cached)):
+            self.History.Record(
+                app,
+                workflow=self.Workflow.Name,
+                start=app.StartTime,
+                queuewait=app.QueueWait,
+                launchlatency=app.LaunchLatency,
+                runtime=app.EndTime - app.StartTime,
+                peakmemory=app.PeakMemory,
+                status=app.Status,
+            )
+        del self.Running[id(app)]
+        if app.PeakMemory is not None:
+            self.Learned[app.cmd] = max(self.Learned.get(app.cmd, 0), app.PeakMemory)
+        self.Leave(app)
+        if app.Group is not None:
+            if state == "COMPLETED":
+                self.GroupTimes.setdefault(app.Group, []).append(app.EndTime - app.StartTime)
+            self.GroupDone[app.Group] = self.GroupDone.get(app.Group, 0) + 1
+            self.Stragglers(app.Group)
+        self.Finish(app)
+        self.Free(app)
+
+        if self.Retry(app):
+            delay = app.RetryBackoff * 2 ** (self.Attempts[id(app)] - 1)
+            CompositionLogger.Warning("Application Name = {0} -- {1} (status {2}); retrying in {3} s".format(app.Name, app.State, app.Status, delay))
+            self.Record("retry", app=app, attempt=self.Attempts[id(app)], delay=delay)
+            super(UseRunner, app).__setattr__('Status', None)
+            self.Retrying += 1
+            self.loop.Later(delay, self.Requeue, app)
+        else:
+            if app.State != "COMPLETED":
+                self.CancelDownstream(app)
+            self.Graph.Complete(app)
+            Notify(app)
+            self.Consumed(app)
+        self.Schedule()
+
+
+    def Retry(self, app):
+        """
+        Whether a failed app gets another try
+        """
+        if (app.State == "COMPLETED") or (self.Attempts[id(app)] > app.Retries):
+            return False
+        if len(app.RetryOn) == 0:
+            return True
+        return (app.Status in app.RetryOn) or ((app.State == "TIMEOUT") and ("TIMEOUT" in app.RetryOn))
+
+
+    def Requeue(self, app):
+        self.Retrying -= 1
+        i = self.Graph.Index[id(app)]
+        self.Graph.ReadyTime[i] = None
+        self.Graph.Push(i)
+        self.Schedule()
+
+
+    def CancelDownstream(self, app):
+        """
+        app failed for good: cancel what depends on it (directly or not); independent branches carry on
+        """
+        cancelled = [self.Graph.Applications[j] for j in self.Graph.Cancel(self.Graph.Index[id(app)])]
+        if len(cancelled) > 0:
+            CompositionLogger.Warning(
+                "Application Name = {0} -- {1}; cancelling what depends on it: {2}".format(app.Name, app.State, ", ".join([dep.Name for dep in cancelled]))
+            )
+        self.Cancelled(cancelled, app.Name)
+
+
+    def Cancelled(self, cancelled, cause):
+        for dep in cancelled:
+            super(UseRunner, dep).__setattr__('Status', None)
+            super(UseRunner, dep).__setattr__('State', "CANCELLED")
+            self.Record("cancel", app=dep, cause=cause)
+            Notify(dep)
+            self.Consumed(dep)
+
+
+    def Consumed(self, app):
+        """
+        app is through: free the channels of whatever it depended on (and its own) that nothing still running or waiting will read
+        """
+        for producer in [app] + [dep for dep in app.DependsOn if isinstance(dep, Application) and (id(dep) in self.Graph.Index)]:
+            if len(producer.Publishes) == 0:
+                continue
+            consumers = [self.Graph.Applications[j] for j in self.Graph.Successors[self.Graph.Index[id(producer)]]]
+            if Finished(producer) and all([Finished(consumer) for consumer in consumers]):
+                for name in producer.Publishes:
+                    channels.Free(name, scope=self.Channels)
+                self.Record("free", app=producer, channels=producer.Publishes)
+
+
+    def Summarize(self):
+        states = {}
+        for app in self.Graph.Applications:
+            if 'State' in app.__dir__():
+                states.setdefault(app.State, []).append(app.Name)
+        for state in ("FAILED", "TIMEOUT", "CANCELLED"):
+            if state in states:
+                CompositionLogger.Warning("Workflow Name={0}: {1} Application(s) {2}: {3}".format(self.Workflow.Name, len(states[state]), state, ", ".join(states[state])))
+
+
+    def Start(self, callback=None):
+        """
+        Launch what can run, without waiting on the loop; callback(self) is called (in the loop) once everything has finished or the rest is deferred
+        """
+        self.Callback = callback
+
+        # Depending on an Application (of another Workflow) that already didn't succeed
+        self.Cancelled([self.Graph.Applications[i] for i in self.Graph.Doomed], "DependsOn")
+
+        if self.Live:
+            super(UseRunner, self.Workflow).__setattr__('scheduler', self)
+            self.Inbox = self.OpenInbox()
+            if self.Workflow.Agents and (self.Pool is not None):
+                directory = os.path.join(self.Workflow.Directory, ".agents") if self.Workflow._CreateCalled_ else tempfile.mkdtemp(prefix="effis-agents-")
+                self.Agents = Agents(self.loop, self.Pool.Resources, directory)
+                self.Agents.Start()
+        self.Schedule()
+
+
+    def Close(self):
+        with self.PostLock:
+            self.Closed = True
+        if self.Shared and (self.Released in self.Pool.Listeners):
+            self.Pool.Listeners.remove(self.Released)
+        if self.Live:
+            super(UseRunner, self.Workflow).__setattr__('scheduler', None)
+        if self.Inbox is not None:
+            self.Inbox.Close()
+        if self.Sampler is not None:
+            self.Sampler.Cancel()
+        if self.GiveUpTimer is not None:
+            self.GiveUpTimer.Cancel()
+        if self.History is not None:
+            self.History.Close()
+        if self.Journal is not None:
+            self.Journal.Close()
+        if self.Watcher is not None:
+            self.Watcher.Close()
+        self.Launcher.Close()
+        if self.Cache is not None:
+            self.Cache.Close()
+        if self.Agents is not None:
+            self.Agents.Close()
+        if self.Workers is not None:
+            self.Workers.Close()
+        if self.Live:
+            # Whatever wasn't freed along the way (e.g. left for a continuation job, or after an error)
+            for app in self.Graph.Applications:
+                for name in app.Publishes:
+                    channels.Free(name, scope=self.Channels)
+        if self.OwnLoop:
+            self.loop.Close()
+
+
+    def Run(self):
+        """
+        Returns True if every Application finished (False if some were left for a continuation job)
+        """
+        try:
+            self.Start()
+            while self.Workflow.While((not self.Done()) and (not self.Stalled)):
+                self.loop.RunOnce()
+            if self.Done():
+                self.Summarize()
+            return self.Done()
+        finally:
+            self.Close()
@@ -0,0 +1,210 @@
+"""
+effis.composition.simulate
+"""
+
+import os
+import heapq
+import signal
+import itertools
+
+from effis.composition.runner import UseRunner
+from effis.composition.events import Timer
+from effis.composition.scheduler import Scheduler
+from effis.composition.log import CompositionLogger
+
+
+class SimulatedLoop:
+    """
+    Stand-in for EventLoop with a virtual clock: RunOnce() jumps straight to the next timer
+    """
+
+    def __init__(self):
+        self.Clock = 0.0
+        self.timers = []
+        self.counter = itertools.count()
+
+
+    def Now(self):
+        return self.Clock
+
+
+    def Later(self, delay, callback, *args):
+        timer = Timer(self.Clock + max(delay, 0), callback, args)
+        heapq.heappush(self.timers, (timer.when, next(self.counter), timer))
+        return timer
+
+
+    def Call(self, callback, *args):
+        return self.Later(0, callback, *args)
+
+
+    def RunOnce(self):
+        if len(self.timers) == 0:
+            CompositionLogger.RaiseError(RuntimeError, "Simulation stalled: Applications are waiting on something that never happens")
+        when, count, timer = heapq.heappop(self.timers)
+        if not timer.cancelled:
+            self.Clock = max(self.Clock, when)
+            timer.callback(*timer.args)
+
+
+    def Close(self):
+        self.timers = []
+
+
+class SimulatedProcess:
+    returncode = 0
+    pid = None
+
+    def terminate(self):
+        self.returncode = -signal.SIGTERM
+
+    def kill(self):
+        self.returncode = -signal.SIGKILL
+
+
+class Simulator(Scheduler):
+    """
+    Replays a Workflow's Applications through the Scheduler's dependency, admission and priority logic,
+    with each Application taking its estimated runtime and no processes launched.
+    Run it on a copy of the Workflow (as Workflow.Simulate() does), since Applications get run-time attributes set.
+    """
+
+    Live = False
+
+
+    def __init__(self, workflow):
+
+        for app in workflow.Applications:
+            if app.Name is None:
+                super(UseRunner, app).__setattr__('Name', os.path.basename(app.cmd))
+
+        super().__init__(workflow, loop=SimulatedLoop())
+
+        # Use past runs for estimates, but don't add simulated runs to them
+        if self.History is not None:
+            self.History.Close()
+            self.History = None
+
+        # Dependencies outside of the Workflow are taken to be satisfied up front
+        for i, dep in self.Graph.External:
+            CompositionLogger.Warning("Simulation: treating dependency Name={0} (outside the Workflow) as finished".format(dep.Name))
+            self.loop.Call(self.ExternalFinished, i)
+
+        self.Usage = {'Cores': 0, 'GPUs': 0, 'Memory': 0}
+        self.Timeline = [(0.0, dict(self.Usage))]
+
+
+    def FindDeadline(self):
+        return None
+
+
+    def OpenJournal(self):
+        return None
+
+
+    def WatchArtifacts(self, artifacts):
+        for i, artifact in artifacts:
+            CompositionLogger.Warning("Simulation: treating data dependency {0} as there from the start".format(artifact.path))
+            self.loop.Call(self.ExternalFinished, i)
+
+
+    def Stragglers(self, group):
+        # Simulated runs take their estimates, so nothing straggles
+        pass
+
+
+    def Use(self, placement, sign):
+        for i, cores, gpus, memory in placement:
+            self.Usage['Cores'] += sign * cores
+            self.Usage['GPUs'] += sign * gpus
+            self.Usage['Memory'] += sign * memory
+        self.Timeline += [(self.loop.Now(), dict(self.Usage))]
+
+
+    def Launch(self, app):
+        super(UseRunner, app).__setattr__('stdout', None)
+        self.Join(app)
+        self.Track(app, SimulatedProcess(), self.loop.Now())
+        self.Use(self.Placements.get(id(app), []), 1)
+        runtime = self.Estimate(app)
+        if (self.Limit(app) is not None) and (runtime >= self.Limit(app)):
+            self.TimedOut.add(id(app))
+            app.procid.terminate()
+            runtime = self.Limit(app)
+        self.loop.Later(runtime, self.Exited, app, app.procid)
+
+
+    def Finish(self, app):
+        self.Use(self.Placements.get(id(app), []), -1)
+
+
+    def Report(self):
+        """
+        Predicted makespan, time-averaged utilization of each resource, and stretches with idle cores
+        """
+
+        makespan = self.loop.Now()
+        report = {
+            'Makespan': makespan,
+            'Utilization': {},
+            'IdleGaps': [],
+            'Applications': {},
+        }
+
+        for app in self.Workflow.Applications:
+            report['Applications'][app.Name] = {
+                'Start': app.StartTime,
+                'End': app.EndTime,
+                'QueueWait': app.QueueWait,
+                'State': app.__dict__.get('State'),
+            }
+
+        if self.Pool is None:
+            return report
+
+        capacity = {
+            'Cores': self.Pool.Resources['Nodes'] * self.Pool.Resources['CoresPerNode'],
+            'GPUs': self.Pool.Resources['Nodes'] * self.Pool.Resources['GPUsPerNode'],
+            'Memory': self.Pool.Resources['Nodes'] * self.Pool.Resources['MemoryPerNode'],
+        }
+
+        area = {'Cores': 0.0, 'GPUs': 0.0, 'Memory': 0.0}
+        for (start, usage), (end, after) in zip(self.Timeline, self.Timeline[1:] + [(makespan, None)]):
+            for key in area:
+                area[key] += usage[key] * (end - start)
+
+            idle = capacity['Cores'] - usage['Cores']
+            if (end > start) and (idle > 0):
+                gaps = report['IdleGaps']
+                if (len(gaps) > 0) and (gaps[-1]['End'] == start) and (gaps[-1]['IdleCores'] == idle):
+                    gaps[-1]['End'] = end
+                else:
+                    gaps += [{'Start': start, 'End': end, 'IdleCores': idle}]
+
+        for key in area:
+            if (makespan > 0) and (capacity[key] > 0) and (capacity[key] != float('inf')):
+                report['Utilization'][key] = area[key] / (capacity[key] * makespan)
+            else:
+                report['Utilization'][key] = None
+
+        return report
+
+
+    def Run(self):
+        super().Run()
+        return self.Report()
+
+
+def Summary(report):
+    """
+    Human readable version of a Simulate() report
+    """
+    lines = ["Predicted makespan: {0:.1f} s".format(report['Makespan'])]
+    for key, value in report['Utilization'].items():
+        if value is not None:
+            lines += ["{0} utilization: {1:.1f}%".format(key, 100 * value)]
+    idle = sum([(gap['End'] - gap['Start']) * gap['IdleCores'] for gap in report['IdleGaps']])
+    lines += ["Idle core-seconds: {0:.1f} across {1} gap(s)".format(idle, len(report['IdleGaps']))]
+    for gap in report['IdleGaps']:
+        lines += ["  {0:10.1f} - {1:10.1f} s: {2} core(s) idle".format(gap['Start'], gap['End'], gap['IdleCores'])]
+    return "\n".join(lines)
@@ -58,13 +58,17 @@ class ListType:
     def ErrorMessage(self, given, element=None):
         if element is None:
             element = given
+        if isinstance(self.astype, tuple):
+            names = " or ".join([astype.__name__ for astype in self.astype])
+        else:
+            names = self.astype.__name__
         return (
             "Invalid assignment: {0}={1} --> "
             "Must be given as {2} object or list of {2} objects; "
             "{3} is not.".format(
                 self.key,
                 str(given),
-                self.astype.__name__,
+                names,
                 str(element)
             )
         )
@@ -2,15 +2,17 @@
 effis.composition.workflow
 """
 
+import asyncio
 import datetime
 import os
+import time
 import subprocess
 import threading
 import json
 import sys
 import shutil
-import stat
-import atexit
+import copy
+import socket
 from contextlib import ContextDecorator
 import dill as pickle
 import yaml
@@ -21,6 +23,13 @@ from effis.composition.runner import Detected, UseRunner
 from effis.composition.application import Application
 from effis.composition.backup import Backup
 from effis.composition.campaign import Campaign
+from effis.composition.scheduler import Scheduler, Finished, Future
+from effis.composition.simulate import Simulator, Summary
+from effis.composition.journal import Journal, AppendEvent
+from effis.composition.inbox import SendApplication
+from effis.composition.executor import Submission, Local
+from effis.composition.pilot import Enqueue
+from effis.composition.resources import MemoryMB
 
 from effis.composition.log import CompositionLogger
 from effis.composition.util import ListType, Arguments, InputList
@@ -33,6 +42,28 @@ except:
 """
 
 
+# Background asyncio tasks (keeping references so they aren't garbage collected while running)
+Tasks = set()
+
+
+def Resolve(future, result):
+    """
+    Set an asyncio future to result, or to the exception if result is one
+    """
+    if future.done():
+        return
+    elif isinstance(result, BaseException):
+        future.set_exception(result)
+    else:
+        future.set_result(result)
+
+
+def Background(coroutine):
+    task = asyncio.get_running_loop().create_task(coroutine)
+    Tasks.add(task)
+    task.add_done_callback(Tasks.discard)
+
+
 class Chdir(ContextDecorator):
     """
     Context manager that works with Python's with statement -- changes directory and then returns
@@ -53,7 +84,9 @@ class Chdir(ContextDecorator):
         return None
 
 
-def FindExt(path, files=[], ext=".bp", isdir=True):
+def FindExt(path, files=None, ext=".bp", isdir=True):
+    if files is None:
+        files = []
     if path is None:
         path = "./"
     paths = os.listdir(path)
@@ -123,24 +156,120 @@ class Workflow(UseRunner):
     #: Lets set a max running for the group
     GroupMax = {}
 
+    #: Only start Applications when the cores/GPUs/memory they ask for are free: True detects the allocation (Slurm, or the local machine),
+    #: a dict describes it (anything left out is detected), e.g. {'Nodes': 2, 'CoresPerNode': 64, 'GPUsPerNode': 4, 'MemoryPerNode': "256G"}.
+    #: None (or False) starts whatever is ready right away, as many as there are.
+    Resources = None
+
+    #: Record how Applications ran, for later estimates (Priority, walltime, memory admission, Simulate()):
+    #: True (~/.effis/history.sqlite, or $EFFIS_HISTORY), a file path (e.g. on a local or project filesystem), or False
+    History = False
+
+    #: Seconds between resident memory samples of running Applications, which tighten later memory admission (0 turns sampling off)
+    SampleMemory = 0
+
+    #: Let smaller Applications start in resource gaps ahead of larger ones that are waiting
+    Backfill = True
+
+    #: Seconds an Application can wait for resources with others backfilling around it; after that, nothing more starts ahead of it,
+    #: so what's running drains until it fits (None lets backfilling go on however long it waits)
+    BackfillWait = 600
+
+    #: Order for starting ready Applications when not all of them can start (Resources, GroupMax):
+    #: "Order" (as added) or "CriticalPath" (longest estimated downstream chain first)
+    Priority = "Order"
+
     #: ADIOS Campaign Management – Use campaign other than Directory name
     Campaign = None
 
     #: Workflow-Workflow dependencies
     DependsOn = []
 
+    #: Seconds held back at the end of a batch job; Applications estimated to run past that wait for a continuation job
+    WalltimeMargin = 60
+
+    #: Default Timeout (seconds) for Applications that don't set one; None lets them run as long as they like
+    Timeout = None
+
+    #: Seconds between SIGTERM and SIGKILL when an Application runs past its Timeout
+    KillGrace = 30
+
+    #: Straggler mode, as {Group: factor}: once SpeculateAfter of a Group has finished, a member running longer than factor x the Group's median runtime
+    #: gets a duplicate (in <Directory>.speculative); whichever copy finishes first is kept, and the other is killed
+    Speculate = {}
+
+    #: Fraction of a Group that has to finish before its stragglers get duplicates
+    SpeculateAfter = 0.75
+
+    #: Submit a continuation job (effis-submit --sub --restart) for Applications that didn't fit in the walltime
+    Chain = True
+
+    #: Run (Runner=None) through the effis-executor daemon, sharing its resources with other Workflows, instead of in a thread of this process:
+    #: True for the default socket ($EFFIS_EXECUTOR, else ~/.effis/executor.<host>.sock), or a socket path. The daemon is started if it isn't running.
+    Executor = None
+
+    #: Seconds between checks on batch jobs a (Runner=None) Workflow depends on
+    MonitorInterval = 10
+
+    #: Modules the Python worker pool imports up front, for Applications with a Function (e.g. ["omas", "netCDF4", "adios2", "effis.shim"])
+    Preload = []
+
+    #: Size of the Python worker pool; None uses the cores of a node
+    Workers = None
+
+    #: Threads starting Application processes in parallel
+    LaunchThreads = 4
+
+    #: Most Application launches per second (e.g. to go easy on srun/slurmctld); None doesn't limit them
+    LaunchRate = None
+
+    #: Source each distinct set of SetupFiles once and start Applications straight into the environment it leaves,
+    #: instead of sourcing them (e.g. module loads) at every launch. Only exported variables carry over (not aliases, ulimits, ...);
+    #: a setup file's contents changing means a new snapshot, but not changes to files it sources itself.
+    SnapshotSetup = False
+
+    #: Start one long-lived agent per node (with a single srun in a Slurm allocation; local processes outside one), and hand it the
+    #: single-rank Applications to fork/exec, bound to the cores/GPUs reserved for them, instead of a job step each
+    Agents = False
+
+    #: Submit this many pilot jobs instead of one job running the whole Workflow: the Applications go in a queue in Directory,
+    #: and each pilot (an allocation of the Workflow's size, e.g. small Nodes) runs them as they fit, until the queue is drained.
+    #: More can be added while it runs with effis-pilot submit. Dependencies on the Workflow wait on the first pilot.
+    Pilots = 0
+
+    #: Reuse results from earlier runs: True (~/.effis/cache, or $EFFIS_CACHE) or a directory. An Application whose command, arguments,
+    #: Environment and Input/SetupFile contents (and the outputs of the Applications it depends on) match a cached run gets that run's outputs
+    #: in its Directory instead of running. Applications without a Directory of their own (Subdirs=False), or depending on one, aren't cached.
+    Cache = None
+
+    #: Most the Cache may hold (MB, or with a K/M/G/T suffix); least recently used results go first
+    CacheSize = None
+
+    #: Seconds a cached result is kept after it was last used
+    CacheAge = None
+
+    #: Hard-link cached outputs into Directory instead of copying them (faster, but they mustn't be modified in place)
+    CacheLink = False
+
     # Use MPI MPMD; not supported yet
     MPMD = False
 
     # Appends the current time to the created workflow directory (Might get rid of this)
     TimeIndex = False
 
+    # Set by Submit(): whether it blocks until the Workflow is through (a pickle from before then has this default)
+    Wait = True
+
 
     # Various workflow files
     _touchname_ = "workflow.done"     # Signals workflow finished, can run backup
     _backupname_ = "backup.json"      # Configures the globus movement
     _submitname_ = "workflow.sh"      # File that submits with scheduler
     _picklename_ = "workflow.pickle"  # Saves workflow description
+    _journalname_ = "workflow.journal.jsonl"  # Appended to as things happen (launches, exits, ...)
+    _inboxname_ = "workflow.inbox"  # Other processes drop Applications here to add them while running
+    _queuename_ = "workflow.queue.sqlite"  # Tasks for pilot jobs
+    _pilotname_ = "pilot.sh"          # File that pilot jobs run
 
     # Used with checking for the Runner
     _RunnerError_ = (CompositionLogger.Warning, "No batch queue [Workflow] Runner found, conintuining without one.")
@@ -157,10 +286,46 @@ class Workflow(UseRunner):
         # Throw errors for bad attribute type settings
         if (name in ("Name", "Directory")) and (value is not None) and (type(value) is not str):
             CompositionLogger.RaiseError(ValueError, "Workflow attribute: {0} should be set as a string".format(name))
-        elif name in ("Subdirs", "MPMD", "TimeIndex") and (type(value) is not bool):
+        elif name in ("Subdirs", "MPMD", "TimeIndex", "Backfill", "Chain", "SnapshotSetup", "Agents", "CacheLink") and (type(value) is not bool):
             CompositionLogger.RaiseError(ValueError, "Workflow attribute: {0} should be set as a boolean".format(name))
         elif (name == "GroupMax") and (not isinstance(value, dict)):
             CompositionLogger.RaiseError(ValueError, "Workflow attribute: {0} should be set as a dictionary".format(name))
+        elif (name == "Resources") and (value is not None) and (type(value) is not bool) and (not isinstance(value, dict)):
+            CompositionLogger.RaiseError(ValueError, "Workflow attribute: {0} should be set as a dictionary or a boolean (or None)".format(name))
+        elif (name == "History") and (type(value) is not bool) and (type(value) is not str):
+            CompositionLogger.RaiseError(ValueError, "Workflow attribute: {0} should be set as a boolean or a file path".format(name))
+        elif (name == "Priority") and (value not in ("CriticalPath", "Order")):
+            CompositionLogger.RaiseError(ValueError, "Workflow attribute: {0} should be 'CriticalPath' or 'Order'".format(name))
+        elif (name == "Preload") and ((type(value) is not list) or any([type(module) is not str for module in value])):
+            CompositionLogger.RaiseError(ValueError, "Workflow attribute: {0} should be set as a list of module names".format(name))
+        elif (name == "Cache") and (value is not None) and (type(value) is not bool) and (type(value) is not str):
+            CompositionLogger.RaiseError(ValueError, "Workflow attribute: {0} should be set as a boolean or a directory".format(name))
+        elif (name == "CacheSize") and (value is not None):
+            MemoryMB(value)
+        elif (name == "CacheAge") and (value is not None) and ((not isinstance(value, (int, float))) or isinstance(value, bool) or (value < 0)):
+            CompositionLogger.RaiseError(ValueError, "Workflow attribute: {0} should be set as a non-negative number (of seconds)".format(name))
+        elif (name == "Pilots") and ((type(value) is not int) or (value < 0)):
+            CompositionLogger.RaiseError(ValueError, "Workflow attribute: {0} should be set as a non-negative integer".format(name))
+        elif (name == "LaunchThreads") and ((type(value) is not int) or (value < 1)):
+            CompositionLogger.RaiseError(ValueError, "Workflow attribute: {0} should be set as a positive integer".format(name))
+        elif (name == "LaunchRate") and (value is not None) and ((not isinstance(value, (int, float))) or isinstance(value, bool) or (value <= 0)):
+            CompositionLogger.RaiseError(ValueError, "Workflow attribute: {0} should be set as a positive number (of launches per second)".format(name))
+        elif (name == "Workers") and (value is not None) and ((type(value) is not int) or (value < 1)):
+            CompositionLogger.RaiseError(ValueError, "Workflow attribute: {0} should be set as a positive integer".format(name))
+        elif (name == "Executor") and (value is not None) and (type(value) is not bool) and (type(value) is not str):
+            CompositionLogger.RaiseError(ValueError, "Workflow attribute: {0} should be set as a boolean or a socket path".format(name))
+        elif (name in ("SampleMemory", "WalltimeMargin", "KillGrace", "MonitorInterval")) and ((not isinstance(value, (int, float))) or isinstance(value, bool) or (value < 0)):
+            CompositionLogger.RaiseError(ValueError, "Workflow attribute: {0} should be set as a non-negative number (of seconds)".format(name))
+        elif (name in ("Timeout", "BackfillWait")) and (value is not None) and ((not isinstance(value, (int, float))) or isinstance(value, bool) or (value < 0)):
+            CompositionLogger.RaiseError(ValueError, "Workflow attribute: {0} should be set as a non-negative number (of seconds)".format(name))
+        elif (name == "Speculate") and ((not isinstance(value, dict)) or any([(not isinstance(factor, (int, float))) or isinstance(factor, bool) or (factor < 1) for factor in value.values()])):
+            CompositionLogger.RaiseError(ValueError, "Workflow attribute: {0} should be set as a dictionary of Group: factor (at least 1)".format(name))
+        elif (name == "SpeculateAfter") and ((not isinstance(value, (int, float))) or isinstance(value, bool) or (value < 0) or (value > 1)):
+            CompositionLogger.RaiseError(ValueError, "Workflow attribute: {0} should be set as a fraction between 0 and 1".format(name))
+        elif (name == "Resources") and isinstance(value, dict):
+            for key in value:
+                if key not in ("Nodes", "CoresPerNode", "GPUsPerNode", "MemoryPerNode"):
+                    CompositionLogger.RaiseError(ValueError, "Workflow attribute: {0} does not take key {1}".format(name, key))
 
         # These are for Object types, will throw errors within if necessary
         if name == "SchedulerDirectives":
@@ -235,7 +400,7 @@ class Workflow(UseRunner):
         """
 
         if ('Runner' not in kwargs):
-            if (self.Runner is None) and (not isinstance(self, SubWorkflow)):
+            if ((self.Runner is None) and (not isinstance(self, SubWorkflow))) or ('Function' in kwargs):
                 thisrunner = None
             else:
                 thisrunner = Application.DetectRunnerInfo(useprint=False)
@@ -245,6 +410,38 @@ class Workflow(UseRunner):
         return self.Applications[-1]
 
 
+    def AddApplication(self, app=None, **kwargs):
+        """
+        Add an Application (or make one from kwargs, like Application()) to a Workflow that may already be running; thread-safe.
+        If it's running in this process, the scheduler picks it up right away. Otherwise, once Create() has been called,
+        it goes through the Workflow's inbox directory, so e.g. a process that loaded the Workflow's pickle can add to the effis-submit running it.
+        DependsOn can refer to Applications already in the Workflow, by object or by an Application with the same Name.
+        Once the Workflow has finished (its done marker is there), nothing reads the inbox anymore, so that's an error.
+        """
+
+        if app is None:
+            if ('Runner' not in kwargs) and ((self.Runner is None) or ('Function' in kwargs)):
+                kwargs['Runner'] = None
+            app = Application(**kwargs)
+        elif not isinstance(app, Application):
+            CompositionLogger.RaiseError(ValueError, "Only Application objects can be added to a Workflow object")
+
+        scheduler = self.__dict__.get('scheduler')
+        if (scheduler is not None) and scheduler.Post(app):
+            return app
+        elif self._CreateCalled_:
+            if os.path.exists(self._touchname_):
+                CompositionLogger.RaiseError(
+                    RuntimeError,
+                    "Application Name = {0} -- Workflow Name={1} has already finished; nothing reads its inbox anymore".format(app.Name, self.Name)
+                )
+            SendApplication(self._inboxname_, app)
+            CompositionLogger.Info("Application Name = {0} -- Sent to Workflow Name={1} (in {2})".format(app.Name, self.Name, self._inboxname_))
+        else:
+            self += app
+        return app
+
+
     def GetCall(self, runnerdeps=[]):
         RunnerArgs = []
         if self.Runner is not None:
@@ -276,9 +473,10 @@ class Workflow(UseRunner):
             pickle.dump(self, handle, protocol=pickle.HIGHEST_PROTOCOL, recurse=True)
 
     
-    def Create(self):
+    def Create(self, restart=False):
         """
-        Create the Workflow description and copy associated files to the run directories
+        Create the Workflow description and copy associated files to the run directories.
+        With restart=True, an existing run directory is reused, and nothing is copied over what's already there.
         """
 
         if (self.Name is None) and (self.Directory is None):
@@ -305,25 +503,33 @@ class Workflow(UseRunner):
         self.SetAppDirectories(self.Applications)
 
         # Don't overwrite original composition; Anticipate that SubWorkflows (Runner=None) will be using the same directory
-        if (not self.AllowExisting) and os.path.exists(self.Directory):
+        existed = os.path.exists(self.Directory)
+        if (not self.AllowExisting) and (not restart) and existed:
             CompositionLogger.RaiseError(FileExistsError, "Trying to create to a directory that already exists: {0}".format(self.Directory))
 
         # Create Directories
         if not os.path.exists(self.Directory):
             os.makedirs(self.Directory)
             CompositionLogger.Info("Created: {0}".format(self.Directory))
+        tocopy = []
         for app in self.Applications:
             if not os.path.exists(app.Directory):
                 os.makedirs(app.Directory)
+                tocopy += [app]
+            elif not (restart and existed):
+                tocopy += [app]
 
         # Copy the input files
-        self.CopyInput()
-        for app in self.Applications:
+        if not (restart and existed):
+            self.CopyInput()
+        for app in tocopy:
             app.CopyInput()
 
         # Check for cyclic dependencies
         for app in self.Applications:
             for dep in app.DependsOn:
+                if not isinstance(dep, Application):
+                    continue
                 depdeps = dep.DependsOn
                 for depdep in depdeps:
                     #if app.Name == depdep.Name:
@@ -335,6 +541,10 @@ class Workflow(UseRunner):
         super(UseRunner, self).__setattr__("_backupname_", os.path.join(self.Directory, "{0}.{1}".format(self.Name, self._backupname_)))
         super(UseRunner, self).__setattr__("_submitname_", os.path.join(self.Directory, "{0}.{1}".format(self.Name, self._submitname_)))
         super(UseRunner, self).__setattr__("_picklename_", os.path.join(self.Directory, "{0}.{1}".format(self.Name, self._picklename_)))
+        super(UseRunner, self).__setattr__("_journalname_", os.path.join(self.Directory, "{0}.{1}".format(self.Name, self._journalname_)))
+        super(UseRunner, self).__setattr__("_inboxname_", os.path.join(self.Directory, "{0}.{1}".format(self.Name, self._inboxname_)))
+        super(UseRunner, self).__setattr__("_queuename_", os.path.join(self.Directory, "{0}.{1}".format(self.Name, self._queuename_)))
+        super(UseRunner, self).__setattr__("_pilotname_", os.path.join(self.Directory, "{0}.{1}".format(self.Name, self._pilotname_)))
 
         """
         if adios2 is not None:
@@ -347,8 +557,13 @@ class Workflow(UseRunner):
 
         super(UseRunner, self).__setattr__("_CreateCalled_", True)
 
-        # Dump pickle file when Python closes
-        atexit.register(self.PickleWrite)
+        AppendEvent(
+            self._journalname_, "create",
+            workflow=self.Name,
+            directory=self.Directory,
+            applications=[{'app': app.Name, 'directory': app.Directory, 'DependsOn': [dep.Name if isinstance(dep, Application) else dep.path for dep in app.DependsOn]} for app in self.Applications],
+        )
+        self.PickleWrite()
 
 
     def SetupBackup(self):
@@ -408,53 +623,51 @@ class Workflow(UseRunner):
 
             CampaignName = self.Campaign.Name
             cdir = os.path.dirname(self.Directory)
-            reldir = os.path.basename(self.Directory)
-
-            with Chdir(cdir):
 
-                bp = FindBP(path=reldir)
+            # Campaign entries are named relative to the directory above the Workflow's
+            bp = [os.path.relpath(filename, cdir) for filename in FindBP(path=self.Directory)]
 
-                if self.Campaign.SchemaOnly:
-                    info = omas.omas_info()
-                    names = info.keys()
-                    newbp = []
-                    for filename in bp:
-                        if os.path.splitext(os.path.basename(filename))[0] in names:
-                            newbp += [filename]
-                    bp = newbp
+            if self.Campaign.SchemaOnly:
+                info = omas.omas_info()
+                names = info.keys()
+                newbp = []
+                for filename in bp:
+                    if os.path.splitext(os.path.basename(filename))[0] in names:
+                        newbp += [filename]
+                bp = newbp
 
-                if len(bp) == 0:
-                    CompositionLogger.Debug("Skipping campaign management: No .bp files")
-                    return
+            if len(bp) == 0:
+                CompositionLogger.Debug("Skipping campaign management: No .bp files")
+                return
 
-                if not self.Campaign.ExistenceChecks():
-                    return
+            if not self.Campaign.ExistenceChecks():
+                return
 
-                CompositionLogger.Info(
-                    "BP files to add to campaign {0}:".format(self.Campaign.Name) + "\n" + 
-                    "\n".join(bp)
-                )
+            CompositionLogger.Info(
+                "BP files to add to campaign {0}:".format(self.Campaign.Name) + "\n" + 
+                "\n".join(bp)
+            )
 
-                with open(self.Campaign.ConfigFile, 'r') as infile:
-                    config = yaml.safe_load(infile)
+            with open(self.Campaign.ConfigFile, 'r') as infile:
+                config = yaml.safe_load(infile)
 
-                storepath = os.path.join(os.path.expanduser(config['Campaign']['campaignstorepath']), "{0}.aca".format(self.Campaign.Name))
+            storepath = os.path.join(os.path.expanduser(config['Campaign']['campaignstorepath']), "{0}.aca".format(self.Campaign.Name))
 
-                if os.path.exists(storepath):
-                    subcmd = "update"
-                else:
-                    subcmd = "create"
+            if os.path.exists(storepath):
+                subcmd = "update"
+            else:
+                subcmd = "create"
 
-                '''
-                args = [subcmd, self.Campaign.Name, "--files"] + bp
-                fullcmd = [self.Campaign.ManagerCommand] + args
-                '''
+            '''
+            args = [subcmd, self.Campaign.Name, "--files"] + bp
+            fullcmd = [self.Campaign.ManagerCommand] + args
+            '''
 
-                #fullcmd = [self.Campaign.ManagerCommand, "--files"] + bp + [subcmd, storepath]
-                fullcmd = [self.Campaign.ManagerCommand, subcmd, storepath, "--files"] + bp
+            #fullcmd = [self.Campaign.ManagerCommand, "--files"] + bp + [subcmd, storepath]
+            fullcmd = [self.Campaign.ManagerCommand, subcmd, storepath, "--files"] + bp
 
-                CompositionLogger.Info("Campaign management: {0}".format(' '.join(fullcmd)))
-                subprocess.call(fullcmd)
+            CompositionLogger.Info("Campaign management: {0}".format(' '.join(fullcmd)))
+            subprocess.call(fullcmd, cwd=cdir)
 
 
     def While(self, condition):
@@ -479,6 +692,7 @@ class Workflow(UseRunner):
                 idstr not in dep.__dir__()
             )
         ):
+            time.sleep(0.1)
             current = datetime.datetime.now()
 
         if idstr not in dep.__dir__():
@@ -566,6 +780,7 @@ class Workflow(UseRunner):
                     )
 
             while self.While(any(alive)):
+                time.sleep(self.MonitorInterval)
                 for i, jobid in enumerate(runnerdeps):
                     alive[i] = runners[i].Monitor(jobid, self.Name)
 
@@ -599,6 +814,8 @@ class Workflow(UseRunner):
 
             while self.While(any(alive)):
                 for i, tid in enumerate(threaddeps):
+                    # Blocks, but comes back now and then to check for errors
+                    tid.join(timeout=1.0)
                     alive[i] = tid.is_alive()
 
             CompositionLogger.Info(
@@ -616,27 +833,30 @@ class Workflow(UseRunner):
             CompositionLogger.Info("Submitted as Job ID: {0}".format(self.JobID))
         else:
             super(UseRunner, self).__setattr__('JobID', None)
+        AppendEvent(self._journalname_, "submit", jobid=self.JobID)
 
 
-    def Submit(self, wait=True, AsyncTimeout=0):
+    def Submit(self, wait=True, AsyncTimeout=0, restart=False):
+        """
+        restart=True picks up an earlier run in the same Directory: Applications that finished successfully there aren't run again
+        """
         if AsyncTimeout == 0:
-            return self._Submit(wait=wait, AsyncTimeout=AsyncTimeout)
+            return self._Submit(wait=wait, AsyncTimeout=AsyncTimeout, restart=restart)
         else:
             tid = threading.Thread(
                 target=self._Submit,
-                kwargs={'wait': wait, 'AsyncTimeout': AsyncTimeout}
+                kwargs={'wait': wait, 'AsyncTimeout': AsyncTimeout, 'restart': restart}
             )
             tid.start()
             return tid
 
 
-    def _Submit(self, wait=True, AsyncTimeout=0):
+    def _Submit(self, wait=True, AsyncTimeout=0, restart=False):
         if not self._CreateCalled_:
-            self.Create()
+            self.Create(restart=restart)
 
-        with Chdir(self.Directory):
-            if os.path.exists(self._touchname_):
-                os.remove(self._touchname_)
+        if os.path.exists(self._touchname_) and (not restart):
+            os.remove(self._touchname_)
 
         self.SetupBackup()
         self.SubmitBackup()
@@ -644,13 +864,25 @@ class Workflow(UseRunner):
         runnerdeps, runnernames, runners, threaddeps, threadnames = self.GetDependencies(AsyncTimeout=AsyncTimeout)
         super(UseRunner, self).__setattr__('Wait', wait)
 
-        if self.Runner is not None:
-            SubmitCall = self.GetCall(runnerdeps=runnerdeps)
-            with open(self._submitname_, 'w') as outfile:
-                outfile.write(self.ShellSetup(force=True))
-                outfile.write(
-                    "effis-submit --sub {0} --name {1}".format(self.Directory, self.Name)
+        if self.Pilots > 0:
+            self.QueueForPilots(restart=restart)
+
+            if len(threaddeps) > 0:
+                tid = threading.Thread(
+                    target=self.SubmitPilots,
+                    args=(self.Pilots, ),
+                    kwargs={'runnerdeps': runnerdeps, 'threaddeps': threaddeps, 'threadnames': threadnames}
                 )
+                return self.ThreadRun(tid)
+            else:
+                self.SubmitPilots(self.Pilots, runnerdeps=runnerdeps)
+
+        elif self.Runner is not None:
+            SubmitCall = self.GetCall(runnerdeps=runnerdeps)
+            self.WriteSubmitScript(restart=restart)
+
+            # The job can start (and load the pickle) as soon as it's submitted
+            self.PickleWrite()
 
             if len(threaddeps) > 0:
                 tid = threading.Thread(
@@ -667,6 +899,11 @@ class Workflow(UseRunner):
             for app in self.Applications:
                 super(UseRunner, app).__setattr__("UpstreamSetupFile", self.SetupFile)
 
+            if self.Executor not in (None, False):
+                # The daemon waits on the dependencies itself, so this process can exit right away (wait=False)
+                self.PickleWrite()
+                return self.ThreadRun(Submission(self, restart=restart))
+
             self.BatchWait(runnerdeps, runnernames, runners)
 
             """
@@ -681,7 +918,11 @@ class Workflow(UseRunner):
             """
 
             self.ThreadWait(threaddeps, threadnames)
-            tid = threading.Thread(target=self.SubSubmit)
+            self.PickleWrite()
+
+            # So whatever waits on this Workflow (e.g. in the executor) can tell if this process goes away before it's through
+            AppendEvent(self._journalname_, "run", pid=os.getpid(), host=socket.gethostname())
+            tid = threading.Thread(target=self.SubSubmit, kwargs={'restart': restart})
             return self.ThreadRun(tid)
 
         '''
@@ -693,6 +934,167 @@ class Workflow(UseRunner):
         self.PickleWrite()
 
 
+    def _Futures(self):
+        """
+        (submitted, finished) asyncio futures of the Workflow, in the running asyncio loop
+        """
+        loop = asyncio.get_running_loop()
+        futures = self.__dict__.get('futures')
+        if (futures is None) or (futures[0].get_loop() is not loop):
+            futures = (loop.create_future(), loop.create_future())
+            super(UseRunner, self).__setattr__('futures', futures)
+        return futures
+
+
+    async def SubmitAsync(self, restart=False, timeout=None):
+        """
+        asyncio counterpart of Submit(wait=False): returns once the Workflow has been handed off; await WaitAsync() for it to finish.
+        Dependencies are awaited rather than waited on in threads (batch jobs need what they depend on submitted, Runner=None Workflows need it finished),
+        so they should be submitted with SubmitAsync() in the same asyncio loop; timeout (seconds) bounds each wait.
+        Runner=None Workflows run in one thread shared by everything submitted this way in the process (or in the executor daemon, with Executor set);
+        in the process, each is admitted against its own Resources, as with Submit(). With Pilots, the Applications are queued and the pilot jobs submitted, as with Submit().
+        """
+
+        submitted, finished = self._Futures()
+        try:
+            if not self._CreateCalled_:
+                self.Create(restart=restart)
+            if os.path.exists(self._touchname_) and (not restart):
+                os.remove(self._touchname_)
+            self.SetupBackup()
+            self.SubmitBackup()
+            super(UseRunner, self).__setattr__('Wait', False)
+
+            runnerdeps = []
+            for dep in self.DependsOn:
+                if (dep.Runner is not None) and (self.Runner is not None):
+                    await asyncio.wait_for(asyncio.shield(dep._Futures()[0]), timeout)
+                    runnerdeps += [dep.JobID]
+                else:
+                    CompositionLogger.Info("Workflow Name={0} waiting for Workflow Name={1}".format(self.Name, dep.Name))
+                    await dep.WaitAsync(timeout=timeout)
+
+            if self.Pilots > 0:
+                self.QueueForPilots(restart=restart)
+                await asyncio.to_thread(self.SubmitPilots, self.Pilots, runnerdeps=runnerdeps)
+                Background(self.MonitorAsync())
+
+            elif self.Runner is not None:
+                self.WriteSubmitScript(restart=restart)
+                self.PickleWrite()
+                await asyncio.to_thread(self.RunnerSubmit, self.GetCall(runnerdeps=runnerdeps))
+                Background(self.MonitorAsync())
+
+            else:
+                for app in self.Applications:
+                    super(UseRunner, app).__setattr__("UpstreamSetupFile", self.SetupFile)
+                self.PickleWrite()
+
+                if self.Executor not in (None, False):
+                    handle = Submission(self, restart=restart)
+                    await asyncio.to_thread(handle.start)
+                    super(UseRunner, self).__setattr__("tid", handle)
+                    Background(self.MonitorAsync())
+                else:
+                    loop = asyncio.get_running_loop()
+                    Local().Submit(self, restart=restart, wait=False, callback=lambda result: loop.call_soon_threadsafe(Resolve, finished, result))
+
+        except Exception as e:
+            Resolve(submitted, e)
+            Resolve(finished, e)
+            raise
+
+        Resolve(submitted, self)
+        return self
+
+
+    async def MonitorAsync(self):
+        """
+        Check on a Workflow running outside of this process (batch job, or executor daemon) every MonitorInterval seconds, until it's through
+        """
+        finished = self._Futures()[1]
+        try:
+            if self.Runner is not None:
+                while await asyncio.to_thread(self.Runner.Monitor, self.JobID, self.Name):
+                    await asyncio.sleep(self.MonitorInterval)
+            else:
+                while await asyncio.to_thread(self.tid.is_alive):
+                    await asyncio.sleep(self.tid.PollInterval)
+        except Exception as e:
+            # Not everyone else's problem in this process
+            CompositionLogger.ERROR = False
+            Resolve(finished, e)
+            return
+        Resolve(finished, self.Runner is not None or os.path.exists(self._touchname_))
+
+
+    async def WaitAsync(self, app=None, timeout=None):
+        """
+        asyncio counterpart of joining Submit()'s thread: wait (up to timeout seconds) for the Workflow from SubmitAsync() to finish.
+        Returns True if everything did (False if some was left for a continuation job).
+        With app, waits for just that Application (of a Workflow running in this process) instead, and returns it.
+        """
+        if app is not None:
+            future = Future(app)
+        else:
+            future = self._Futures()[1]
+        return await asyncio.wait_for(asyncio.shield(future), timeout)
+
+
+    def ApplicationFutures(self):
+        """
+        {Name: asyncio future} for the Workflow's Applications, each set to its Application once it has finished (when running in this process)
+        """
+        return {app.Name: Future(app) for app in self.Applications}
+
+
+    def WriteSubmitScript(self, restart=False):
+        with open(self._submitname_, 'w') as outfile:
+            outfile.write(self.ShellSetup(force=True))
+            outfile.write(
+                "effis-submit --sub {0} --name {1}".format(self.Directory, self.Name)
+            )
+            if restart:
+                outfile.write(" --restart")
+
+
+    def QueueForPilots(self, restart=False):
+        """
+        Put the Applications in the Workflow's queue (and write the pickle) for pilot jobs to load
+        """
+        if (self.Runner is None) or ('GetJobID' not in self.Runner.__dir__()):
+            CompositionLogger.RaiseError(ValueError, "Workflow Name={0}: Pilots needs a batch queue Runner to submit pilot jobs with".format(self.Name))
+        for app in self.Applications:
+            super(UseRunner, app).__setattr__("UpstreamSetupFile", self.SetupFile)
+        if restart:
+            self.Restart()
+        Enqueue(self)
+        self.PickleWrite()
+
+
+    def SubmitPilots(self, count=1, runnerdeps=[], threaddeps=[], threadnames=[]):
+        """
+        Submit count (more) pilot jobs working through the Workflow's queue; returns their Job IDs
+        """
+        with open(self._pilotname_, 'w') as outfile:
+            outfile.write(self.ShellSetup(force=True))
+            outfile.write(
+                "effis-pilot run {0} --name {1}".format(self.Directory, self.Name)
+            )
+
+        SubmitCall = self.Runner.GetCall(self, self.SchedulerDirectives) + self.Runner.Dependency(runnerdeps) + [self._pilotname_]
+        jobids = []
+        for i in range(count):
+            self.RunnerSubmit(SubmitCall, threaddeps=threaddeps, threadnames=threadnames)
+            threaddeps, threadnames = [], []
+            jobids += [self.JobID]
+
+        # Dependent Workflows wait on the first pilot, which keeps going until the queue is drained
+        if (len(jobids) > 0) and (jobids[0] is not None):
+            super(UseRunner, self).__setattr__('JobID', jobids[0])
+        return jobids
+
+
     def ThreadRun(self, tid):
 
         tid.start()
@@ -703,94 +1105,115 @@ class Workflow(UseRunner):
         return self.tid
 
 
-    def SubSubmit(self):
+    def Simulate(self, Resources=None, verbose=True):
+        """
+        Predict how the Applications will run -- with the same dependency, admission and priority logic as SubSubmit(),
+        but with estimated runtimes (EstimatedRuntime or History) and no processes launched.
+        Resources describes the allocation to simulate, otherwise Workflow.Resources (or Nodes, with local-looking nodes) is used.
+        """
 
-        GroupRunning = {}
-        NoneGroupRunning = []
-        for app in self.Applications:
-            if (app.Group is None) or (app.Group in GroupRunning):
-                continue
-            GroupRunning[app.Group] = []
+        workflow = copy.deepcopy(self)
+        if Resources is not None:
+            workflow.Resources = Resources
+        elif (workflow.Resources is None) and ('Nodes' in workflow.__dir__()) and (workflow.Nodes is not None):
+            workflow.Resources = {'Nodes': int(workflow.Nodes)}
 
+        if (workflow.Name is None) and (workflow.Directory is not None):
+            workflow.Name = os.path.basename(workflow.Directory)
 
-        while self.While(True):
+        report = Simulator(workflow).Run()
+        if verbose:
+            CompositionLogger.Info("Workflow Name={0} simulation".format(workflow.Name) + "\n" + Summary(report))
+        return report
 
-            for app in self.Applications:
 
-                blocked = False
-                for dep in app.DependsOn:
-                    if ('Status' not in dep.__dir__()) or (dep.Status is None):
-                        blocked = True
-                        break
-                if (app.Group is not None) and (app.Group in self.GroupMax) and (len(GroupRunning[app.Group]) >= self.GroupMax[app.Group]):
-                    blocked = True
+    def Restart(self):
+        """
+        Rebuild what an earlier run in this Directory got done, from its journal and done marker:
+        Applications whose last run exited successfully are marked finished; anything pending, failed or cut off runs (again)
+        """
 
-                if blocked:
-                    continue
-                elif ('Status' in app.__dir__()):
-                    continue
+        alldone = os.path.exists(self._touchname_)
+        status = {}
+        for record in Journal.Read(self._journalname_):
+            if record['event'] == "launch":
+                status[record['app']] = None
+            elif record['event'] == "exit":
+                status[record['app']] = record['status']
+            elif record['event'] == "cancel":
+                status[record['app']] = None
+
+        # The done marker only vouches for Applications the journal doesn't know about (it's written even if some failed)
+        finished = 0
+        for app in self.Applications:
+            if (status.get(app.Name) == 0) or (alldone and (app.Name not in status)):
+                super(UseRunner, app).__setattr__('Status', 0)
+                finished += 1
 
-                with Chdir(app.Directory):
+        AppendEvent(self._journalname_, "restart", finished=finished)
+        CompositionLogger.Info("Workflow Name={0} restarting: {1} of {2} Application(s) already finished".format(self.Name, finished, len(self.Applications)))
 
-                    cmd = app.GetCall()
-                    msg = "Application Name = {0} -- Starting:".format(app.Name) + "\n" + " ".join(cmd)
 
-                    if app.LogFile is not None:
-                        super(UseRunner, app).__setattr__('stdout', open(app.LogFile, 'w'))
-                        msg = msg + " > {0} 2>&1".format(app.LogFile)
-                    else:
-                        super(UseRunner, app).__setattr__('stdout', None)
+    def Continue(self):
+        """
+        Hand the rest of the Workflow to a new batch job, because it won't fit in the walltime left in this one
+        """
 
-                    ShellSetup = app.ShellSetup()
+        finished = len([app for app in self.Applications if Finished(app)])
+        remaining = len(self.Applications) - finished
 
-                    if ShellSetup is not None:
-                        jobfile = "./{0}.sh".format(app.Name)
+        before = None
+        for record in Journal.Read(self._journalname_):
+            if record['event'] == "continue":
+                before = record['finished']
+        AppendEvent(self._journalname_, "continue", finished=finished, remaining=remaining)
 
-                        with open(jobfile, "w") as outfile:
-                            outfile.write(ShellSetup)
-                            outfile.write(
-                                "{0}".format(" ".join(cmd))
-                            )
+        if (not self.Chain) or (self.Runner is None) or ('GetJobID' not in self.Runner.__dir__()):
+            CompositionLogger.Warning(
+                "Workflow Name={0}: {1} Application(s) didn't fit in the walltime. Continue with: effis-submit --sub {2} --name {0} --restart".format(
+                    self.Name, remaining, self.Directory
+                )
+            )
+            return
+        elif (before is not None) and (finished == before):
+            CompositionLogger.Warning("Workflow Name={0}: continuation job made no progress; not chaining another".format(self.Name))
+            return
 
-                        os.chmod(
-                            jobfile,
-                            stat.S_IRUSR | stat.S_IXUSR | stat.S_IWUSR |
-                            stat.S_IRGRP | stat.S_IXGRP |
-                            stat.S_IROTH | stat.S_IXOTH
-                        )
-                        cmd = [jobfile]
+        CompositionLogger.Info("Workflow Name={0}: submitting a continuation job for {1} Application(s)".format(self.Name, remaining))
+        deps = []
+        if "SLURM_JOB_ID" in os.environ:
+            deps = [os.environ["SLURM_JOB_ID"]]
+        self.WriteSubmitScript(restart=True)
+        self.RunnerSubmit(self.GetCall(runnerdeps=deps))
 
-                    CompositionLogger.Info(msg)
-                    p = subprocess.Popen(cmd, stdout=app.stdout, stderr=app.stdout, env={**os.environ, **app.Environment})
 
-                    super(UseRunner, app).__setattr__('procid', p)
-                    if app.Group is not None:
-                        GroupRunning[app.Group] += [app.procid]
-                    else:
-                        NoneGroupRunning += [app.procid]
+    def SubSubmit(self, restart=False):
 
-            done = True
+        if restart:
+            self.Restart()
 
-            for app in self.Applications:
+        scheduler = Scheduler(self)
+        self.Completed(scheduler.Run(), scheduler.Stalled)
 
-                if ('procid' in app.__dir__()) and (('Status' not in app.__dir__()) or (app.Status is None)):
-                    super(UseRunner, app).__setattr__('Status', app.procid.poll())
 
-                if ('Status' not in app.__dir__()) or (app.Status is None):
-                    done = False
-                elif (app.Group is not None) and (app.procid in GroupRunning[app.Group]):
-                    GroupRunning[app.Group].remove(app.procid)
-                    self.FinishCloseFile(app)
-                elif (app.Group is None) and (app.procid in NoneGroupRunning):
-                    NoneGroupRunning.remove(app.procid)
-                    self.FinishCloseFile(app)
+    def Completed(self, done, stalled=False):
+        """
+        Wrap up after the scheduler is through: done marker and campaign if everything finished, else a continuation job if some was deferred
+        """
+        if not done:
+            if stalled:
+                self.Continue()
+            return
 
-            if done:
-                break
+        with open(self._touchname_, "w") as outfile:
+            outfile.write("")
+        AppendEvent(self._journalname_, "done")
 
-        with Chdir(self.Directory):
-            with open(self._touchname_, "w") as outfile:
-                outfile.write("")
+        # Sent while the scheduler was shutting down, before the done marker was there to stop it
+        if os.path.isdir(self._inboxname_):
+            late = [name for name in os.listdir(self._inboxname_) if name.endswith(".pickle")]
+            if len(late) > 0:
+                CompositionLogger.Warning("Workflow Name={0}: {1} Application(s) added after it had finished weren't run (left in {2})".format(self.Name, len(late), self._inboxname_))
 
         if self.Wait:
             self.Campaignify()
@@ -812,6 +1235,10 @@ class SubWorkflow(Workflow):
     _backupname_ = "sub.backup.json"      # Configures the globus movement
     _submitname_ = "sub.workflow.sh"      # File that submits with scheduler
     _picklename_ = "sub.workflow.pickle"  # Saves workflow description
+    _journalname_ = "sub.workflow.journal.jsonl"  # Appended to as things happen (launches, exits, ...)
+    _inboxname_ = "sub.workflow.inbox"  # Other processes drop Applications here to add them while running
+    _queuename_ = "sub.workflow.queue.sqlite"  # Tasks for pilot jobs
+    _pilotname_ = "sub.pilot.sh"      # File that pilot jobs run
 
     AllowExisting = True
 
@@ -0,0 +1,28 @@
+import argparse
+
+from effis.composition.agents import Serve
+
+
+def main():
+
+    # Started by the scheduler (one per node) for Workflows with Agents set
+    parser = argparse.ArgumentParser(description="Per-node agent starting a Workflow's Applications")
+    parser.add_argument("-d", "--directory", help="Directory to register in (where the scheduler looks for its agents)", required=True)
+    parser.add_argument("-n", "--node", help="Node index (default: $SLURM_NODEID)", required=False, type=int, default=None)
+    parser.add_argument("--host", help="Address to listen on (default: every interface, registered under the host name)", required=False, default=None)
+    parser.add_argument("--cores", help="Comma-separated cores to bind tasks to (default: the agent's own affinity)", required=False, default=None)
+    parser.add_argument("--gpus", help="Comma-separated GPUs to hand out (default: the visible ones)", required=False, default=None)
+    args = parser.parse_args()
+
+    cores = None
+    if args.cores is not None:
+        cores = [int(core) for core in args.cores.split(",")]
+    gpus = None
+    if args.gpus is not None:
+        gpus = args.gpus.split(",")
+
+    Serve(args.directory, node=args.node, host=args.host, cores=cores, gpus=gpus)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,32 @@
+import argparse
+import datetime
+
+from effis.composition.cache import Cache
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Statistics about, and eviction from, the cache of Application results")
+    parser.add_argument("command", help="stats (of the cache), or evict (entries by size/age)", choices=["stats", "evict"])
+    parser.add_argument("-p", "--path", help="Cache directory (default: $EFFIS_CACHE, or ~/.effis/cache)", required=False, default=None)
+    parser.add_argument("-s", "--size", help="Evict least recently used entries down to this size (MB, or with a K/M/G/T suffix)", required=False, default=None)
+    parser.add_argument("-a", "--age", help="Evict entries not used in this many seconds", required=False, type=float, default=None)
+    args = parser.parse_args()
+
+    cache = Cache(args.path)
+
+    if args.command == "evict":
+        print("Evicted {0}".format(cache.Evict(size=args.size, age=args.age)))
+    else:
+        stats = cache.Stats()
+        for name in ("Path", "Entries", "SizeMB", "Hits", "Misses", "Stores", "Evictions", "HitRate"):
+            print("{0:>10}: {1}".format(name, stats[name]))
+        for name in ("Oldest", "LastUsed"):
+            if stats[name] is not None:
+                print("{0:>10}: {1}".format(name, datetime.datetime.fromtimestamp(stats[name]).strftime("%Y-%m-%d %H:%M:%S")))
+
+    cache.Close()
+
+
+if __name__ == "__main__":
+    main()
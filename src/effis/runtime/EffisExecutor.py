@@ -0,0 +1,33 @@
+import argparse
+import json
+
+from effis.composition.executor import Address, Request, StartDaemon, Serve
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Shared executor daemon for (Runner=None) Workflows with Executor set")
+    parser.add_argument("command", help="start (in the background), run (in the foreground), status, or stop (once what it has is finished)", choices=["start", "run", "status", "stop"])
+    parser.add_argument("-s", "--socket", help="Socket path (default: $EFFIS_EXECUTOR, else ~/.effis/executor.<host>.sock)", required=False, default=None)
+    parser.add_argument("-r", "--resources", help="Resources to manage, as JSON, e.g. '{\"Nodes\": 2}' (default: detected)", required=False, default=None)
+    args = parser.parse_args()
+
+    address = Address(True if args.socket is None else args.socket)
+    resources = None
+    if args.resources is not None:
+        resources = json.loads(args.resources)
+
+    if args.command == "start":
+        StartDaemon(address, resources=resources)
+    elif args.command == "run":
+        Serve(address, resources=resources)
+    else:
+        try:
+            reply = Request(address, {'op': args.command})
+        except OSError:
+            raise SystemExit("No executor running on {0}".format(address))
+        print(json.dumps(reply, indent=4))
+
+
+if __name__ == "__main__":
+    main()
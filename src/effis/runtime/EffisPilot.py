@@ -0,0 +1,33 @@
+import argparse
+import datetime
+
+from effis.composition.pilot import Pilot, Queue
+from effis.runtime.EffisSubmit import LoadWorkflow
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Pilot jobs working through the queue of a Workflow with Pilots set")
+    parser.add_argument("command", help="run (as a pilot, in this allocation), submit (more pilot jobs), or status (of the queue)", choices=["run", "submit", "status"])
+    parser.add_argument("directory", help="Path to the Workflow directory", type=str)
+    parser.add_argument("-n", "--name", help="Workflow Name", required=False, default=None)
+    parser.add_argument("-c", "--count", help="How many pilot jobs to submit", required=False, type=int, default=1)
+    args = parser.parse_args()
+
+    workflow = LoadWorkflow(args.directory, name=args.name)
+
+    if args.command == "run":
+        Pilot(workflow).Run()
+    elif args.command == "submit":
+        print(" ".join([str(jobid) for jobid in workflow.SubmitPilots(args.count)]))
+    else:
+        queue = Queue(workflow._queuename_)
+        for state, count in sorted(queue.Counts().items()):
+            print("{0:>10}: {1}".format(state, count))
+        for pilot in queue.Pilots():
+            print("Pilot {0} (job {1}) last checked in {2}".format(pilot['worker'], pilot['jobid'], datetime.datetime.fromtimestamp(pilot['beat']).strftime("%Y-%m-%d %H:%M:%S")))
+        queue.Close()
+
+
+if __name__ == "__main__":
+    main()
@@ -3,19 +3,16 @@ import os
 import dill as pickle
 
 
-def main():
+def LoadWorkflow(directory, name=None):
+    """
+    Workflow description pickled in directory (the only one there, unless name picks one)
+    """
 
-    parser = argparse.ArgumentParser()
-    parser.add_argument("directory", help="Path to directory", type=str)
-    parser.add_argument("--sub", help="Sub-submit", action="store_true")
-    parser.add_argument("-n", "--name", help="Workflow Name", required=False, default=None)
-    args = parser.parse_args()
-
-    if args.name is not None:
-        filename = os.path.join(args.directory, "{0}.workflow.pickle".format(args.name))
+    if name is not None:
+        filename = os.path.join(directory, "{0}.workflow.pickle".format(name))
 
     else:
-        names = os.listdir(args.directory)
+        names = os.listdir(directory)
         count = 0
         for name in names:
             if name.endswith("workflow.pickle") and (not name.endswith("sub.workflow.pickle")):
@@ -23,7 +20,7 @@ def main():
                 count += 1
 
         if count == 1:
-            filename = os.path.join(args.directory, filename)
+            filename = os.path.join(directory, filename)
         elif count > 1:
             raise NameError("More than one workflow description found. Set one with --name")
         elif count == 0:
@@ -31,12 +28,27 @@ def main():
 
 
     if not os.path.exists(filename):
-        raise ValueError("No workflow description found in {0}".format(args.directory))
+        raise ValueError("No workflow description found in {0}".format(directory))
 
     with open(filename, 'rb') as handle:
-        workflow = pickle.load(handle)
+        return pickle.load(handle)
+
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("directory", help="Path to directory", type=str)
+    parser.add_argument("--sub", help="Sub-submit", action="store_true")
+    parser.add_argument("-n", "--name", help="Workflow Name", required=False, default=None)
+    parser.add_argument("--restart", help="Pick up an earlier run: skip Applications that already finished successfully", action="store_true")
+    parser.add_argument("--simulate", help="Predict makespan/utilization with estimated runtimes; don't run anything", action="store_true")
+    args = parser.parse_args()
+
+    workflow = LoadWorkflow(args.directory, name=args.name)
 
-    if args.sub:
-        workflow.SubSubmit()
+    if args.simulate:
+        workflow.Simulate()
+    elif args.sub:
+        workflow.SubSubmit(restart=args.restart)
     else:
-        workflow.Submit()
+        workflow.Submit(restart=args.restart)
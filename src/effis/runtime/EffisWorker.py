@@ -0,0 +1,12 @@
+import sys
+
+from effis.composition.functions import Serve
+
+
+def main():
+    # Started by the scheduler for Applications with a Function; arguments are the modules to preload
+    Serve(sys.argv[1:])
+
+
+if __name__ == "__main__":
+    main()
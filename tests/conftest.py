@@ -0,0 +1,44 @@
+import os
+import pytest
+
+from effis.composition.log import CompositionLogger
+
+
+@pytest.fixture(autouse=True)
+def Isolated(tmp_path, monkeypatch):
+    """
+    Keep anything written outside of a test's Workflow (history, cache) in its tmp_path, and reset the global error flag
+    """
+    monkeypatch.setenv("EFFIS_HISTORY", str(tmp_path / "history.sqlite"))
+    monkeypatch.setenv("EFFIS_CACHE", str(tmp_path / "cache"))
+    yield
+    CompositionLogger.ERROR = False
+
+
+@pytest.fixture
+def directory(tmp_path):
+    return os.path.join(str(tmp_path), "workflow")
+
+
+@pytest.fixture
+def sbatch(tmp_path, monkeypatch):
+    """
+    A stand-in sbatch on PATH: keeps a copy of the Workflow pickle as it is when the job is submitted, and prints a job ID.
+    Returns the file the copies' names are listed in.
+    """
+    bindir = tmp_path / "bin"
+    bindir.mkdir()
+    submitted = tmp_path / "submitted.txt"
+    script = bindir / "sbatch"
+    script.write_text(
+        "#!/bin/sh\n"
+        "for last; do true; done\n"
+        "dir=$(dirname \"$last\")\n"
+        "n=$(ls \"$dir\" | grep -c '^submitted')\n"
+        "cp \"$dir\"/*.workflow.pickle \"$dir/submitted.$n.pickle\"\n"
+        "echo \"$dir/submitted.$n.pickle\" >> {0}\n"
+        "echo $((1000 + n))\n".format(submitted)
+    )
+    script.chmod(0o755)
+    monkeypatch.setenv("PATH", "{0}:{1}".format(bindir, os.environ["PATH"]))
+    return submitted
@@ -0,0 +1,74 @@
+import os
+import json
+import socket
+import threading
+
+from effis.composition.events import EventLoop
+from effis.composition.agents import Agent, Agents, Send
+
+
+def test_local_agents_run_tasks(tmp_path):
+    loop = EventLoop()
+    agents = Agents(loop, {'Nodes': 1, 'CoresPerNode': 2, 'GPUsPerNode': 0}, str(tmp_path / "agents"))
+    agents.Start()
+    exited = {}
+
+    def Started(task, proc):
+        assert proc.returncode is None
+        loop.WatchProcess(proc, lambda proc: exited.__setitem__(task, proc.returncode))
+
+    try:
+        for task, status in ((0, 0), (1, 3)):
+            workdir = tmp_path / "task{0}".format(task)
+            workdir.mkdir()
+            cmd = ["sh", "-c", "echo $EFFIS_TEST > out.txt; exit {0}".format(status)]
+            environment = {**os.environ, 'EFFIS_TEST': "task{0}".format(task)}
+            agents.Submit(0, 1, 0, cmd, str(workdir), environment, None, False, lambda proc, task=task: Started(task, proc))
+        while len(exited) < 2:
+            loop.RunOnce()
+    finally:
+        agents.Close()
+        loop.Close()
+
+    assert exited == {0: 0, 1: 3}
+    assert (tmp_path / "task1" / "out.txt").read_text().strip() == "task1"
+
+
+def Lines(sock):
+    buffer = b""
+    while True:
+        data = sock.recv(1 << 16)
+        if len(data) == 0:
+            return
+        buffer += data
+        while b"\n" in buffer:
+            line, buffer = buffer.split(b"\n", 1)
+            yield json.loads(line)
+
+
+def test_agent_takes_only_its_scheduler(tmp_path):
+    agent = Agent(str(tmp_path), 0, "secret")
+    assert agent.Socket.getsockname()[0] != "0.0.0.0"
+    thread = threading.Thread(target=agent.Run, daemon=True)
+    thread.start()
+    address = agent.Socket.getsockname()
+
+    # Neither a connection that says nothing, nor one with the wrong token, keeps the scheduler out
+    idle = socket.create_connection(address)
+    wrong = socket.create_connection(address)
+    Send(wrong, {'op': "hello", 'token': "guess"})
+    assert wrong.recv(1) == b""
+    wrong.close()
+
+    scheduler = socket.create_connection(address)
+    Send(scheduler, {'op': "hello", 'token': "secret"})
+    Send(scheduler, {'op': "launch", 'id': 0, 'argv': ["sh", "-c", "exit 3"], 'cwd': str(tmp_path), 'env': dict(os.environ), 'log': None, 'append': False, 'cores': 1, 'gpus': 0})
+    events = Lines(scheduler)
+    assert next(events)['event'] == "started"
+    assert next(events) == {'id': 0, 'event': "exit", 'status': 3}
+
+    Send(scheduler, {'op': "shutdown"})
+    thread.join(timeout=5)
+    assert not thread.is_alive()
+    scheduler.close()
+    idle.close()
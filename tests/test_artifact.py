@@ -0,0 +1,49 @@
+import os
+import time
+
+import effis.composition as effis
+from effis.composition.journal import Journal
+
+
+def Pipeline(directory, produce, timeout=0):
+    workflow = effis.Workflow(Runner=None, Directory=directory)
+    a = workflow.Application(cmd="sh", Name="a")
+    a.CommandLineArguments = ["-c", produce]
+    b = workflow.Application(cmd="cat", Name="b", CommandLineArguments=["../a/out.txt"], DependsOn=[effis.Artifact("a/out.txt", timeout=timeout)])
+    c = workflow.Application(cmd="true", Name="c", DependsOn=[b])
+    return workflow, a, b, c
+
+
+def test_starts_once_written(directory):
+    workflow, a, b, c = Pipeline(directory, "echo data > out.txt; sleep 0.5")
+    workflow.Submit()
+    assert [app.State for app in (a, b, c)] == ["COMPLETED"] * 3
+    # The consumer overlapped with the producer
+    assert b.StartTime < a.EndTime
+
+
+def test_failed_producer_cancels_consumer(directory):
+    workflow, a, b, c = Pipeline(directory, "false")
+    workflow.Submit(wait=False)
+    workflow.tid.join(timeout=10)
+    assert not workflow.tid.is_alive()
+    assert (a.State, b.State, c.State) == ("FAILED", "CANCELLED", "CANCELLED")
+
+    cancelled = [record['app'] for record in Journal.Read(workflow._journalname_) if record['event'] == "cancel"]
+    assert sorted(cancelled) == ["b", "c"]
+
+
+def test_timeout_after_idle(directory):
+    workflow, a, b, c = Pipeline(directory, "true", timeout=0.5)
+    start = time.time()
+    workflow.Submit()
+    assert time.time() - start >= 0.5
+    assert (a.State, b.State, c.State) == ("COMPLETED", "CANCELLED", "CANCELLED")
+
+
+def test_written_during_timeout(tmp_path, directory):
+    # Something outside of the Workflow writes the file while it waits
+    workflow, a, b, c = Pipeline(directory, "sleep 0.2; (sleep 0.3; echo late > out.txt) &", timeout=5)
+    workflow.Submit()
+    assert (a.State, b.State, c.State) == ("COMPLETED", "COMPLETED", "COMPLETED")
+    assert os.path.exists(os.path.join(a.Directory, "out.txt"))
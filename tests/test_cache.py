@@ -0,0 +1,76 @@
+import os
+import time
+import types
+import sqlite3
+
+import effis.composition as effis
+from effis.composition.journal import Journal
+from effis.composition.cache import Cache
+
+
+def Run(directory, upstream, **settings):
+    workflow = effis.Workflow(Runner=None, Directory=directory, Cache=True)
+    up = workflow.Application(cmd="sh", Name="up", Cache=False, **settings)
+    up.CommandLineArguments = ["-c", upstream]
+    workflow.Application(cmd="sh", Name="down", DependsOn=[up], CommandLineArguments=["-c", "echo done > down.txt"])
+    workflow.Submit()
+    assert [app.State for app in workflow.Applications] == ["COMPLETED", "COMPLETED"]
+    return [record['app'] for record in Journal.Read(workflow._journalname_) if record['event'] == "cached"]
+
+
+def test_downstream_hit_when_upstream_outputs_match(tmp_path):
+    assert Run(str(tmp_path / "one"), "echo same > out.txt") == []
+    assert Run(str(tmp_path / "two"), "echo same > out.txt") == ["down"]
+    assert os.path.exists(str(tmp_path / "two" / "down" / "down.txt"))
+
+
+def test_downstream_miss_when_upstream_outputs_change(tmp_path):
+    # up isn't cached and writes something different every time, so down's earlier result doesn't apply
+    assert Run(str(tmp_path / "one"), "echo $$ > out.txt") == []
+    assert Run(str(tmp_path / "two"), "echo $$ > out.txt") == []
+
+
+def test_upstream_log_and_wrapper_not_hashed(tmp_path):
+    # The log differs every run, and so does the wrapper script sourcing the setup file (it has the run's paths in it)
+    setup = tmp_path / "setup.sh"
+    setup.write_text("export FOO=same\n")
+    upstream = "echo $$; echo $FOO > out.txt"
+    assert Run(str(tmp_path / "one"), upstream, LogFile="up.log", SetupFile=str(setup)) == []
+    assert Run(str(tmp_path / "two"), upstream, LogFile="up.log", SetupFile=str(setup)) == ["down"]
+
+
+def test_index_without_wal(tmp_path):
+    Run(str(tmp_path / "one"), "true")
+    db = sqlite3.connect(os.path.join(os.environ["EFFIS_CACHE"], "index.sqlite"))
+    assert db.execute("PRAGMA journal_mode").fetchone()[0] == "delete"
+    db.close()
+
+
+def Stored(cache, tmp_path, name, size):
+    directory = tmp_path / name
+    directory.mkdir()
+    (directory / "out.bin").write_bytes(b"x" * size)
+    key = name * 8
+    cache.Store(key, types.SimpleNamespace(Name=name, cmd=name, Directory=str(directory)))
+    cache.pool.submit(lambda: None).result()
+    return key
+
+
+def test_eviction_and_stats(tmp_path):
+    cache = Cache(str(tmp_path / "cache"))
+    old = Stored(cache, tmp_path, "old", 1 << 20)
+    time.sleep(0.01)
+    new = Stored(cache, tmp_path, "new", 1 << 20)
+    assert cache.Restore(new, str(tmp_path / "restored")) is not None
+    assert (tmp_path / "restored" / "out.bin").read_bytes() == b"x" * (1 << 20)
+    assert cache.Restore("missing" * 8, str(tmp_path / "restored")) is None
+
+    # Least recently used goes first
+    assert cache.Evict(size=1.5) == 1
+    assert not os.path.exists(cache.Entry(old))
+    assert os.path.exists(cache.Entry(new))
+    assert cache.Evict(age=0) == 1
+
+    stats = cache.Stats()
+    assert (stats['Entries'], stats['Hits'], stats['Misses'], stats['Stores'], stats['Evictions']) == (0, 1, 1, 2, 2)
+    cache.Close()
@@ -0,0 +1,53 @@
+import os
+import numpy
+import pytest
+from multiprocessing import shared_memory
+
+import effis.composition as effis
+from effis.composition import channels
+from effis.composition.journal import Journal
+
+
+def Exists(segment):
+    try:
+        shm = shared_memory.SharedMemory(name=segment)
+    except FileNotFoundError:
+        return False
+    channels.Untrack(shm)
+    shm.close()
+    return True
+
+
+def test_publish_and_map(monkeypatch):
+    monkeypatch.setenv("EFFIS_CHANNELS", "testscope")
+    original = numpy.arange(12, dtype="int32").reshape(3, 4)
+    channels.Publish("grid", original)
+    channels.Close()
+    assert Exists(channels.SegmentName("grid", scope="testscope"))
+
+    view = channels.Channel("grid")
+    assert (view.shape, view.dtype) == ((3, 4), numpy.dtype("int32"))
+    assert numpy.array_equal(view, original)
+    assert not view.flags.writeable
+    del view
+    channels.Close()
+
+    channels.Free("grid", scope="testscope")
+    assert not Exists(channels.SegmentName("grid", scope="testscope"))
+    with pytest.raises(KeyError):
+        channels.Channel("grid")
+
+
+def test_between_applications(directory):
+    # Functions go to the workers by value; channels and numpy by reference, since the workers can import them
+    workflow = effis.Workflow(Runner=None, Directory=directory, Workers=2)
+    producer = workflow.Application(cmd="produce", Name="produce", Publishes=["field"], Function=lambda: channels.Publish("field", numpy.linspace(0, 1, 1000)) is not None)
+    consumer = workflow.Application(cmd="consume", Name="consume", DependsOn=[producer], Function=lambda: numpy.array(channels.Channel("field")))
+    workflow.Submit()
+
+    assert (producer.State, consumer.State) == ("COMPLETED", "COMPLETED")
+    assert numpy.array_equal(consumer.Result, numpy.linspace(0, 1, 1000))
+    # Freed once its only consumer was through
+    assert not Exists(channels.SegmentName("field", scope=channels.Scope(workflow.Directory)))
+    freed = [record for record in Journal.Read(workflow._journalname_) if record['event'] == "free"]
+    assert [(record['app'], record['channels']) for record in freed] == [("produce", ["field"])]
@@ -0,0 +1,73 @@
+import pytest
+
+import effis.composition as effis
+from effis.composition.runner import UseRunner
+from effis.composition.dag import DAG
+from effis.composition.scheduler import Finished
+
+
+def Diamond():
+    a = effis.Application(cmd="true", Name="a", Runner=None)
+    b = effis.Application(cmd="true", Name="b", Runner=None, DependsOn=[a])
+    c = effis.Application(cmd="true", Name="c", Runner=None, DependsOn=[a])
+    d = effis.Application(cmd="true", Name="d", Runner=None, DependsOn=[b, c])
+    return [a, b, c, d]
+
+
+def Names(graph):
+    names = []
+    app = graph.Pop()
+    while app is not None:
+        names += [app.Name]
+        app = graph.Pop()
+    return names
+
+
+def test_ready_once_dependencies_complete():
+    a, b, c, d = Diamond()
+    graph = DAG([a, b, c, d], Finished)
+    assert Names(graph) == ["a"]
+    graph.Complete(a)
+    assert Names(graph) == ["b", "c"]
+    graph.Complete(b)
+    assert Names(graph) == []
+    graph.Complete(c)
+    assert Names(graph) == ["d"]
+    graph.Complete(d)
+    assert graph.Done()
+
+
+def test_finished_applications_are_skipped():
+    a, b, c, d = Diamond()
+    super(UseRunner, a).__setattr__('Status', 0)
+    graph = DAG([a, b, c, d], Finished)
+    assert Names(graph) == ["b", "c"]
+    assert graph.Skip == {0}
+
+
+def test_cancel_and_drop():
+    a, b, c, d = Diamond()
+    graph = DAG([a, b, c, d], Finished)
+    Names(graph)
+    graph.Complete(a)
+    assert sorted(graph.Cancel(1)) == [3]
+    assert graph.Drop(2) == [2]
+    assert graph.Drop(2) == []
+    assert graph.Skip == {2, 3}
+
+
+def test_critical_path_first():
+    short = effis.Application(cmd="true", Name="short", Runner=None)
+    head = effis.Application(cmd="true", Name="head", Runner=None)
+    tail = effis.Application(cmd="true", Name="tail", Runner=None, DependsOn=[head])
+    graph = DAG([short, head, tail], Finished)
+    graph.CriticalPath([5, 1, 10])
+    assert Names(graph) == ["head", "short"]
+
+
+def test_cycle_is_an_error():
+    a = effis.Application(cmd="true", Name="a", Runner=None)
+    b = effis.Application(cmd="true", Name="b", Runner=None, DependsOn=[a])
+    a.DependsOn = [b]
+    with pytest.raises(ValueError):
+        DAG([a, b], Finished)
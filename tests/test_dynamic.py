@@ -0,0 +1,75 @@
+import os
+import time
+import pytest
+import dill as pickle
+
+import effis.composition as effis
+from effis.composition.journal import Journal
+from effis.composition.events import EventLoop
+from effis.composition.inbox import Inbox, SendApplication
+
+
+def Running(directory):
+    workflow = effis.Workflow(Runner=None, Directory=directory)
+    bad = workflow.Application(cmd="false", Name="bad")
+    good = workflow.Application(cmd="true", Name="good")
+    workflow.Application(cmd="sleep", Name="hold", CommandLineArguments=["0.5"])
+    workflow.Submit(wait=False)
+    while 'State' not in bad.__dict__ or bad.State == "RUNNING" or 'State' not in good.__dict__ or good.State == "RUNNING":
+        time.sleep(0.05)
+    return workflow, bad, good
+
+
+def test_added_after_failed_dependency_is_cancelled(directory):
+    workflow, bad, good = Running(directory)
+    after = workflow.AddApplication(cmd="true", Name="after", DependsOn=[bad])
+    later = workflow.AddApplication(cmd="true", Name="later", DependsOn=[after])
+    workflow.tid.join(timeout=10)
+
+    assert bad.State == "FAILED"
+    assert (after.State, later.State) == ("CANCELLED", "CANCELLED")
+    assert "Status" not in after.__dict__ or after.Status is None
+    cancelled = [record['app'] for record in Journal.Read(workflow._journalname_) if record['event'] == "cancel"]
+    assert sorted(cancelled) == ["after", "later"]
+
+
+def test_added_after_finished_dependency_runs(directory):
+    workflow, bad, good = Running(directory)
+    after = workflow.AddApplication(cmd="true", Name="after", DependsOn=[good])
+    workflow.tid.join(timeout=10)
+    assert after.State == "COMPLETED"
+
+
+def test_added_after_finish_is_an_error(directory):
+    workflow = effis.Workflow(Runner=None, Directory=directory)
+    workflow.Application(cmd="true", Name="first")
+    workflow.Submit()
+    with pytest.raises(RuntimeError):
+        workflow.AddApplication(cmd="true", Name="late")
+    assert os.listdir(workflow._inboxname_) == []
+
+
+def test_inbox_skips_vanished_files(tmp_path, monkeypatch):
+    path = str(tmp_path / "inbox")
+    for name in ("first", "gone", "second"):
+        SendApplication(path, effis.Application(cmd="true", Name=name, Runner=None))
+        time.sleep(0.01)
+    for name in os.listdir(path):
+        with open(os.path.join(path, name), 'rb') as handle:
+            if pickle.load(handle).Name == "gone":
+                gone = name
+
+    # Taken by someone else between the listing and looking at it
+    getmtime = os.path.getmtime
+    def Vanishing(name):
+        if os.path.basename(name) == gone:
+            os.remove(name)
+        return getmtime(name)
+    monkeypatch.setattr(os.path, "getmtime", Vanishing)
+
+    loop = EventLoop()
+    received = []
+    inbox = Inbox(loop, path, lambda app: received.append(app.Name))
+    inbox.Close()
+    loop.Close()
+    assert received == ["first", "second"]
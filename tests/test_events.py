@@ -0,0 +1,29 @@
+import pytest
+
+from effis.composition.events import EventLoop
+
+
+def test_raising_callback_keeps_rest_of_batch():
+    loop = EventLoop()
+    ran = []
+
+    def Bad():
+        raise ValueError("bad")
+
+    loop.Later(0, ran.append, "timer")
+    loop.Later(0, Bad)
+    loop.Later(0, ran.append, "due")
+    loop.Call(ran.append, "first")
+    loop.Call(Bad)
+    loop.Call(ran.append, "second")
+
+    # The later timers and all of the pending callbacks are put back, not dropped
+    with pytest.raises(ValueError):
+        loop.RunOnce()
+    assert ran == ["timer"]
+    with pytest.raises(ValueError):
+        loop.RunOnce()
+    assert ran == ["timer", "due", "first"]
+    loop.RunOnce()
+    assert ran == ["timer", "due", "first", "second"]
+    loop.Close()
@@ -0,0 +1,56 @@
+import os
+import socket
+import subprocess
+import threading
+
+import effis.composition as effis
+from effis.composition.executor import Executor
+from effis.composition.journal import AppendEvent
+
+
+def test_wait_ends_when_dependency_is_gone(tmp_path):
+    # A Runner=None Workflow whose process went away before writing its done marker
+    dep = effis.Workflow(Runner=None, Directory=str(tmp_path / "dep"), Name="dep")
+    dep.Application(cmd="true", Name="app")
+    dep.Create()
+    gone = subprocess.Popen(["true"])
+    gone.wait()
+    AppendEvent(dep._journalname_, "run", pid=gone.pid, host=socket.gethostname())
+
+    workflow = effis.Workflow(Runner=None, Directory=str(tmp_path / "after"), Name="after", DependsOn=[dep], MonitorInterval=0.1)
+    app = workflow.Application(cmd="true", Name="app")
+    workflow.Create()
+
+    executor = Executor(resources={'Nodes': 1, 'CoresPerNode': 1})
+    results = []
+    through = threading.Event()
+    executor.Submit(workflow, callback=lambda result: (results.append(result), through.set()))
+    thread = threading.Thread(target=executor.Run, daemon=True)
+    thread.start()
+    assert through.wait(timeout=5)
+    executor.Stop()
+    thread.join(timeout=5)
+
+    assert isinstance(results[0], RuntimeError) and "dep" in str(results[0])
+    assert "State" not in app.__dict__
+
+
+def test_runs_with_submitter_environment(tmp_path):
+    workflow = effis.Workflow(Runner=None, Directory=str(tmp_path / "workflow"), Name="env")
+    app = workflow.Application(cmd="sh", Name="app", CommandLineArguments=["-c", "echo $EFFIS_SUBMITTER > out.txt"])
+    workflow.Create()
+
+    executor = Executor(shared=False)
+    assert executor.Handle({'op': "status"})['resources'] is None
+    through = threading.Event()
+    executor.Submit(workflow, callback=lambda result: through.set(), environment={**os.environ, 'EFFIS_SUBMITTER': "client"})
+    thread = threading.Thread(target=executor.Run, daemon=True)
+    thread.start()
+    assert through.wait(timeout=5)
+    executor.Stop()
+    thread.join(timeout=5)
+
+    assert app.State == "COMPLETED"
+    with open(os.path.join(app.Directory, "out.txt")) as infile:
+        assert infile.read().strip() == "client"
+    assert "EFFIS_SUBMITTER" not in os.environ
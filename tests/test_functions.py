@@ -0,0 +1,49 @@
+import os
+import signal
+
+import effis.composition as effis
+
+
+# The Functions are passed by value (like anything defined in a script), since the workers can't import this module
+
+def test_result_and_exception(directory):
+    workflow = effis.Workflow(Runner=None, Directory=directory, Workers=1)
+    double = workflow.Application(cmd="double", Name="double", Function=lambda x, y=0: 2 * x + y, Args=[20], Kwargs={'y': 2})
+    broken = workflow.Application(cmd="broken", Name="broken", Function=lambda: 1 / 0, LogFile="broken.log")
+    after = workflow.Application(cmd="after", Name="after", Function=lambda: "still up", DependsOn=[double])
+    workflow.Submit()
+
+    assert (double.State, double.Result) == ("COMPLETED", 42)
+    assert (broken.State, broken.Status, broken.Result) == ("FAILED", 1, None)
+    with open(os.path.join(broken.Directory, "broken.log")) as infile:
+        assert "ZeroDivisionError" in infile.read()
+    assert (after.State, after.Result) == ("COMPLETED", "still up")
+
+
+def test_worker_reused(directory):
+    workflow = effis.Workflow(Runner=None, Directory=directory, Workers=1)
+    apps = []
+    for i in range(3):
+        apps += [workflow.Application(cmd="where", Name="where{0}".format(i), Environment={'WHICH': str(i)},
+                                      Function=lambda: (__import__("os").getpid(), __import__("os").getcwd(), __import__("os").environ['WHICH']))]
+    workflow.Submit()
+
+    pids = set([app.Result[0] for app in apps])
+    assert len(pids) == 1
+    assert os.getpid() not in pids
+    # Each call still gets its own Directory and Environment
+    assert [app.Result[1:] for app in apps] == [(app.Directory, str(i)) for i, app in enumerate(apps)]
+
+
+def test_worker_replaced_after_kill(directory):
+    workflow = effis.Workflow(Runner=None, Directory=directory, Workers=1, KillGrace=0.2)
+    before = workflow.Application(cmd="pid", Name="before", Function=lambda: __import__("os").getpid())
+    # The timeout allows for the worker starting up
+    stubborn = workflow.Application(cmd="stubborn", Name="stubborn", Timeout=3,
+                                    Function=lambda: (__import__("signal").signal(15, __import__("signal").SIG_IGN), __import__("time").sleep(10)))
+    after = workflow.Application(cmd="pid", Name="after", Function=lambda: __import__("os").getpid(), DependsOn=[before])
+    workflow.Submit()
+
+    assert (stubborn.State, stubborn.Status) == ("TIMEOUT", -signal.SIGKILL)
+    assert (before.State, after.State) == ("COMPLETED", "COMPLETED")
+    assert after.Result != before.Result
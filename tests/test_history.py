@@ -0,0 +1,34 @@
+import os
+import sqlite3
+
+import effis.composition as effis
+from effis.composition.history import History
+
+
+def Run(directory, history):
+    workflow = effis.Workflow(Runner=None, Directory=directory)
+    workflow.History = history
+    app = workflow.Application(cmd="true", Name="app")
+    workflow.Submit()
+    return app
+
+
+def test_off_by_default(directory):
+    Run(directory, effis.Workflow.History)
+    assert not os.path.exists(os.environ["EFFIS_HISTORY"])
+
+
+def test_records_runs(tmp_path):
+    path = str(tmp_path / "runs.sqlite")
+    for i in range(2):
+        app = Run(str(tmp_path / "run{0}".format(i)), path)
+
+    history = History(path)
+    estimate = history.Estimate(app)
+    history.Close()
+    assert estimate['Runs'] == 2
+    assert estimate['Exact']
+    assert estimate['Runtime'] is not None
+
+    # Rollback journal, not WAL: safe on network filesystems
+    assert sqlite3.connect(path).execute("PRAGMA journal_mode").fetchone()[0] == "delete"
@@ -0,0 +1,41 @@
+import dill as pickle
+
+import effis.composition as effis
+from effis.composition.runner import slurm
+from effis.composition.journal import Journal, AppendEvent
+
+
+def test_pickle_written_before_submit(directory, sbatch):
+    workflow = effis.Workflow(Runner=slurm(), Directory=directory)
+    workflow.Application(cmd="true", Name="app", Runner=None)
+    workflow.Submit(wait=False)
+    assert workflow.JobID == "1000"
+
+    # What the batch job would load if it started right away
+    with open(sbatch.read_text().split()[0], 'rb') as handle:
+        submitted = pickle.load(handle)
+    assert submitted.Wait is False
+
+
+def test_pickle_from_create_has_wait(directory):
+    workflow = effis.Workflow(Runner=None, Directory=directory)
+    workflow.Application(cmd="true", Name="app")
+    workflow.Create()
+    with open(workflow._picklename_, 'rb') as handle:
+        assert pickle.load(handle).Wait is True
+
+
+def test_read_skips_cut_off_record(tmp_path):
+    filename = str(tmp_path / "journal.jsonl")
+    journal = Journal(filename)
+    journal.Write("launch", app="first")
+    journal.Write("exit", app="first", status=0, sync=True)
+    journal.Close()
+    AppendEvent(filename, "done")
+    with open(filename, "a") as outfile:
+        outfile.write('{"event": "launch", "app": "sec')
+
+    records = Journal.Read(filename)
+    assert [record['event'] for record in records] == ["launch", "exit", "done"]
+    assert records[1]['status'] == 0
+    assert Journal.Read(str(tmp_path / "missing.jsonl")) == []
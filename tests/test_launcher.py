@@ -0,0 +1,101 @@
+import os
+
+import effis.composition as effis
+
+
+def test_wrapper_keeps_arguments_whole(tmp_path, directory):
+    setup = tmp_path / "setup.sh"
+    setup.write_text("export FOO=from-setup\n")
+
+    workflow = effis.Workflow(Runner=None, Directory=directory)
+    app = workflow.Application(cmd="sh", Name="app", SetupFile=str(setup), LogFile="log.txt")
+    app.CommandLineArguments = ["-c", "echo $FOO; echo second > out.txt"]
+    workflow.Submit()
+
+    assert app.State == "COMPLETED"
+    with open(os.path.join(app.Directory, "log.txt")) as infile:
+        assert infile.read().strip() == "from-setup"
+    assert os.path.exists(os.path.join(app.Directory, "out.txt"))
+
+
+def test_setup_without_shell_variable(tmp_path, directory, monkeypatch):
+    monkeypatch.delenv("SHELL", raising=False)
+    setup = tmp_path / "setup.sh"
+    setup.write_text("export FOO=from-setup\n")
+
+    workflow = effis.Workflow(Runner=None, Directory=directory)
+    app = workflow.Application(cmd="sh", Name="app", SetupFile=str(setup), LogFile="log.txt")
+    app.CommandLineArguments = ["-c", "echo $FOO"]
+    workflow.Submit()
+
+    assert app.State == "COMPLETED"
+    with open(os.path.join(app.Directory, "log.txt")) as infile:
+        assert infile.read().strip() == "from-setup"
+
+
+def test_group_max_while_launching(directory):
+    # Launches are in flight (off the loop) for a while before their processes are up; GroupMax has to count them
+    for resources in (None, {'Nodes': 1, 'CoresPerNode': 64}):
+        workflow = effis.Workflow(Runner=None, Directory=directory, GroupMax={'g': 1}, Resources=resources)
+        apps = [workflow.Application(cmd="sleep", CommandLineArguments=["0.2"], Name="sleep{0}".format(i), Group="g") for i in range(3)]
+        workflow.Submit()
+        starts = sorted([app.StartTime for app in apps])
+        assert starts[1] - starts[0] >= 0.2
+        assert starts[2] - starts[1] >= 0.2
+        directory += ".again"
+
+
+def Counting(tmp_path, name, extra=""):
+    # A setup file that notes every time it's sourced
+    setup = tmp_path / name
+    setup.write_text("echo sourced >> {0}\n{1}export FOO=from-setup\n".format(tmp_path / "sourced.txt", extra))
+    return str(setup)
+
+
+def Sourced(tmp_path):
+    if not (tmp_path / "sourced.txt").exists():
+        return 0
+    return len((tmp_path / "sourced.txt").read_text().splitlines())
+
+
+def Logged(app):
+    with open(os.path.join(app.Directory, "log.txt")) as infile:
+        return infile.read().strip()
+
+
+def test_snapshot_sourced_once(tmp_path, directory):
+    workflow = effis.Workflow(Runner=None, Directory=directory, SnapshotSetup=True)
+    setup = Counting(tmp_path, "setup.sh")
+    apps = [workflow.Application(cmd="sh", Name="app{0}".format(i), SetupFile=setup, LogFile="log.txt", CommandLineArguments=["-c", "echo $FOO"]) for i in range(3)]
+    other = workflow.Application(cmd="sh", Name="other", SetupFile=Counting(tmp_path, "more.sh", extra="true\n"), LogFile="log.txt", CommandLineArguments=["-c", "echo $FOO"])
+    workflow.Submit()
+
+    # Once for the (same content in each Application's) setup.sh, once for more.sh; no wrapper scripts
+    assert Sourced(tmp_path) == 2
+    for app in apps + [other]:
+        assert (app.State, Logged(app)) == ("COMPLETED", "from-setup")
+        assert not os.path.exists(os.path.join(app.Directory, "{0}.sh".format(app.Name)))
+
+
+def test_snapshot_falls_back_to_wrapper(tmp_path, directory):
+    # Sourcing fails the first time (the snapshot), and works from then on (the wrapper script)
+    workflow = effis.Workflow(Runner=None, Directory=directory, SnapshotSetup=True)
+    marker = tmp_path / "tried"
+    setup = Counting(tmp_path, "setup.sh", extra="[ -e {0} ] || {{ touch {0}; exit 1; }}\n".format(marker))
+    app = workflow.Application(cmd="sh", Name="app", SetupFile=setup, LogFile="log.txt", CommandLineArguments=["-c", "echo $FOO"])
+    workflow.Submit()
+
+    assert Sourced(tmp_path) == 2
+    assert (app.State, Logged(app)) == ("COMPLETED", "from-setup")
+    assert os.path.exists(os.path.join(app.Directory, "app.sh"))
+
+
+def test_snapshot_without_shell_variable(tmp_path, directory, monkeypatch):
+    monkeypatch.delenv("SHELL", raising=False)
+    workflow = effis.Workflow(Runner=None, Directory=directory, SnapshotSetup=True)
+    app = workflow.Application(cmd="sh", Name="app", SetupFile=Counting(tmp_path, "setup.sh"), LogFile="log.txt", CommandLineArguments=["-c", "echo $FOO"])
+    workflow.Submit()
+
+    assert Sourced(tmp_path) == 1
+    assert (app.State, Logged(app)) == ("COMPLETED", "from-setup")
+    assert not os.path.exists(os.path.join(app.Directory, "app.sh"))
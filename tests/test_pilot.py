@@ -0,0 +1,121 @@
+import os
+import time
+import asyncio
+
+import pytest
+
+import effis.composition as effis
+from effis.composition.runner import slurm
+from effis.composition.pilot import Pilot, Queue, Enqueue
+from effis.composition.journal import Journal
+from effis.runtime.EffisSubmit import LoadWorkflow
+
+
+@pytest.fixture(autouse=True)
+def Unallocated(monkeypatch):
+    for name in ("SLURM_JOB_ID", "SLURM_JOB_END_TIME", "SLURM_JOB_START_TIME"):
+        monkeypatch.delenv(name, raising=False)
+
+
+def Queued(directory, sbatch, setup=None):
+    workflow = effis.Workflow(Runner=slurm(), Directory=directory, Pilots=2)
+    first = workflow.Application(cmd="true", Name="first", Runner=None)
+    workflow.Application(cmd="true", Name="second", Runner=None, DependsOn=[first])
+    workflow.Application(cmd="true", Name="other", Runner=None)
+    if setup is not None:
+        setup(workflow)
+    workflow.Submit(wait=False)
+    assert len(sbatch.read_text().split()) == 2
+    return LoadWorkflow(directory, name=workflow.Name)
+
+
+def Launched(workflow):
+    return [(record['app'], record['worker']) for record in Journal.Read(workflow._journalname_) if record['event'] == "launch"]
+
+
+def test_pilot_drains_queue(directory, sbatch):
+    workflow = Queued(directory, sbatch)
+    pilot = Pilot(workflow)
+    assert pilot.Run()
+
+    queue = Queue(workflow._queuename_)
+    assert queue.Counts() == {"done": 3}
+    queue.Close()
+    assert sorted([name for name, worker in Launched(workflow)]) == ["first", "other", "second"]
+    assert all([worker == pilot.Worker for name, worker in Launched(workflow)])
+    assert os.path.exists(workflow._touchname_)
+
+
+def test_pilot_picks_up_after_others(directory, sbatch):
+    workflow = Queued(directory, sbatch)
+
+    # Another pilot ran "first", and is running "other"
+    queue = Queue(workflow._queuename_)
+    assert queue.Claim("elsewhere", 0) == 0
+    assert queue.Finish(0, 0) is False
+    assert queue.Claim("elsewhere", 2) == 0
+    queue.Beat("elsewhere")
+
+    pilot = Pilot(workflow)
+    pilot.PollInterval = 0.1
+    pilot.Start()
+    while "State" not in workflow.Applications[1].__dict__ or workflow.Applications[1].State == "RUNNING":
+        pilot.loop.RunOnce()
+    assert [name for name, worker in Launched(workflow)] == ["second"]
+    assert not pilot.Done()
+
+    # ... and finishes it, so this pilot is through too
+    assert queue.Finish(2, 0) is True
+    queue.Close()
+    while not pilot.Done():
+        pilot.loop.RunOnce()
+    pilot.Close()
+    assert [name for name, worker in Launched(workflow)] == ["second"]
+
+
+def test_pilot_retries_with_backoff(directory, sbatch):
+    def Setup(workflow):
+        flaky = workflow.Applications[2]
+        flaky.cmd = "sh"
+        flaky.CommandLineArguments = ["-c", "test -e flag || { touch flag; exit 1; }"]
+        flaky.Retries = 1
+        flaky.RetryBackoff = 0.3
+
+    workflow = Queued(directory, sbatch, setup=Setup)
+    assert Pilot(workflow).Run()
+    launches = [record['time'] for record in Journal.Read(workflow._journalname_) if (record['event'] == "launch") and (record['app'] == "other")]
+    assert len(launches) == 2
+    assert launches[1] - launches[0] >= 0.3
+
+
+def test_fill_leaves_claimed_tasks(directory, sbatch):
+    workflow = Queued(directory, sbatch)
+    queue = Queue(workflow._queuename_)
+    queue.Claim("elsewhere", 0)
+    Enqueue(workflow)
+    assert queue.States()[0][:2] == ("running", "elsewhere")
+    queue.Close()
+
+
+def test_deadline_from_walltime(directory, sbatch):
+    workflow = Queued(directory, sbatch, setup=lambda workflow: setattr(workflow, "Walltime", "10:00"))
+    pilot = Pilot(workflow)
+    assert abs(pilot.Deadline - (time.time() + 600)) < 5
+    pilot.Close()
+
+
+def test_submit_async_queues_for_pilots(directory, sbatch):
+    workflow = effis.Workflow(Runner=slurm(), Directory=directory, Pilots=2)
+    workflow.Application(cmd="true", Name="first", Runner=None)
+
+    async def Main():
+        await workflow.SubmitAsync()
+
+    asyncio.run(Main())
+    assert len(sbatch.read_text().split()) == 2
+    assert workflow.JobID == "1000"
+    queue = Queue(workflow._queuename_)
+    assert queue.Counts() == {"ready": 1}
+    queue.Close()
+    with open(workflow._pilotname_) as infile:
+        assert "effis-pilot run" in infile.read()
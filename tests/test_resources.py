@@ -0,0 +1,116 @@
+import sys
+import time
+import types
+import asyncio
+import subprocess
+
+import pytest
+
+import effis.composition as effis
+from effis.composition.resources import Pool, Request, MemoryMB, ProcessRSS
+
+
+def Sleepers(directory, count, resources, asynchronous=False):
+    workflow = effis.Workflow(Runner=None, Directory=directory)
+    workflow.Resources = resources
+    apps = [workflow.Application(cmd="sleep", CommandLineArguments=["0.3"], Name="sleep{0}".format(i)) for i in range(count)]
+    if asynchronous:
+        async def Main():
+            await workflow.SubmitAsync()
+            assert await workflow.WaitAsync(timeout=10)
+        asyncio.run(Main())
+    else:
+        workflow.Submit()
+    return sorted([app.StartTime for app in apps])
+
+
+def test_unthrottled_without_resources(directory):
+    starts = Sleepers(directory, 4, None)
+    assert starts[-1] - starts[0] < 0.25
+
+
+def test_admission_with_resources(directory):
+    starts = Sleepers(directory, 3, {'Nodes': 1, 'CoresPerNode': 1})
+    assert starts[1] - starts[0] >= 0.25
+    assert starts[2] - starts[1] >= 0.25
+
+
+def test_submit_async_uses_workflow_resources(tmp_path):
+    # Same as with Submit(): throttled by the Workflow's own Resources, and not at all without them
+    starts = Sleepers(str(tmp_path / "one"), 2, {'Nodes': 1, 'CoresPerNode': 1}, asynchronous=True)
+    assert starts[1] - starts[0] >= 0.25
+    starts = Sleepers(str(tmp_path / "all"), 4, None, asynchronous=True)
+    assert starts[-1] - starts[0] < 0.25
+
+
+def Ask(**options):
+    # Stands in for an Application with a parallel Runner
+    app = {'Name': "app", 'Runner': "srun", 'Function': None, 'Memory': None}
+    app.update(options)
+    return Request(types.SimpleNamespace(**app))
+
+
+def test_pool_places_across_nodes():
+    pool = Pool({'Nodes': 2, 'CoresPerNode': 4, 'GPUsPerNode': 0, 'MemoryPerNode': 1000})
+    first = pool.Acquire(Ask(Ranks=6))
+    assert [(node, cores) for node, cores, gpus, memory in first] == [(0, 4), (1, 2)]
+    assert pool.Acquire(Ask(Ranks=4)) is None
+    second = pool.Acquire(Ask(Ranks=2, CoresPerRank=1))
+    assert second == [(1, 2, 0, 0)]
+    pool.Release(first)
+    assert pool.Acquire(Ask(Ranks=4, RanksPerNode=2)) == [(0, 2, 0, 0), (1, 2, 0, 0)]
+
+
+def test_memory_settings():
+    assert MemoryMB(512) == 512
+    assert MemoryMB("512M") == 512
+    assert MemoryMB("2G") == 2048
+    assert MemoryMB("1.5gb") == 1536
+    assert MemoryMB("1024K") == 1
+    with pytest.raises(ValueError):
+        MemoryMB("lots")
+
+
+def test_pool_memory_and_oversized():
+    pool = Pool({'Nodes': 1, 'CoresPerNode': 4, 'GPUsPerNode': 0, 'MemoryPerNode': 1000})
+    held = pool.Acquire(Ask(Ranks=1, Memory="600M"))
+    assert pool.Acquire(Ask(Ranks=1, Memory=600)) is None
+
+    # More than the allocation has: only ever runs by itself
+    assert pool.Acquire(Ask(Ranks=16)) is None
+    pool.Release(held)
+    assert pool.Acquire(Ask(Ranks=16)) == [(0, 4, 0, 1000)]
+
+
+def test_admission_by_memory(directory):
+    # Room for either one's memory, not both, even with cores to spare
+    workflow = effis.Workflow(Runner=None, Directory=directory, Resources={'Nodes': 1, 'CoresPerNode': 4, 'MemoryPerNode': "1G"})
+    apps = [workflow.Application(cmd="sleep", CommandLineArguments=["0.3"], Name="sleep{0}".format(i), Memory="600M") for i in range(2)]
+    workflow.Submit()
+    starts = sorted([app.StartTime for app in apps])
+    assert starts[1] - starts[0] >= 0.25
+
+
+# Touches every page, so it's all resident
+Hog = "x = b'x' * (64 << 20); import time; time.sleep({0})"
+
+
+def test_process_rss_counts_descendants():
+    proc = subprocess.Popen(["sh", "-c", "{0} -c \"{1}\"; true".format(sys.executable, Hog.format(5))])
+    try:
+        start = time.time()
+        while (ProcessRSS(proc.pid) < 60) and (time.time() - start < 5):
+            time.sleep(0.05)
+        assert ProcessRSS(proc.pid) >= 60
+    finally:
+        proc.kill()
+        proc.wait()
+
+
+def test_peak_memory_sampled(directory):
+    workflow = effis.Workflow(Runner=None, Directory=directory, SampleMemory=0.05)
+    hog = workflow.Application(cmd=sys.executable, Name="hog", CommandLineArguments=["-c", Hog.format(0.5)])
+    small = workflow.Application(cmd="sleep", Name="small", CommandLineArguments=["0.5"])
+    workflow.Submit()
+    assert hog.PeakMemory >= 60
+    assert small.PeakMemory < 60
@@ -0,0 +1,164 @@
+import os
+import sys
+import time
+import signal
+import resource
+import subprocess
+
+import effis.composition as effis
+from effis.composition.journal import Journal
+
+
+def Events(workflow, event):
+    return [record for record in Journal.Read(workflow._journalname_) if record['event'] == event]
+
+
+def test_dependents_start_once_finished(directory):
+    workflow = effis.Workflow(Runner=None, Directory=directory)
+    first = workflow.Application(cmd="sleep", Name="first", CommandLineArguments=["0.2"])
+    second = workflow.Application(cmd="true", Name="second", DependsOn=[first])
+    other = workflow.Application(cmd="true", Name="other")
+    workflow.Submit()
+
+    assert [app.State for app in (first, second, other)] == ["COMPLETED"] * 3
+    assert second.StartTime >= first.EndTime
+    assert other.StartTime < first.EndTime
+
+
+def test_idle_while_waiting(directory):
+    workflow = effis.Workflow(Runner=None, Directory=directory)
+    workflow.Application(cmd="sleep", Name="sleep", CommandLineArguments=["0.5"])
+    before = resource.getrusage(resource.RUSAGE_SELF)
+    workflow.Submit()
+    after = resource.getrusage(resource.RUSAGE_SELF)
+    assert (after.ru_utime + after.ru_stime) - (before.ru_utime + before.ru_stime) < 0.2
+
+
+def test_longest_chain_starts_first(directory):
+    # One core, so whatever starts first holds up the rest; the chain through head is the longest
+    workflow = effis.Workflow(Runner=None, Directory=directory, Resources={'Nodes': 1, 'CoresPerNode': 1}, Priority="CriticalPath")
+    workflow.Application(cmd="true", Name="short", EstimatedRuntime=5)
+    head = workflow.Application(cmd="true", Name="head", EstimatedRuntime=1)
+    workflow.Application(cmd="true", Name="tail", EstimatedRuntime=10, DependsOn=[head])
+    workflow.Submit()
+    assert [record['app'] for record in Events(workflow, "launch")] == ["head", "tail", "short"]
+
+
+def test_timeout_escalates_to_sigkill(directory):
+    workflow = effis.Workflow(Runner=None, Directory=directory, Timeout=0.2, KillGrace=0.2)
+    stubborn = workflow.Application(cmd=sys.executable, Name="stubborn")
+    stubborn.CommandLineArguments = ["-c", "import signal, time; signal.signal(signal.SIGTERM, signal.SIG_IGN); time.sleep(10)"]
+    polite = workflow.Application(cmd="sleep", Name="polite", CommandLineArguments=["10"])
+    start = time.time()
+    workflow.Submit()
+
+    assert time.time() - start < 2
+    assert (stubborn.State, stubborn.Status) == ("TIMEOUT", -signal.SIGKILL)
+    assert (polite.State, polite.Status) == ("TIMEOUT", -signal.SIGTERM)
+    assert sorted([record['app'] for record in Events(workflow, "timeout")]) == ["polite", "stubborn"]
+
+def test_failure_cancels_only_downstream(directory):
+    workflow = effis.Workflow(Runner=None, Directory=directory)
+    bad = workflow.Application(cmd="false", Name="bad")
+    child = workflow.Application(cmd="true", Name="child", DependsOn=[bad])
+    grandchild = workflow.Application(cmd="true", Name="grandchild", DependsOn=[child])
+    independent = workflow.Application(cmd="true", Name="independent")
+    workflow.Submit()
+
+    assert (bad.State, child.State, grandchild.State, independent.State) == ("FAILED", "CANCELLED", "CANCELLED", "COMPLETED")
+    assert sorted([record['app'] for record in Events(workflow, "cancel")]) == ["child", "grandchild"]
+
+
+def test_retry_with_backoff(directory):
+    workflow = effis.Workflow(Runner=None, Directory=directory)
+    flaky = workflow.Application(cmd="sh", Name="flaky", Retries=2, RetryBackoff=0.2)
+    flaky.CommandLineArguments = ["-c", "test -e flag || { touch flag; exit 1; }"]
+    picky = workflow.Application(cmd="sh", Name="picky", Retries=2, RetryOn=[3], CommandLineArguments=["-c", "exit 1"])
+    workflow.Submit()
+
+    assert flaky.State == "COMPLETED"
+    launches = [record['time'] for record in Events(workflow, "launch") if record['app'] == "flaky"]
+    assert len(launches) == 2
+    assert launches[1] - launches[0] >= 0.2
+    assert picky.State == "FAILED"
+    assert len([record for record in Events(workflow, "launch") if record['app'] == "picky"]) == 1
+
+def Restartable(directory):
+    workflow = effis.Workflow(Runner=None, Directory=directory, Name="restartable")
+    first = workflow.Application(cmd="true", Name="first")
+    second = workflow.Application(cmd="sh", Name="second", DependsOn=[first])
+    second.CommandLineArguments = ["-c", "test -e {0} || exec sleep 30".format(os.path.join(os.path.dirname(directory), "ready"))]
+    workflow.Application(cmd="true", Name="third", DependsOn=[second])
+    return workflow
+
+
+def test_restart_after_kill_skips_finished(directory):
+    # Run in another process, and kill it (without any chance to clean up) while second is running
+    script = "import sys; sys.path.insert(0, {0!r}); from test_scheduler import Restartable; Restartable({1!r}).Submit()".format(os.path.dirname(__file__), directory)
+    run = subprocess.Popen([sys.executable, "-c", script])
+    journal = os.path.join(directory, "restartable.workflow.journal.jsonl")
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        launches = [record for record in Journal.Read(journal) if record['event'] == "launch"] if os.path.exists(journal) else []
+        if [record['app'] for record in launches] == ["first", "second"]:
+            break
+        time.sleep(0.05)
+    run.kill()
+    run.wait()
+    os.kill(launches[-1]['pid'], signal.SIGKILL)
+
+    open(os.path.join(os.path.dirname(directory), "ready"), "w").close()
+    workflow = Restartable(directory)
+    workflow.Submit(restart=True)
+    assert [app.State for app in workflow.Applications[1:]] == ["COMPLETED"] * 2
+    assert [record['app'] for record in Events(workflow, "launch")] == ["first", "second", "second", "third"]
+    assert Events(workflow, "restart")[0]['finished'] == 1
+    assert os.path.exists(workflow._touchname_)
+
+
+def Ensemble(directory, straggler):
+    # Three quick members, and one whose original and speculative copy (told apart by the directory it runs in) behave differently
+    workflow = effis.Workflow(Runner=None, Directory=directory, Speculate={'g': 2}, SpeculateAfter=0.75, KillGrace=0.2)
+    for i in range(3):
+        workflow.Application(cmd="sleep", Name="member{0}".format(i), Group="g", CommandLineArguments=["0.1"])
+    slow = workflow.Application(cmd="sh", Name="slow", Group="g", CommandLineArguments=["-c", straggler])
+    return workflow, slow
+
+
+def Gone(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return True
+    return False
+
+
+def test_speculative_copy_wins(directory):
+    workflow, slow = Ensemble(directory, "case $PWD in *.speculative) echo copy > out.txt; exit 0;; esac; exec sleep 30")
+    start = time.time()
+    workflow.Submit()
+
+    assert time.time() - start < 5
+    assert slow.State == "COMPLETED"
+    assert [record['app'] for record in Events(workflow, "speculate")] == ["slow"]
+    assert [record['app'] for record in Events(workflow, "speculative-win")] == ["slow"]
+    # The original was stopped, and the copy's directory took its place
+    assert Gone([record['pid'] for record in Events(workflow, "launch") if record['app'] == "slow"][0])
+    with open(os.path.join(slow.Directory, "out.txt")) as infile:
+        assert infile.read().strip() == "copy"
+    assert not os.path.exists(slow.Directory + ".speculative")
+
+
+def test_original_beats_speculative_copy(directory):
+    workflow, slow = Ensemble(directory, "case $PWD in *.speculative) exec sleep 30;; esac; sleep 0.6")
+    start = time.time()
+    workflow.Submit()
+
+    assert time.time() - start < 5
+    assert slow.State == "COMPLETED"
+    speculated = Events(workflow, "speculate")
+    assert [record['app'] for record in speculated] == ["slow"]
+    assert Events(workflow, "speculative-win") == []
+    # The copy was killed, and cleaned up after
+    assert Gone(speculated[0]['pid'])
+    assert not os.path.exists(slow.Directory + ".speculative")
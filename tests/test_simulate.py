@@ -0,0 +1,63 @@
+import effis.composition as effis
+from effis.composition.runner import srun
+
+
+def Simulated(**settings):
+    workflow = effis.Workflow(Runner=None, Name="simulated")
+    for name, value in settings.items():
+        setattr(workflow, name, value)
+    return workflow
+
+
+def Starts(workflow, resources=None):
+    report = workflow.Simulate(Resources=resources, verbose=False)
+    return {name: app['Start'] for name, app in report['Applications'].items()}
+
+
+def test_simulate_before_create():
+    workflow = effis.Workflow(Runner=None, Name="simulated")
+    first = workflow.Application(cmd="a", Name="first", Runner=None, EstimatedRuntime=2)
+    workflow.Application(cmd="b", Name="second", Runner=None, EstimatedRuntime=3, DependsOn=[first])
+    report = workflow.Simulate(verbose=False)
+    assert report['Makespan'] == 5
+    assert report['Applications']['second']['Start'] == 2
+
+
+def test_group_max():
+    workflow = effis.Workflow(Runner=None, Name="simulated", GroupMax={'g': 2})
+    for i in range(4):
+        workflow.Application(cmd="a", Name="member{0}".format(i), Runner=None, Group="g", EstimatedRuntime=1)
+    report = workflow.Simulate(verbose=False)
+    assert sorted([app['Start'] for app in report['Applications'].values()]) == [0, 0, 1, 1]
+
+
+def test_backfill_goes_around_waiting_application():
+    for backfill, expected in ((True, 0), (False, 20)):
+        workflow = Simulated(Backfill=backfill)
+        workflow.Application(cmd="a", Name="half", Runner=srun(), Ranks=2, EstimatedRuntime=10)
+        workflow.Application(cmd="b", Name="whole", Runner=srun(), Ranks=4, EstimatedRuntime=10)
+        workflow.Application(cmd="c", Name="small", Runner=srun(), Ranks=2, EstimatedRuntime=5)
+        starts = Starts(workflow, {'Nodes': 1, 'CoresPerNode': 4, 'GPUsPerNode': 0, 'MemoryPerNode': 1000})
+        assert starts['small'] == expected
+
+
+def test_backfill_stops_for_long_waiting_application():
+    # Small Applications ending at staggered times would keep half the cores busy forever
+    for wait, expected in ((None, 35), (5, 15)):
+        workflow = Simulated(BackfillWait=wait)
+        workflow.Application(cmd="a", Name="half", Runner=srun(), Ranks=2, EstimatedRuntime=10)
+        workflow.Application(cmd="b", Name="whole", Runner=srun(), Ranks=4, EstimatedRuntime=10)
+        for i in range(5):
+            workflow.Application(cmd="c", Name="small{0}".format(i), Runner=srun(), Ranks=2, EstimatedRuntime=15 if i == 0 else 10)
+        starts = Starts(workflow, {'Nodes': 1, 'CoresPerNode': 4, 'GPUsPerNode': 0, 'MemoryPerNode': 1000})
+        assert starts['whole'] == expected
+
+
+def test_critical_path_priority():
+    for priority, first in (("Order", "short"), ("CriticalPath", "head")):
+        workflow = Simulated(Priority=priority)
+        workflow.Application(cmd="a", Name="short", Runner=srun(), Ranks=1, EstimatedRuntime=5)
+        head = workflow.Application(cmd="b", Name="head", Runner=srun(), Ranks=1, EstimatedRuntime=1)
+        workflow.Application(cmd="c", Name="tail", Runner=srun(), Ranks=1, EstimatedRuntime=10, DependsOn=[head])
+        starts = Starts(workflow, {'Nodes': 1, 'CoresPerNode': 1, 'GPUsPerNode': 0, 'MemoryPerNode': 1000})
+        assert starts[first] == 0
@@ -0,0 +1,62 @@
+import time
+
+import effis.composition as effis
+from effis.composition.runner import slurm
+from effis.composition.scheduler import Scheduler
+from effis.composition.journal import Journal
+
+
+def Events(workflow, event):
+    return [record['app'] for record in Journal.Read(workflow._journalname_) if record['event'] == event]
+
+
+def test_deferred_past_deadline(directory, monkeypatch):
+    monkeypatch.setenv("SLURM_JOB_END_TIME", str(time.time() + 5))
+    workflow = effis.Workflow(Runner=None, Directory=directory, WalltimeMargin=0)
+    short = workflow.Application(cmd="true", Name="short", EstimatedRuntime=1)
+    long = workflow.Application(cmd="true", Name="long", EstimatedRuntime=30)
+    after = workflow.Application(cmd="true", Name="after", EstimatedRuntime=1, DependsOn=[short])
+    workflow.Create()
+
+    scheduler = Scheduler(workflow)
+    assert scheduler.Run() is False
+    assert scheduler.Stalled
+    assert (short.State, after.State) == ("COMPLETED", "COMPLETED")
+    assert "State" not in long.__dict__
+    assert Events(workflow, "defer") == ["long"]
+
+
+def test_stall_waits_for_retries(directory, monkeypatch):
+    monkeypatch.setenv("SLURM_JOB_END_TIME", str(time.time() + 5))
+    workflow = effis.Workflow(Runner=None, Directory=directory, WalltimeMargin=0)
+    workflow.Application(cmd="true", Name="long", EstimatedRuntime=30)
+    flaky = workflow.Application(cmd="sh", Name="flaky", EstimatedRuntime=1, Retries=1, RetryBackoff=0.2)
+    flaky.CommandLineArguments = ["-c", "test -e flag || { touch flag; exit 1; }"]
+    workflow.Create()
+
+    scheduler = Scheduler(workflow)
+    assert scheduler.Run() is False
+    assert flaky.State == "COMPLETED"
+    assert Events(workflow, "launch") == ["flaky", "flaky"]
+
+
+def test_continuation_job(directory, sbatch, monkeypatch):
+    monkeypatch.delenv("SLURM_JOB_END_TIME", raising=False)
+    monkeypatch.delenv("SLURM_JOB_ID", raising=False)
+    monkeypatch.setenv("SLURM_JOB_START_TIME", str(time.time() - 50))
+    workflow = effis.Workflow(Runner=slurm(), Directory=directory, Walltime="00:01:00", WalltimeMargin=0)
+    workflow.Application(cmd="true", Name="short", Runner=None, EstimatedRuntime=1)
+    workflow.Application(cmd="true", Name="long", Runner=None, EstimatedRuntime=30)
+    workflow.Create()
+
+    # What the batch job runs: the rest goes to a continuation job, picking up where this one left off
+    workflow.SubSubmit()
+    assert len(sbatch.read_text().split()) == 1
+    with open(workflow._submitname_) as infile:
+        assert "--restart" in infile.read()
+    continued = [record for record in Journal.Read(workflow._journalname_) if record['event'] == "continue"]
+    assert [(record['finished'], record['remaining']) for record in continued] == [(1, 1)]
+
+    # ... unless it made no progress
+    workflow.Continue()
+    assert len(sbatch.read_text().split()) == 1